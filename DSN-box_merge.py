@@ -1,6 +1,7 @@
 # MERGE 2 .csv Box archive files
 import sys
 import pandas as pd
+import DSN_manifest
 
 if len(sys.argv) > 2:
     box_file= sys.argv[1]
@@ -11,14 +12,15 @@ else:
 
 # Example usage: python DSN-box_merge.py box1.csv box2.csv
 
-box_df=pd.read_csv(box_file,header=None,skiprows=1,sep=',')
-if len(box_df.columns)<8:
-    cols_df=['UTC','SQM','lum','chisquared','moonalt','LST','sunalt']
-else:
-    cols_df=['UTC','SQM','lum','chisquared','moonalt','LST','sunalt','Skytemp']
-loc_df=pd.read_csv(loc_file,header=None,skiprows=1,sep=',')
-box_df=pd.concat([box_df,loc_df])
-box_df.drop_duplicates(inplace=True)
-box_df.columns=cols_df
-box_df.sort_values(by='UTC',inplace=True)    
+# columns by header name: UTC,SQM,lum,chisquared,moonalt,LST,sunalt
+# [,Skytemp][,qflag]; older archives without the newer columns get them
+# empty.  Rows of the new file (loc_file) replace rows of the same UTC.
+box_df=pd.read_csv(box_file,sep=',',dtype=str,keep_default_na=False)
+loc_df=pd.read_csv(loc_file,sep=',',dtype=str,keep_default_na=False)
+cols_df=list(box_df.columns)+[c for c in loc_df.columns if c not in box_df.columns]
+box_df=pd.concat([box_df,loc_df],ignore_index=True).reindex(columns=cols_df).fillna('')
+box_df.drop_duplicates(subset=['UTC'],keep='last',inplace=True)
+box_df.sort_values(by='UTC',inplace=True,kind='stable')
 box_df.to_csv(box_file,mode='w',header=cols_df,index=False)
+# refresh the merged file's entry in the per-site manifest
+DSN_manifest.update_file(box_file)
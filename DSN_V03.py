@@ -17,7 +17,6 @@ import datetime
 from datetime import date, time,  timedelta
 from datetime import datetime as dt
 import juliandate as jd
-import pytz  # for time zones
 import numpy as np
 from numpy import arange
 from numpy.polynomial import Polynomial as P
@@ -27,6 +26,7 @@ import csv
 import time
 import sys
 import re
+import json
 import astropy.units as u
 import astropy.coordinates as coord
 from astropy.time import Time
@@ -38,6 +38,15 @@ import ephem
 from fuzzywuzzy import fuzz, process
 from github import Github
 from pathlib import Path
+import DSN_manifest
+import DSN_qflag
+import DSN_stats
+import DSN_timecorr
+import DSN_validate
+import DSN_pyramid
+import DSN_binarchive
+import DSN_sqlstore
+import DSN_xlsx
 #
 # INITIALIZATIONS
 #
@@ -70,6 +79,11 @@ Stempc=np.zeros(nentries)
 volt=np.zeros(nentries)
 freq=np.zeros(nentries)
 moonalt=np.zeros(nentries)
+# per-file stage timings and counts, appended to RUN_METRICS (git-ignored)
+run_metrics={"version":version,"stages":{}}
+RUN_METRICS="DSNdata/RUN_METRICS.jsonl"
+NIGHTSpath="DSNdata/NIGHTS/" # per-site night tables, <site>_nights.csv
+PYRAMIDpath="DSNdata/PYRAMID/" # per-site 5m/1h/night aggregates (DSN_pyramid)
 # want the following set to True for pd columns w/o whines
 pd.options.mode.copy_on_write = True
 #     DSN SQM or TESS site Information
@@ -136,15 +150,18 @@ def mycurve_fit(x, y, ndata,degree):
 #***********************
 def tloc_ut(frame_sensor):
     df=frame_sensor.copy()
-# Arizona Timezone
-    arizona_tz = pytz.timezone("America/Phoenix")
-    df["Tloc"] = pd.to_datetime(df["Tloc"], format="%y%m%d%H%M")
-    df["Tloc"] = df["Tloc"].dt.tz_localize(arizona_tz)
-    df["UT"] = df["Tloc"].dt.tz_convert("UTC")
-    ut = df["UT"].dt.strftime('%Y-%m-%dT%H:%M:%S Z')
-    df["Tloc"]=df["Tloc"].dt.tz_localize(None)
-    df["UT"]=df["UT"].dt.tz_localize(None)
-    return ut,df
+# Arizona time: MST all year, UT-7; Tloc already datetime64 from DSN_xlsx
+    if not np.issubdtype(df["Tloc"].dtype,np.datetime64):
+        df["Tloc"] = DSN_timecorr.from_ns(DSN_timecorr.to_ns(df["Tloc"],fmt="%y%m%d%H%M"))
+    df["UT"] = DSN_timecorr.local_to_ut(df["Tloc"],DSN_timecorr.MST)
+    return df
+#***********************
+def run_timer(label,start_time):
+    """Print and record the seconds since start_time; returns a new start time."""
+    run_time = time.time()-start_time
+    print("+++ RUN time "+label+" (sec): ",np.around(run_time,2))
+    run_metrics["stages"][label]=round(run_time,3)
+    return time.time()
 #***************
 # lambda function center time on local midnight
 jdlam=(lambda jd : jd if jd<12 else jd-24)
@@ -344,19 +361,17 @@ if sensor_name == 'SQM1': # .xlsx data
         RHmax=50.
         Etempcmax=10.
 #        SQMmax=22.4
-        orig_cols = ['Tloc', 'Solar', 'Winds', 'Windd', 'Etempc', 'RH',
-                 'Barom', 'Precip','SQM', 'Stempc', 'Battery', 'Dtempc']
+        orig_cols = DSN_xlsx.LAYOUTS['Sugarloaf']
     else:
         RHmax=50.  # just in case we want other values for Bonita
         Etempcmax=10.
 #        SQMmax=22.4
-        orig_cols = ['Tloc', 'Precip', 'SQM', 'Stempc', 'Solar','Winds',
-                     'Windd','Etempc','RH','Barom', 'Battery', 'Dtempc']
-    frame_sensor=pd.read_excel(in_file,header=None, skiprows=head_skip)
-    frame_sensor.columns=orig_cols
-    frame_sensor.drop(['Solar','Windd','Barom','Precip','Stempc','Dtempc'],
-                      axis=1, inplace=True)
-    UT,frame_sensor = tloc_ut(frame_sensor)
+        orig_cols = DSN_xlsx.LAYOUTS['Bonita']
+# streamed, only Tloc/Winds/Etempc/RH/SQM/Battery; cached per workbook hash
+    xlsx_cache="/tmp/XLSX_CACHE" if "TESTING" in os.environ else DSN_xlsx.default_cache_dir()
+    frame_sensor=DSN_xlsx.read_sqm1(in_file,orig_cols,head_skip=head_skip,
+                                    cache_dir=xlsx_cache)
+    frame_sensor = tloc_ut(frame_sensor)
     # XLSX-only sanity filters (meteo)
     # Drop non-physical values: Etempc < -10 C, RH < 0
     # Log counts before/after with print()
@@ -407,19 +422,24 @@ if sensor_name == 'TESS1':
     frame_sensor.rename(
         columns={"mag":"SQM","Time":"Tloc","tsky":"Stempc",
                 "tamb":"Etempc"},inplace=True)
-    lenJ = len(frame_sensor)
-    local_time = [frame_sensor.Tloc.iloc[i] for i in range(lenJ)]
-# Localize the datetime object to your local timezone
-    local_time_aware = [local_time[i].tz_localize("America/Phoenix") for i in range(lenJ)]
-# Convert the localized datetime object to UTC
-    utc_time_John = [local_time_aware[i].tz_convert(None) for i in range(lenJ)]
-    frame_sensor.insert(0, "UT", utc_time_John)
+# local time is Arizona MST (UT-7)
+    frame_sensor.insert(0, "UT",
+        DSN_timecorr.local_to_ut(frame_sensor.Tloc,DSN_timecorr.MST))
 icount0=len(frame_sensor)
 # drop duplicates, as in OR data
 frame_sensor.drop_duplicates(inplace=True)
 icount=len(frame_sensor)
 print('Total number of data: ',icount,'dups dropped ',
       icount0-icount,' from ',in_file)
+# time order: inversions, duplicate UT, overlapping segments (concatenated
+# dumps) are sorted out here, DSN_VALIDATE=check reports and quits instead
+frame_sensor,validation=DSN_validate.validate(frame_sensor,'UT',
+                        fix=os.environ.get("DSN_VALIDATE","repair")!="check")
+print("Time order: ",DSN_validate.describe(validation))
+run_metrics["validate"]=validation
+if validation["inversions"]>0 and "removed" not in validation:
+    print('JD not monotonic, QUIT')
+    quit()
 #
 # correct UT for bad time shift
 UTC=frame_sensor.UT
@@ -430,47 +450,33 @@ nsite=np.full((icount),site_number)
 JD_midnight_2=np.full(icount,JD_midnight) # default is offset 7h to UT
 #
 if (site_number>1): # for AZ
-    df=frame_sensor[['UT','Tloc']]
-#    df["UT"] = pd.to_datetime(df["UT"], format="%Y-%m-%d %H:%M:%S")
-    df['UT'] = pd.to_datetime(df['UT'], utc=True)
-    df['Tloc'] = pd.to_datetime(df['Tloc']).dt.tz_localize('America/Phoenix')
-    df['Tloc_utc'] = df['Tloc'].dt.tz_convert('UTC')
-    # Now subtraction is valid
-    ut_tloc = (df['UT'] - df['Tloc_utc']) / pd.Timedelta(hours=1)
-#    ut_tloc=(pd.to_datetime(df.UT)-pd.to_datetime(df.Tloc))/\
-#            pd.Timedelta(hours=1)
-    ut_tloc_bad=np.where(ut_tloc!=0)[0]
-
-    if (len(ut_tloc_bad)>0):
-#        df.Tloc=pd.to_datetime(df.UT).dt.tz_localize('America/Phoenix')
-#        df.Tloc=df.Tloc.dt.tz_convert(None)        
-        frame_sensor.Tloc=df.Tloc
-    print("Adjusted ",len(ut_tloc_bad)," UT values for AZ")
+# UT is trusted: local times at another offset or off by more than
+# CLOCK_TOL_S are rebuilt from UT at MST
+    tloc_fixed,timecorr=DSN_timecorr.correct_local(frame_sensor.UT,
+                                                   frame_sensor.Tloc,DSN_timecorr.MST)
+    frame_sensor.Tloc=tloc_fixed
+    print("Adjusted ",timecorr["n_fixed"]," Tloc values for AZ")
+    print("Time check: ",DSN_timecorr.describe(timecorr))
+    run_metrics["timecorr"]=timecorr
 if (site_number==1): # for New Mexico
-    df=frame_sensor[['UT','Tloc']]
-    ut_tloc=(pd.to_datetime(df.UT)-pd.to_datetime(df.Tloc))/\
-            pd.Timedelta(hours=1)
-    ut_tloc_reg=np.where(ut_tloc==6)[0]
+# rows logged in MDT (UT-6) get the DST midnight; MST rows keep the default
+    off_h,_=DSN_timecorr.offsets(frame_sensor.UT,frame_sensor.Tloc)
+    ut_tloc_reg=np.where(off_h==DSN_timecorr.MDT)[0]
     JD_midnight_reg=np.around(JD_midnight-1./24.,6) # NM UT midnight for DST
     JD_midnight_2[ut_tloc_reg]=JD_midnight_reg
 #    ut_tloc_bad=np.where(ut_tloc!=6)[0]
 #    if (len(ut_tloc_bad)>0):
 #        df.Tloc=pd.to_datetime(df.UT).dt.tz_localize('Etc/GMT-6')
 #        df.Tloc=df.Tloc.dt.tz_convert(None)        
-    frame_sensor.Tloc=df.Tloc
     print("Adjusted ",len(ut_tloc_reg)," UT values for NM")
+    timecorr=DSN_timecorr.detect(frame_sensor.UT,frame_sensor.Tloc)
+    print("Time check: ",DSN_timecorr.describe(timecorr))
+    run_metrics["timecorr"]=timecorr
 #
 frame_sensor['JD_mid']=JD_midnight_2 # add JD_midnight value as new column
 UTC=frame_sensor.UT
 Tloc=frame_sensor.Tloc
 JD =pd.DatetimeIndex(frame_sensor['UT']).to_julian_date()
-if not JD.is_monotonic_increasing:
-    for i in range(len(JD)-1):
-        i1=i+1
-        if JD[i1]<JD[i]:
-            print(i,JD[i],JD[i1],Tloc[i],Tloc[i1],frame_sensor.iloc[i-5:i+5])
-    print('JD not monotonic, QUIT')
-    quit()
 
 # new altsun uses astropy sun routines
 sunalt = altsun1(tlat,tlong,tele,list(UTC)) # calculates the whole vector of values
@@ -579,10 +585,7 @@ if endstart != 0:
     print("Night mismatch: ",endstart)
 #
 #####################################
-run_time = time.time()-start_time
-print("+++ RUN time after filtering (sec): ",np.around(run_time,2))
-
-start_time=time.time()
+start_time=run_timer("after filtering",start_time)
 #if (site_number==3 or site_number==5 or site_number ==15 ): 
 # some SQM files use UTC-MST=6, wrong for AZ
 #    df=frame_sensor.copy()
@@ -628,9 +631,7 @@ if sensor_name == 'TESS' :
 #     ndata = 19 means cloud free for 45min on either side of 
 #     point for 1.5 hr total
 print("Number of points in cloud detection =",ndata)
-run_time = time.time()-start_time
-print("+++ RUN time just before cloud filter (sec): ",np.around(run_time,2))
-start_time = time.time() # time cloud filter
+start_time=run_timer("just before cloud filter",start_time) # time cloud filter
 #
 hndata = int((ndata-1)/2)
 # Deal with NO data, indicated by <=0 values
@@ -648,10 +649,7 @@ hndata = int((ndata-1)/2)
 # USE astropy moon routine, in altmoon1
 UTC_list=list(UTC)
 moonalt=altmoon1(tlat,tlong,tele,UTC_list)
-run_time = time.time()-start_time
-print("+++ RUN time after moonalt (sec): ",np.around(run_time,2))
-
-start_time=time.time()
+start_time=run_timer("after moonalt",start_time)
 # calculate MW altitude after discrimination for brightness limits,
 #  sun, moon, clouds
 #MWalt = altMW(tlat,tlong,tele,UTC_list)
@@ -710,9 +708,20 @@ for ii in range(inight):
         SQM[nn-hndata:nn],hndata,2)#dark[nn]) 
                          for nn in range(int(n3),int(ne)+1)]
 #
-run_time = time.time()-start_time
-print("+++ RUN time after cloud filter (sec): ",np.around(run_time,2))
-start_time=time.time()
+start_time=run_timer("after cloud filter",start_time)
+#
+# Quality flags: spikes and steps in SQM, per night, astronomical night
+# only (DSN_qflag), unless switched off for this sensor type
+qflag_params=DSN_qflag.qflag_params(sensor_name)
+if qflag_params:
+    qflag,qflag_counts=DSN_qflag.quality_flags(SQM,night_count,sunalt=sunalt,
+                                               **qflag_params)
+    print("Quality flags: ",qflag_counts["spike"]," spikes ",
+          qflag_counts["step"]," steps")
+    run_metrics["qflag"]=qflag_counts
+    start_time=run_timer("after quality flags",start_time)
+else:
+    print("Quality flags off for sensor ",sensor_name)
 #  Open the output file for writing
 # create output file name from input file
 # for influxDB
@@ -749,6 +758,8 @@ if sensor_name=="TESS":
     cols_df=['UTC','SQM','lum','chisquared','moonalt','LST','sunalt','Skytemp']
 else:
     cols_df=['UTC','SQM','lum','chisquared','moonalt','LST','sunalt']
+if qflag_params:
+    cols_df=cols_df+['qflag']
 df=pd.DataFrame(columns=cols_df)
 df.UTC=UTC_strip
 df.UTC = [dt.strptime(str(df.UTC.iloc[i]).split('+')[0],
@@ -771,9 +782,14 @@ df.SQM=np.around(df.SQM,3)
 df.sunalt=np.around(df.sunalt,3)
 if sensor_name=="TESS":
     df.Skytemp=np.around(Stempc,2)
+if qflag_params:
+    df.qflag=qflag
 #print(df.head())
 #
-for second in ['SQM','lum','chisquared','moonalt']:
+inf_fields=['SQM','lum','chisquared','moonalt']
+if qflag_params:
+    inf_fields=inf_fields+['qflag']
+for second in inf_fields:
     df1=df[['UTC',second]]
     df1.insert(0,'','')
     df1.insert(0,'','',allow_duplicates=True)
@@ -788,7 +804,7 @@ for second in ['SQM','lum','chisquared','moonalt']:
 #
 #   write header only for the first loop, when second=='SQM'
     df1.to_csv(influx_file,mode='a', header=(second=='SQM' and influx_new_file),index=False)
-print(version," ",version_date," Wrote ",4*len(df1)," entries to ",influx_file)
+print(version," ",version_date," Wrote ",len(inf_fields)*len(df1)," entries to ",influx_file)
 #print(df.head())
 #
 # Save the data to an archive file for Box.
@@ -798,6 +814,8 @@ if os.path.exists("DSNdata/BOX/"):
     df_out.to_csv(box_file,mode='w',header=cols_df,index=False)
     print(version," ",version_date," Wrote ",len(df)," entries to ",
           box_file)
+    # keep the per-site time-range manifest of DSNdata/BOX current
+    DSN_manifest.update_file(box_file)
 else:
     min_value = df['SQM'].min()
 # Find the index of the minimum value in SQM
@@ -807,4 +825,53 @@ else:
     df.to_csv("/tmp/TESTING.csv",mode='w',header=cols_df,index=False)
     print(version," ",version_date," Wrote ",len(df)," entries to ",
           "/tmp/TESTING.csv")
+#
+# Fixed-record binary archive per site (memmap readers), when DSNdata/BIN exists
+if os.path.exists(DSN_binarchive.BIN_DIR) and "TESTING" not in os.environ:
+    bin_site=DSN_manifest.site_prefix(site_names[site_number].strip())
+    bin_n,bin_how=DSN_binarchive.append(bin_site,df)
+    print(version," ",version_date," Wrote ",bin_n," records (",bin_how,") to ",
+          DSN_binarchive.bin_path(bin_site))
+    run_metrics["binarchive"]=bin_n
+#
+# SQL store (samples and nights tables), when DSNdata/dsn.sqlite exists
+if os.path.exists(DSN_sqlstore.DB_PATH) and "TESTING" not in os.environ:
+    sql_site=DSN_manifest.site_prefix(site_names[site_number].strip())
+    sql_con=DSN_sqlstore.connect()
+    sql_n,sql_lo,sql_hi=DSN_sqlstore.add_samples(sql_con,sql_site,df)
+    sql_con.close()
+    print(version," ",version_date," Stored ",sql_n," rows in ",DSN_sqlstore.DB_PATH)
+    run_metrics["sqlstore"]=sql_n
+start_time=run_timer("after writing",start_time) # Influx, Box, BIN, SQL writes
+#
+# Per-night table: dark samples, clear fraction, clear SQM median/darkest,
+# moon-down fraction, gap minutes; upserted on the night date
+nights_df=DSN_stats.night_table(df)
+nights_site=DSN_manifest.site_prefix(site_names[site_number].strip())
+if os.path.isdir("DSNdata") and "TESTING" not in os.environ:
+    nights_file=NIGHTSpath+nights_site+"_nights.csv"
+else:
+    nights_file="/tmp/"+nights_site+"_nights.csv"
+DSN_stats.upsert_nights(nights_file,nights_df)
+print("Wrote ",len(nights_df)," nights to ",nights_file)
+run_metrics["nights"]=len(nights_df)
+start_time=run_timer("after night table",start_time)
+#
+# 5-minute, hourly and nightly aggregates for long-range views; the nights
+# of this file are rebuilt
+pyramid_dir=PYRAMIDpath if os.path.isdir("DSNdata") and "TESTING" not in os.environ \
+    else "/tmp/PYRAMID/"
+pyramid_counts=DSN_pyramid.update(nights_site,df,directory=pyramid_dir)
+print("Pyramid ",pyramid_dir+nights_site,": ",pyramid_counts)
+run_metrics["pyramid"]=pyramid_counts
+start_time=run_timer("after pyramid",start_time)
+#
+# per-file timings and counts, one JSON line per run
+run_metrics.update(file=site_file,sensor=sensor_name,rows=len(df),
+                   utc=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"))
+metrics_file=RUN_METRICS if os.path.isdir("DSNdata") and "TESTING" not in os.environ \
+    else "/tmp/RUN_METRICS.jsonl"
+with open(metrics_file,'a') as mfile:
+    mfile.write(json.dumps(run_metrics)+"\n")
+print("Run metrics appended to ",metrics_file)
 # THE END
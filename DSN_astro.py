@@ -0,0 +1,115 @@
+# DSN_astro.py
+# Vectorized astronomy helpers for processed DSN data.
+# These work on whole numpy arrays with plain trigonometry, so they can
+# run over millions of rows without building astropy frames.
+import numpy as np
+import pandas as pd
+
+#----
+# North Galactic Pole, J2000 (deg)
+RA_NGP = 192.85948
+DEC_NGP = 27.12825
+#******************
+def zenith_mwlat(lst_hours, lat_deg):
+    """
+    Absolute galactic latitude |b| (deg) of the zenith.
+    The zenith has RA = LST and Dec = site latitude, so
+      sin b = sin(dec) sin(dec_NGP) + cos(dec) cos(dec_NGP) cos(RA - RA_NGP)
+    Using the apparent LST against the J2000 pole ignores precession
+    (< 0.4 deg for 2000-2030), far below the 20-50 deg MW cuts we apply.
+    Agrees with astropy's AltAz->Galactic transform to ~0.3 deg.
+    """
+    ra = np.radians(np.asarray(lst_hours, dtype=float) * 15.0)
+    dec = np.radians(np.asarray(lat_deg, dtype=float))
+    dg, ag = np.radians(DEC_NGP), np.radians(RA_NGP)
+    sinb = np.sin(dec)*np.sin(dg) + np.cos(dec)*np.cos(dg)*np.cos(ra - ag)
+    return np.abs(np.degrees(np.arcsin(np.clip(sinb, -1.0, 1.0))))
+#******************
+def julian_date(utc):
+    """Julian date (float array) of UTC times (strings, datetimes, Series)."""
+    t = pd.DatetimeIndex(pd.to_datetime(utc, utc=True)).tz_convert(None)
+    ns = np.asarray(t, dtype="datetime64[ns]").astype(np.int64)
+    return ns / 86400e9 + 2440587.5
+#******************
+def local_sidereal_time(utc, lon_deg):
+    """
+    Apparent local sidereal time (hours, 0-24) for east longitude lon_deg.
+    GMST (IAU 1982) plus the leading nutation term of the equation of the
+    equinoxes, taking UT1 = UTC; within ~1 s of astropy's
+    sidereal_time('apparent'), which DSN_V03 writes to the LST column.
+    """
+    d = julian_date(utc) - 2451545.0
+    T = d / 36525.0
+    gmst = 18.697374558 + 24.06570982441908*d + 0.000026*T*T
+    om = np.radians(125.04 - 0.052954*d)
+    L = np.radians(280.47 + 0.98565*d)
+    eps = np.radians(23.4393 - 0.0000004*d)
+    eqeq = (-0.000319*np.sin(om) - 0.000024*np.sin(2*L)) * np.cos(eps)
+    return np.mod(gmst + eqeq + np.asarray(lon_deg, dtype=float)/15.0, 24.0)
+#******************
+def sun_radec(utc):
+    """
+    Apparent solar RA, Dec (deg) from the Astronomical Almanac low-precision
+    formulae (~0.01 deg for 1950-2050).
+    """
+    n = julian_date(utc) - 2451545.0
+    L = 280.460 + 0.9856474*n
+    g = np.radians(357.528 + 0.9856003*n)
+    lam = np.radians(L + 1.915*np.sin(g) + 0.020*np.sin(2*g))
+    eps = np.radians(23.439 - 0.0000004*n)
+    ra = np.degrees(np.arctan2(np.cos(eps)*np.sin(lam), np.cos(lam)))
+    dec = np.degrees(np.arcsin(np.sin(eps)*np.sin(lam)))
+    return np.mod(ra, 360.0), dec
+#******************
+def sun_altitude(utc, lat_deg, lon_deg):
+    """
+    Geometric solar altitude (deg, no refraction), vectorized.
+    Matches astropy get_sun(...).transform_to(AltAz) to ~0.02 deg, which
+    is what DSN_V03 stores as sunalt.
+    """
+    ra, dec = sun_radec(utc)
+    ha = np.radians(local_sidereal_time(utc, lon_deg)*15.0 - ra)
+    phi, dec = np.radians(np.asarray(lat_deg, dtype=float)), np.radians(dec)
+    sinalt = np.sin(phi)*np.sin(dec) + np.cos(phi)*np.cos(dec)*np.cos(ha)
+    return np.degrees(np.arcsin(np.clip(sinalt, -1.0, 1.0)))
+#******************
+def moon_ecliptic(utc):
+    """
+    Geocentric ecliptic longitude, latitude (deg) and horizontal parallax
+    (deg) of the Moon, Astronomical Almanac low-precision series
+    (~0.3 deg in position for 1950-2050).
+    """
+    T = (julian_date(utc) - 2451545.0) / 36525.0
+    s = lambda a, b: np.sin(np.radians(a + b*T))
+    c = lambda a, b: np.cos(np.radians(a + b*T))
+    lam = (218.32 + 481267.881*T + 6.29*s(134.9, 477198.85) - 1.27*s(259.2, -413335.38)
+           + 0.66*s(235.7, 890534.23) + 0.21*s(269.9, 954397.70)
+           - 0.19*s(357.5, 35999.05) - 0.11*s(186.6, 966404.05))
+    beta = (5.13*s(93.3, 483202.03) + 0.28*s(228.2, 960400.87)
+            - 0.28*s(318.3, 6003.18) - 0.17*s(217.6, -407332.20))
+    hp = (0.9508 + 0.0518*c(134.9, 477198.85) + 0.0095*c(259.2, -413335.38)
+          + 0.0078*c(235.7, 890534.23) + 0.0028*c(269.9, 954397.70))
+    return np.mod(lam, 360.0), beta, hp
+#******************
+def moon_altitude(utc, lat_deg, lon_deg):
+    """
+    Topocentric lunar altitude (deg, no refraction), vectorized: the
+    geocentric position of moon_ecliptic() seen from the site (parallax
+    up to ~1 deg).  Within ~0.3 deg of astropy get_moon(...) in AltAz,
+    which DSN_V03 stores as moonalt.
+    """
+    lam, beta, hp = (np.radians(x) for x in moon_ecliptic(utc))
+    n = julian_date(utc) - 2451545.0
+    eps = np.radians(23.439 - 0.0000004*n)
+    # unit vector, equatorial
+    x = np.cos(beta)*np.cos(lam)
+    y = np.cos(eps)*np.cos(beta)*np.sin(lam) - np.sin(eps)*np.sin(beta)
+    z = np.sin(eps)*np.cos(beta)*np.sin(lam) + np.cos(eps)*np.sin(beta)
+    ra, dec = np.arctan2(y, x), np.arcsin(np.clip(z, -1.0, 1.0))
+    ha = np.radians(local_sidereal_time(utc, lon_deg)*15.0) - ra
+    phi = np.radians(np.asarray(lat_deg, dtype=float))
+    sinalt = np.sin(phi)*np.sin(dec) + np.cos(phi)*np.cos(dec)*np.cos(ha)
+    alt = np.arcsin(np.clip(sinalt, -1.0, 1.0))
+    # parallax in altitude: distance 1/sin(hp) Earth radii
+    topo = alt - np.arcsin(np.sin(hp)*np.cos(alt))
+    return np.degrees(topo)
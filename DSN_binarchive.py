@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_binarchive.py
+# Fixed-record binary archive of processed rows, one file per site:
+#   DSNdata/BIN/<site>.dsnb
+# A 32-byte header (MAGIC, version, record size) is followed by records of
+# the NumPy structured dtype RECORD, little endian, packed:
+#   utc int64 (ns since 1970, UTC), SQM float32, lum chisquared float64,
+#   moonalt LST sunalt Skytemp float32 (NaN if absent), flags uint8 (qflag
+#   bits, 0 if absent)
+# float32 holds the other fields at the decimals DSN_V03 rounds them to
+# (DECIMALS); lum and chisquared need more digits.  to_frame rounds back
+# to those decimals, so readers get the archive's values exactly.
+# Records are sorted by utc with no repeats, so readers np.memmap the file
+# and slice a time range with two binary searches: no parsing, and only
+# the pages of the slice are read.
+#
+# Writing is append-only: rows newer than the last record are appended.  A
+# batch reaching back into the archive (reprocessed or backfilled rows)
+# is merged once, rows of the batch replacing records of the same utc (as
+# DSN-box_merge does), and the file is replaced atomically.  A partial
+# record left at the end by an interrupted append is ignored by readers
+# and cut off by the next append.
+#
+# DSN_V03 appends its rows when DSNdata/BIN/ exists; DSN_generate_csv
+# --backend bin answers CSV requests from it.  The files are git-ignored:
+# the process workflow keeps them in the Actions cache and seeds them from
+# DSNdata/BOX_ANALYSIS when the cache has none.
+#
+# Usage:
+#   python DSN_binarchive.py build DSNdata/BOX_ANALYSIS/DSN019-S_*.csv [--dir DSNdata/BIN]
+#   python DSN_binarchive.py query DSN019-S --from 2024-01-01 --to 2024-02-01
+#   python DSN_binarchive.py info [DSN019-S ...]
+#
+#   from DSN_binarchive import read_range, to_frame
+#   rec = read_range("DSN019-S", "2020-01-01", "2025-01-01")   # memmap slice
+#   rec["SQM"].mean(); df = to_frame(rec)
+import os
+import sys
+import glob
+import struct
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+import DSN_manifest
+
+#----
+BIN_DIR = "DSNdata/BIN"
+SUFFIX = ".dsnb"
+MAGIC = b"DSNBIN\x00\x00"
+VERSION = 2
+HEADER_SIZE = 32
+FLOAT_FIELDS = ["SQM", "lum", "chisquared", "moonalt", "LST", "sunalt", "Skytemp"]
+WIDE_FIELDS = ("lum", "chisquared")          # float64: up to 9 significant digits
+# decimals of the processed archive columns (DSN_V03)
+DECIMALS = {"SQM": 3, "lum": 5, "chisquared": 5, "moonalt": 2, "LST": 5,
+            "sunalt": 3, "Skytemp": 2}
+RECORD = np.dtype([("utc", "<i8")] +
+                  [(c, "<f8" if c in WIDE_FIELDS else "<f4") for c in FLOAT_FIELDS] +
+                  [("flags", "u1")])
+#******************
+def bin_path(site, directory=BIN_DIR):
+    return os.path.join(directory, site + SUFFIX)
+#******************
+def _header():
+    head = MAGIC + struct.pack("<HH", VERSION, RECORD.itemsize)
+    return head + b"\x00" * (HEADER_SIZE - len(head))
+#******************
+def _check_header(path, head):
+    if len(head) < HEADER_SIZE or head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path}: not a DSN binary archive")
+    version, itemsize = struct.unpack("<HH", head[len(MAGIC):len(MAGIC)+4])
+    if version != VERSION or itemsize != RECORD.itemsize:
+        raise ValueError(f"{path}: version {version}/record {itemsize} bytes, "
+                         f"expected {VERSION}/{RECORD.itemsize}")
+#******************
+def records(df, ts_col="UTC"):
+    """Processed rows (Box archive columns) as sorted RECORD array, one per utc."""
+    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True, format="ISO8601")
+    ok = t.notna().to_numpy()
+    rec = np.zeros(int(ok.sum()), dtype=RECORD)
+    rec["utc"] = t[ok].dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    for c in FLOAT_FIELDS:
+        rec[c] = (pd.to_numeric(df[c], errors="coerce").to_numpy()[ok]
+                  if c in df.columns else np.nan)
+    if "qflag" in df.columns:
+        rec["flags"] = pd.to_numeric(df["qflag"], errors="coerce").fillna(0).to_numpy()[ok]
+    # sorted, the last of repeated utc wins
+    order = np.argsort(rec["utc"], kind="stable")
+    rec = rec[order]
+    last = np.concatenate((rec["utc"][1:] != rec["utc"][:-1], [True]))
+    return rec[last]
+#******************
+def open_site(site, directory=BIN_DIR):
+    """Read-only memmap of a site's records (empty array if no archive)."""
+    path = bin_path(site, directory)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=RECORD)
+    with open(path, "rb") as f:
+        _check_header(path, f.read(HEADER_SIZE))
+    n = (os.path.getsize(path) - HEADER_SIZE) // RECORD.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(n,))
+#******************
+def _ns(t):
+    t = pd.Timestamp(t)
+    return (t.tz_convert("UTC").tz_localize(None) if t.tzinfo else t).value
+#******************
+def read_range(site, start=None, end=None, directory=BIN_DIR):
+    """Records with start <= utc < end (naive = UTC), a slice of the memmap."""
+    mm = open_site(site, directory)
+    lo = 0 if start is None else int(np.searchsorted(mm["utc"], _ns(start), "left"))
+    hi = len(mm) if end is None else int(np.searchsorted(mm["utc"], _ns(end), "left"))
+    return mm[lo:max(lo, hi)]
+#******************
+def to_frame(rec):
+    """
+    RECORD array -> DataFrame with tz-aware UTC, float64 values at the
+    archive's decimals and qflag (copies).
+    """
+    df = pd.DataFrame({c: np.round(np.asarray(rec[c], dtype=np.float64), DECIMALS[c])
+                       for c in FLOAT_FIELDS})
+    df.insert(0, "UTC", pd.to_datetime(np.asarray(rec["utc"]), utc=True))
+    df["qflag"] = np.asarray(rec["flags"])
+    return df
+#******************
+def append(site, df, ts_col="UTC", directory=BIN_DIR, clear=False):
+    """
+    Add processed rows to a site's archive (see module header).  clear:
+    records in the rows' time range are dropped first (a reprocessed
+    range).  Returns (records appended or merged, "append" | "merge").
+    """
+    new = records(df, ts_col)
+    path = bin_path(site, directory)
+    os.makedirs(directory, exist_ok=True)
+    old = open_site(site, directory)
+    if len(new) == 0:
+        return 0, "append"
+    if len(old) == 0 or new["utc"][0] > old["utc"][-1]:
+        end = HEADER_SIZE + len(old) * RECORD.itemsize
+        mode = "r+b" if os.path.exists(path) else "wb"
+        with open(path, mode) as f:
+            if mode == "wb":
+                f.write(_header())
+            f.truncate(end)             # a partial record of an interrupted append
+            f.seek(end)
+            f.write(new.tobytes())
+        return len(new), "append"
+    # merge: records of the batch replace the same utc (clear: its range)
+    if clear:
+        keep = (old["utc"] < new["utc"][0]) | (old["utc"] > new["utc"][-1])
+    else:
+        keep = ~np.isin(old["utc"], new["utc"])
+    both = np.concatenate([np.asarray(old[keep]), new])
+    both = both[np.argsort(both["utc"], kind="stable")]
+    del old
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_header())
+            f.write(both.tobytes())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return len(new), "merge"
+#******************
+def build_files(paths, directory=BIN_DIR, site=None):
+    """append() from processed CSV files, in file order."""
+    for path in paths:
+        if path.endswith(DSN_manifest.DERIVED_SUFFIXES):
+            continue
+        df = pd.read_csv(path, dtype={"UTC": str})
+        label = site or DSN_manifest.site_prefix(os.path.basename(path))
+        n, how = append(label, df, directory=directory)
+        print(f"✅ {path}: {n} records ({how}) -> {bin_path(label, directory)}")
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="add processed Box-format CSV files")
+    b.add_argument("files", nargs="+")
+    b.add_argument("--site", help="default: file name prefix (DSN019-S)")
+    b.add_argument("--dir", default=BIN_DIR)
+    q = sub.add_parser("query", help="print records of one site as CSV")
+    q.add_argument("site")
+    q.add_argument("--from", dest="start")
+    q.add_argument("--to", dest="end")
+    q.add_argument("--dir", default=BIN_DIR)
+    i = sub.add_parser("info", help="records and time span per site")
+    i.add_argument("sites", nargs="*")
+    i.add_argument("--dir", default=BIN_DIR)
+    args = ap.parse_args()
+    if args.cmd == "build":
+        build_files(args.files, args.dir, args.site)
+    elif args.cmd == "query":
+        df = to_frame(read_range(args.site, args.start, args.end, args.dir))
+        df["UTC"] = df["UTC"].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        df.to_csv(sys.stdout, index=False)
+    else:
+        sites = args.sites or sorted(os.path.basename(p)[:-len(SUFFIX)]
+                                     for p in glob.glob(os.path.join(args.dir, "*" + SUFFIX)))
+        for s in sites:
+            mm = open_site(s, args.dir)
+            span = (f"{pd.Timestamp(int(mm['utc'][0]))} .. {pd.Timestamp(int(mm['utc'][-1]))}"
+                    if len(mm) else "empty")
+            print(f"{s}: {len(mm)} records, {span}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
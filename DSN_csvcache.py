@@ -0,0 +1,218 @@
+# DSN_csvcache.py
+# Range-set cache of normalized Influx CSV rows, one per label, for
+# DSN_generate_csv.py.
+#
+# DSNdata/CSV_CACHE/<label>/index.json lists the fetched segments:
+#   {"header": [...], "segments": [{"start", "stop", "fetched", "rows", "file"}]}
+# Each segment covers [start, stop) (ISO, UTC, as sent to Flux) and keeps
+# its rows in <file>.npz: "t" int64 ns UTC and "v" float64 (rows x cols),
+# NaN for empty cells.  Segments never overlap.  A request is answered by
+# slicing the cached segments; only the sub-ranges returned by missing()
+# go to Influx.  Recent data can still arrive after a fetch, so coverage
+# within SETTLE_DAYS of the fetch time is trusted for TTL_HOURS only and
+# is refetched (and the old rows trimmed) after that.
+#
+# Values are written back with the shortest round-trip decimal form
+# (np.format_float_positional(trim='-'), as Influx prints them); add()
+# checks the round trip and refuses to cache anything it cannot
+# reproduce byte for byte.
+import os
+import csv
+import json
+import tempfile
+import time
+import uuid
+import numpy as np
+import pandas as pd
+try:
+    import fcntl
+except ImportError:          # not on Windows; the lock is then a no-op
+    fcntl = None
+
+#----
+SETTLE_DAYS = 14    # data younger than this at fetch time may still change
+TTL_HOURS = 6       # how long such provisional coverage is trusted
+#******************
+def _ns(iso):
+    ts = pd.Timestamp(iso)
+    return (ts.tz_convert("UTC") if ts.tzinfo else ts.tz_localize("UTC")).value
+#******************
+def _iso(ns):
+    return pd.Timestamp(int(ns), unit="ns", tz="UTC").isoformat().replace("+00:00", "Z")
+#******************
+def format_values(col):
+    """float64 array -> list of strings, '' for NaN, no exponent."""
+    out = []
+    for v in col.tolist():
+        if v != v:
+            out.append("")
+            continue
+        s = repr(v)
+        if "e" in s or "inf" in s:
+            s = np.format_float_positional(v, trim="-")
+        elif s.endswith(".0"):
+            s = s[:-2]
+        out.append(s)
+    return out
+#******************
+def format_times(t):
+    """int64 ns -> RFC3339 strings as Influx writes them (fraction trimmed)."""
+    t = np.asarray(t, dtype=np.int64)
+    out = np.char.add(np.datetime_as_string(t.astype("datetime64[ns]"), unit="s"), "Z").tolist()
+    frac = np.flatnonzero(t % 1_000_000_000)
+    for i in frac:
+        s = np.datetime_as_string(t[i].astype("datetime64[ns]"), unit="ns")
+        out[i] = s.rstrip("0") + "Z"
+    return out
+#******************
+class RangeCache:
+    """
+    c = RangeCache("DSNdata/CSV_CACHE/DSN019-S_MtLemmon")
+    for s, e in c.missing(start_iso, stop_iso): fetch -> c.add(s, e, csv_path)
+    c.write_csv(start_iso, stop_iso, out_csv)
+    """
+    def __init__(self, directory, settle_days=SETTLE_DAYS, ttl_hours=TTL_HOURS):
+        self.dir = str(directory)
+        self.settle = int(settle_days * 86400e9)
+        self.ttl = ttl_hours * 3600.0
+        os.makedirs(self.dir, exist_ok=True)
+        self.index = self._load()
+    #----
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+    #----
+    def _load(self):
+        try:
+            with open(self._path("index.json"), "r", encoding="utf-8") as f:
+                idx = json.load(f)
+        except (OSError, ValueError):
+            idx = {}
+        idx.setdefault("header", None)
+        idx.setdefault("segments", [])
+        return idx
+    #----
+    def _save(self):
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=".index-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self._path("index.json"))
+    #----
+    def _locked(self):
+        f = open(self._path(".lock"), "a")
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+    #----
+    def _coverage(self, seg, now=None):
+        """[lo, hi) ns this segment can answer for right now."""
+        lo, hi = _ns(seg["start"]), _ns(seg["stop"])
+        now = time.time() if now is None else now
+        if now - seg["fetched"] > self.ttl:
+            hi = min(hi, int(seg["fetched"]) * 1_000_000_000 - self.settle)
+        return lo, max(lo, hi)
+    #----
+    def missing(self, start_iso, stop_iso):
+        """Sub-ranges of [start, stop) not answerable from the cache."""
+        lo, hi = _ns(start_iso), _ns(stop_iso)
+        covered = sorted(self._coverage(s) for s in self.index["segments"])
+        gaps, cur = [], lo
+        for a, b in covered:
+            if b <= cur or a >= hi:
+                continue
+            if a > cur:
+                gaps.append((cur, a))
+            cur = max(cur, b)
+        if cur < hi:
+            gaps.append((cur, hi))
+        return [(_iso(a), _iso(b)) for a, b in gaps]
+    #----
+    def _read(self, seg):
+        if not seg["rows"]:
+            return np.empty(0, np.int64), np.empty((0, len(self.index["header"]) - 1))
+        with np.load(self._path(seg["file"])) as z:
+            return z["t"], z["v"]
+    #----
+    def _write_seg(self, start_ns, stop_ns, t, v, fetched):
+        seg = {"start": _iso(start_ns), "stop": _iso(stop_ns), "fetched": fetched,
+               "rows": int(len(t)), "file": None}
+        if len(t):
+            seg["file"] = f"seg-{uuid.uuid4().hex[:12]}.npz"
+            np.savez_compressed(self._path(seg["file"]), t=t, v=v)
+        return seg
+    #----
+    def add(self, start_iso, stop_iso, csv_path):
+        """
+        Store the rows of a freshly fetched CSV covering [start, stop).
+        Overlapping (stale) parts of older segments are trimmed away.
+        Returns False (and caches nothing) if the CSV cannot be
+        reproduced exactly from the binary form.
+        """
+        df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+        header = list(df.columns)
+        t = pd.to_datetime(df.iloc[:, 0], utc=True, format="ISO8601").to_numpy("datetime64[ns]")
+        t = t.astype(np.int64)
+        v = np.column_stack([pd.to_numeric(df[c].replace("", np.nan), errors="coerce")
+                             .to_numpy(float) for c in header[1:]]) if len(header) > 1 \
+            else np.empty((len(df), 0))
+        if (np.diff(t) < 0).any():
+            return False
+        if format_times(t) != df.iloc[:, 0].tolist() or any(
+                format_values(v[:, j]) != df.iloc[:, j + 1].tolist() for j in range(v.shape[1])):
+            return False
+        lo, hi = _ns(start_iso), _ns(stop_iso)
+        with self._locked():
+            self.index = self._load()
+            if self.index["header"] != header:
+                self.clear()
+                self.index["header"] = header
+            keep = []
+            for seg in self.index["segments"]:
+                a, b = _ns(seg["start"]), _ns(seg["stop"])
+                if b <= lo or a >= hi:
+                    keep.append(seg)
+                    continue
+                # trim the part of the old segment that the new fetch replaces
+                st, sv = self._read(seg)
+                for pa, pb in ((a, min(b, lo)), (max(a, hi), b)):
+                    if pa < pb:
+                        m = (st >= pa) & (st < pb)
+                        keep.append(self._write_seg(pa, pb, st[m], sv[m], seg["fetched"]))
+                if seg["file"]:
+                    os.remove(self._path(seg["file"]))
+            keep.append(self._write_seg(lo, hi, t, v, time.time()))
+            self.index["segments"] = sorted(keep, key=lambda s: _ns(s["start"]))
+            self._save()
+        return True
+    #----
+    def clear(self):
+        for seg in self.index["segments"]:
+            if seg["file"]:
+                try:
+                    os.remove(self._path(seg["file"]))
+                except OSError:
+                    pass
+        self.index = {"header": None, "segments": []}
+    #----
+    def write_csv(self, start_iso, stop_iso, out_csv):
+        """
+        Write the cached rows in [start, stop) to out_csv (via .part and
+        rename), same layout as DSN_generate_csv.  Returns the row count.
+        """
+        lo, hi = _ns(start_iso), _ns(stop_iso)
+        part = f"{out_csv}.part"
+        n = 0
+        with open(part, "w") as f:
+            csv.writer(f, lineterminator="\n").writerow(self.index["header"])
+            for seg in self.index["segments"]:
+                a, b = _ns(seg["start"]), _ns(seg["stop"])
+                if b <= lo or a >= hi or not seg["rows"]:
+                    continue
+                t, v = self._read(seg)
+                i, j = np.searchsorted(t, lo, "left"), np.searchsorted(t, hi, "left")
+                if i >= j:
+                    continue
+                cols = [format_times(t[i:j])] + [format_values(v[i:j, k]) for k in range(v.shape[1])]
+                f.writelines(",".join(r) + "\n" for r in zip(*cols))
+                n += j - i
+        os.replace(part, out_csv)
+        return n
@@ -10,37 +10,19 @@ import argparse
 
 #----
 version="DSN_generate_analysis"
-version_date="06/26/2026"
+version_date="10/19/2026"
 print("DSN_generate_analysis.py version ",version_date)
 #----
 import json
 import glob
 import datetime
 from pathlib import Path
-from astropy.time import Time
-from astropy.coordinates import AltAz, EarthLocation, SkyCoord, get_sun
-import astropy.units as u
+from DSN_stats import observing_time_stats, write_stats
+from DSN_sketch import SketchGroups, EXACT_LIMIT
+from DSN_manifest import overlapping_files, DERIVED_SUFFIXES
+from DSN_inputs import ensure_derived
+from DSN_astro import zenith_mwlat
 
-#******************
-def altsun1(tlat,tlong,tele,utc):
-    sun_time = Time(utc) #UTC time
-    loc = EarthLocation.from_geodetic(tlong,tlat,tele)
-    altaz = AltAz(obstime=sun_time, location=loc)
-    alt_ang = get_sun(sun_time).transform_to(altaz).alt.degree
-    return alt_ang
-#******************
-# calculate galactic latitude of zenith at times utc
-# absolute galactic latitude |b| of the zenith
-def z_MWlat(tlat, tlong, tele, utc):
-    loc = EarthLocation.from_geodetic(
-        lon=tlong*u.deg, lat=tlat*u.deg, height=tele*u.m)
-    t = Time(utc, location=loc)
-    # Zenith in the local AltAz frame
-    zen_altaz = SkyCoord(
-        alt=90*u.deg, az=0*u.deg, frame=AltAz(obstime=t, location=loc))
-    # Convert to Galactic and return |b|
-    b = zen_altaz.galactic.b.to_value(u.deg)
-    return np.abs(b)
 #******************
 def ymd(d: str) -> str:
     # Accept YYYY-MM-DD (from Grafana) and return YYYYMMDD
@@ -51,7 +33,13 @@ parser.add_argument('--input_dir', required=True)
 parser.add_argument('--from', dest='from_time', required=True)
 parser.add_argument('--to', dest='to_time', required=True)
 parser.add_argument('--label', required=True)
+parser.add_argument('--sites', default='DSNsites.csv',
+                    help='site metadata (default ./DSNsites.csv)')
+parser.add_argument('--exact', action='store_true',
+                    help='exact medians for every group (no quantile sketches)')
 args = parser.parse_args()
+# per-group medians: exact below EXACT_LIMIT values, KLL sketch above
+sketch_limit = None if args.exact else EXACT_LIMIT
 
 in_dir = args.input_dir
 label = args.label
@@ -68,7 +56,7 @@ ymd_to   = ymd(args.to_time)
 outdir = Path(in_dir)
 #outdir.mkdir(parents=True, exist_ok=True)
 # Load site metadata
-sites_df = pd.read_csv("DSNsites.csv", comment='#', header=None,
+sites_df = pd.read_csv(args.sites, comment='#', header=None,
                        names=['lon', 'lat', 'el', 'sensor', 'ihead', 'dark',
                               'bright', 'label'])
 sites_df['label'] = sites_df['label'].astype(str).str.strip()
@@ -82,87 +70,19 @@ try:
     el = site_info['el']
     latlonel='Lon '+str(lon)+' Lat '+str(lat)+' El '+str(el)+' m'
 except IndexError:
-    raise ValueError(f"Label {label} not found in DSNsites.csv")
+    raise ValueError(f"Label {label} not found in {args.sites}")
 
 print(f"📁 Reading from {in_dir} for label {label}")
-all_files = [f for f in os.listdir(in_dir) if f.startswith(label) and f.endswith('.csv') and not f.endswith('_monthly_points.csv')]
+# consult <label>_manifest.json: open only files overlapping [from, to]
+# (tables this script writes back into the same directory are skipped)
+all_files = overlapping_files(in_dir, label, start_time, end_time,
+                              exclude=DERIVED_SUFFIXES)
 if not all_files:
-    raise FileNotFoundError(f"No files matching {label}_*.csv found in {in_dir}")
+    raise FileNotFoundError(f"No files matching {label}_*.csv overlap {time_range_label} in {in_dir}")
 
 num_files=len(all_files)
-print(f"📄 Found {num_files} files: {all_files}")
-
-df_list = []
-for file in all_files:
-    filepath = os.path.join(in_dir, file)
-    try:
-        df = pd.read_csv(filepath, comment='#', sep=None, engine='python')
-        df['sourcefile'] = file
-        df_list.append(df)
-    except Exception as e:
-        print(f"⚠️ Skipping {file}: {e}")
-
-df_all = pd.concat(df_list, ignore_index=True)
-df_all = df_all.rename(columns={
-    "time (UT)": "UTC",
-    "rad (mag/sq asec)": "SQM",
-    "rad nW/cm2/sr": "lum",
-    "chisquared": "chisquared",
-    "Moon alt (deg)": "moonalt"
-})
-
-# Debug: print column order and sample data
-print(f"Columns in df_all: {df_all.columns.tolist()}")
-if len(df_all) > 0:
-    print(f"Sample row:\n{df_all.iloc[0]}")
-
-if 'UTC' in df_all.columns:
-    df_all['UTC'] = pd.to_datetime(df_all['UTC'], utc=True, errors='coerce')
-    df_all = df_all.dropna(subset=['UTC'])
-    df_all = df_all[(df_all['UTC'] >= start_time) & (df_all['UTC'] <= end_time)]
-    UTC=df_all['UTC']
-else:
-    raise ValueError("Missing UTC column")
+print(f"📄 Found {num_files} files overlapping the range: {all_files}")
 
-# Stats
-def gap_corrected_hours(df, ts_col="UTC", q=10, tol=1.25):
-    """
-    Sum only 'continuous' intervals:
-      - Estimate cadence as the q-th percentile of positive diffs (sec)
-      - Keep diffs in (0, cadence*tol]
-      - Robust fallbacks if cadence is 0/NaN
-    Returns hours (float).
-    """
-    if df.empty:
-        return 0.0
-
-    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True).sort_values()
-    t = t[t.notna()]
-    if len(t) < 2:
-        return 0.0
-
-    diffs = t.diff().dt.total_seconds().to_numpy()[1:]  # skip first NaN
-    diffs = diffs[np.isfinite(diffs) & (diffs > 0)]
-    if diffs.size == 0:
-        return 0.0
-
-    # cadence estimate: small-but-robust
-    cadence = np.percentile(diffs, q)
-    if not np.isfinite(cadence) or cadence <= 0:
-        cadence = np.min(diffs)  # fallback
-    if not np.isfinite(cadence) or cadence <= 0:
-        return 0.0
-
-    max_allowed = cadence * tol
-    keep = diffs[(diffs > 0) & (diffs <= max_allowed)]
-    seconds = keep.sum()
-
-    # last-ditch fallback: if still zero but we do have diffs, clip at 95th pct
-    if seconds == 0 and diffs.size > 0:
-        cap = np.percentile(diffs, 95)
-        seconds = diffs[diffs <= cap].sum()
-
-    return seconds / 3600.0
 #
 def _filtered_sqm(df, moon_thr=-10.0, chi_thr=0.009, MW_thr=50.):
     """
@@ -192,26 +112,115 @@ def _filtered_sqm(df, moon_thr=-10.0, chi_thr=0.009, MW_thr=50.):
 moon_thr=-10.
 MW_thr=20.
 chi_thr=0.009
-#df_local = df_all.copy()
-df_all['Local'] = df_all['UTC'].dt.tz_convert('America/Phoenix')
-df_all['Date'] = df_all['Local'].dt.date
-# Total (gap-aware)
-run_hours = gap_corrected_hours(df_all, ts_col="UTC")
-# Night only (sunalt <= -18)
-df_all['sunalt']=altsun1(lat,lon,el,list(UTC))
-df_all = df_all[df_all['sunalt'] <= -18]
-UTC=df_all['UTC']
-night_hours = gap_corrected_hours(df_all, ts_col="UTC")
-#run_hours = (df_all['UTC'].iloc[-1]-df_all['UTC'].iloc[0]).total_seconds()/3600
-#night_hours = night_seconds / 3600.0
-pct_night = 100 * night_hours / run_hours if run_hours else 0
+bin_hours = 10.0/60.0   # LST bins (10 minutes)
+#
+def _night_rows(df):
+    """Night rows (sunalt <= -18) with MWlat, the zenith |b| from LST."""
+    d = df[df['sunalt'] <= -18]
+    if 'MWlat' not in d.columns:
+        d = d.assign(MWlat=zenith_mwlat(d['LST'], lat))
+    return d
+#
+def _month_rows(df):
+    """Filtered night rows with numeric SQM/MWlat and their MST month_start (Plot 6)."""
+    m = _filtered_sqm(_night_rows(df), moon_thr=-10.0, chi_thr=0.009, MW_thr=MW_thr)
+    if m.empty:
+        return m
+    # Ensure Local exists (MST)
+    if "Local" not in m.columns:
+        m["Local"] = pd.to_datetime(m["UTC"], utc=True).dt.tz_convert("America/Phoenix")
+    m["SQM"] = pd.to_numeric(m["SQM"], errors="coerce")
+    m["MWlat"] = pd.to_numeric(m["MWlat"], errors="coerce")
+    m = m.dropna(subset=["Local", "SQM", "MWlat"]).copy()
+    # Month grouping in MST, using month-start timestamps (tz-naive for plotting stability)
+    m["month_start"] = m["Local"].dt.tz_localize(None).dt.to_period("M").dt.to_timestamp(how="start")
+    return m
 #
-# FIX: Convert chisquared to numeric before comparison
-night_cl = df_all[pd.to_numeric(df_all['chisquared'], errors='coerce') <= 0.009]
-non_cloud_hours = gap_corrected_hours(night_cl, ts_col="UTC")
-percent_le_0009 = 100 * non_cloud_hours/night_hours if night_hours > 0 else 0
-# MW lats
-df_all['MWlat']=z_MWlat(lat,lon,el,list(UTC))
+def _lst_rows(df):
+    """Night rows for the LST-folded plot, with LST in [0,24) h and its bin centre."""
+    d = _night_rows(df).copy()
+    d["SQM"] = pd.to_numeric(d["SQM"], errors="coerce")
+    d["chisquared"] = pd.to_numeric(d["chisquared"], errors="coerce")
+    d["moonalt"] = pd.to_numeric(d["moonalt"], errors="coerce")
+    d = d[
+        (d["chisquared"] < 0.09) &
+        (d["moonalt"] < -10.0) &
+        (d["SQM"].notna()) &
+        (d["SQM"] <= 23.0) &
+        (d["UTC"].notna())
+    ].copy()
+    # LST (hours) already on every row (ensure_derived)
+    d["LST"] = np.mod(d["LST"].to_numpy(dtype=float), 24.0)
+    d["bin"] = (np.floor(d["LST"] / bin_hours) * bin_hours) + (bin_hours/2.0)
+    return d
+
+# columns kept from each file for the stats and plots below
+KEEP_COLS = ["UTC", "SQM", "chisquared", "moonalt", "sunalt", "LST"]
+LST_REQUIRED = ("SQM", "chisquared", "moonalt", "UTC")
+# (site, month) and (site, LST bin) median sketches are built file by
+# file and merged, so they never see the concatenated rows
+month_sk = SketchGroups(exact_limit=sketch_limit)
+lst_sk = SketchGroups(exact_limit=sketch_limit)
+derived = {}
+df_list = []
+for file in all_files:
+    filepath = os.path.join(in_dir, file)
+    try:
+        df = pd.read_csv(filepath, comment='#', sep=None, engine='python')
+    except Exception as e:
+        print(f"⚠️ Skipping {file}: {e}")
+        continue
+    df = df.rename(columns={
+        "time (UT)": "UTC",
+        "rad (mag/sq asec)": "SQM",
+        "rad nW/cm2/sr": "lum",
+        "chisquared": "chisquared",
+        "Moon alt (deg)": "moonalt"
+    })
+    if 'UTC' not in df.columns:
+        print(f"⚠️ Skipping {file}: no UTC column")
+        continue
+    df['UTC'] = pd.to_datetime(df['UTC'], utc=True, errors='coerce')
+    df = df.dropna(subset=['UTC'])
+    df = df[(df['UTC'] >= start_time) & (df['UTC'] <= end_time)].copy()
+    # sunalt and LST: reuse the archived columns (DSN_V03 writes both), compute
+    # vectorized only what is missing or invalid (e.g. Influx exports)
+    for col, st in ensure_derived(df, lat, lon).items():
+        derived.setdefault(col, set()).add(st)
+    rows = _month_rows(df)
+    if len(rows):
+        month_sk.update(rows.assign(site=label), ["site", "month_start"], "SQM")
+    if all(c in df.columns for c in LST_REQUIRED):
+        rows = _lst_rows(df)
+        if len(rows):
+            lst_sk.update(rows.assign(site=label), ["site", "bin"], "SQM")
+    df_list.append(df[[c for c in KEEP_COLS if c in df.columns]])
+
+if not df_list:
+    raise ValueError("Missing UTC column")
+df_all = pd.concat(df_list, ignore_index=True)
+del df_list
+
+# Debug: print column order and sample data
+print(f"Columns in df_all: {df_all.columns.tolist()}")
+if len(df_all) > 0:
+    print(f"Sample row:\n{df_all.iloc[0]}")
+UTC=df_all['UTC']
+print("🧭 Derived columns: " + ", ".join(f"{c} {'/'.join(sorted(st))}" for c, st in derived.items()))
+# run/night/clear hours and the per-night, per-month tables from a
+# single sorted pass (DSN_stats)
+obs_stats, nights_tab, months_tab = observing_time_stats(
+    df_all, ts_col="UTC", sunalt=df_all['sunalt'], chi_thr=0.009)
+run_hours = obs_stats['run_hours']
+night_hours = obs_stats['night_hours']
+pct_night = obs_stats['pct_night']
+percent_le_0009 = obs_stats['pct_clear']
+stats_files = write_stats(outdir, label, obs_stats, nights_tab, months_tab)
+print(f"📊 Wrote {len(nights_tab)} nights, {len(months_tab)} months to "
+      f"{', '.join(p.name for p in stats_files)}")
+# Night only (sunalt <= -18), MW lats (zenith |b| from LST)
+df_all = _night_rows(df_all)
+UTC=df_all['UTC']
 summary_html = f"""
 <h2>1. Summary Statistics</h2>
 <ul>
@@ -222,6 +231,9 @@ summary_html = f"""
   <li><b>Night Hours (sunalt<-18):</b> {night_hours:.1f}</li>
   <li><b>Run Hours percentage:</b> {pct_night:.1f}%</li>
   <li><b>Percentage w/o clouds:</b> {percent_le_0009:.1f}%</li>
+  <li><b>Nights:</b> {len(nights_tab)} (<a href="{label}_nights.csv">per-night</a>,
+      <a href="{label}_months.csv">per-month</a>,
+      <a href="{label}_stats.json">JSON</a>)</li>
 </ul>
 <h2>2. Night Sky Brightness (NSB) plots (interactive)</h2>
 """
@@ -545,34 +557,23 @@ if 'chisquared' in df_all.columns:
 # where the monthly median SQM occurs (nearest sample).
 # -------------------------------
 try:
-    if "UTC" not in df_use.columns:
-        raise ValueError("df_use missing UTC column for monthly plot.")
-
-    _m = df_use.copy()
-    # Ensure Local exists (MST)
-    if "Local" not in _m.columns:
-        _m["Local"] = pd.to_datetime(_m["UTC"], utc=True).dt.tz_convert("America/Phoenix")
-
-    _m["SQM"] = pd.to_numeric(_m["SQM"], errors="coerce")
-    _m["MWlat"] = pd.to_numeric(_m["MWlat"], errors="coerce")
-
-    _m = _m.dropna(subset=["Local", "SQM", "MWlat"]).copy()
+    # filtered rows again for the sample nearest each month's median
+    _m = _month_rows(df_all)
     if _m.empty:
         raise ValueError("No data left for monthly plot after filtering/NaN drops.")
 
-    # Month grouping in MST, using month-start timestamps (tz-naive for plotting stability)
-    _m["month_start"] = _m["Local"].dt.tz_localize(None).dt.to_period("M").dt.to_timestamp(how="start")
-
-    rows = []
-    for ms, g in _m.groupby("month_start"):
-        sqm_med = float(g["SQM"].median())
-        # pick the sample closest to the monthly median SQM (ties -> first)
-        j = (g["SQM"] - sqm_med).abs().idxmin()
-        t_med = g.loc[j, "Local"]              # timezone-aware MST
-        mw_at = float(g.loc[j, "MWlat"])       # MWlat at that timestamp
-        rows.append((ms, t_med, sqm_med, mw_at))
-
-    monthly_pts = pd.DataFrame(rows, columns=["month_start", "time", "SQM_median", "MWlat_at_median"])
+    # monthly medians from the (site, month) sketches merged while loading
+    med = month_sk.table(["site", "month_start"]).set_index("month_start")["median"]
+    # pick the sample closest to the monthly median SQM (ties -> first)
+    _m = _m.reset_index(drop=True)
+    _m["dist"] = (_m["SQM"] - _m["month_start"].map(med)).abs()
+    j = _m.groupby("month_start")["dist"].idxmin()
+    monthly_pts = pd.DataFrame({
+        "month_start": j.index,
+        "time": _m.loc[j.values, "Local"].to_numpy(),  # timezone-aware MST
+        "SQM_median": med.loc[j.index].to_numpy(dtype=float),
+        "MWlat_at_median": _m.loc[j.values, "MWlat"].to_numpy(dtype=float),
+    })
     monthly_pts = monthly_pts.sort_values("month_start").reset_index(drop=True)
 
     # Save for external matplotlib use
@@ -630,39 +631,20 @@ try:
         if c not in df_all.columns:
             raise ValueError("Missing one or more required columns for LST plot (SQM, chisquared, moonalt, UTC).")
 
-    # Filter rows
-    df_lst = df_all.copy()
-    df_lst["SQM"] = pd.to_numeric(df_lst["SQM"], errors="coerce")
-    df_lst["chisquared"] = pd.to_numeric(df_lst["chisquared"], errors="coerce")
-    df_lst["moonalt"] = pd.to_numeric(df_lst["moonalt"], errors="coerce")
-
-    df_lst = df_lst[
-        (df_lst["chisquared"] < 0.09) &
-        (df_lst["moonalt"] < -10.0) &
-        (df_lst["SQM"].notna()) &
-        (df_lst["SQM"] <= 23.0) &
-        (df_lst["UTC"].notna())
-    ].copy()
+    # Filter rows (LST wrapped to [0,24) h, 10-minute bins)
+    df_lst = _lst_rows(df_all)
 
     if len(df_lst) < 50:
         print("⚠️ Not enough filtered points for LST plot; skipping.")
     else:
-        # Compute LST (hours) for each timestamp
-        loc = EarthLocation.from_geodetic(lon=lon*u.deg, lat=lat*u.deg, height=el*u.m)
-        t = Time(list(df_lst["UTC"]), location=loc)
-        lst_hours = t.sidereal_time("apparent").hour
-        df_lst["LST"] = np.mod(np.array(lst_hours, dtype=float), 24.0)
-
-        # Bin in LST (10-minute bins)
-        bin_hours = 10.0/60.0
-        df_lst["bin"] = (np.floor(df_lst["LST"] / bin_hours) * bin_hours) + (bin_hours/2.0)
-
-        g = df_lst.groupby("bin")["SQM"]
+        # per-(site, LST bin) sketches merged while loading: exact for small
+        # ranges, bounded memory for long ones
+        tab = lst_sk.table(["site", "bin"], ddof=0)
         binned = pd.DataFrame({
-            "LST": g.median().index.values.astype(float),
-            "median": g.median().values.astype(float),
-            "stdev": g.std(ddof=0).values.astype(float),
-            "n": g.size().values.astype(int),
+            "LST": tab["bin"].to_numpy(dtype=float),
+            "median": tab["median"].to_numpy(dtype=float),
+            "stdev": tab["stdev"].to_numpy(dtype=float),
+            "n": tab["n"].to_numpy(dtype=int),
         })
 
         # Keep only bins with at least a few points (stable stdev)
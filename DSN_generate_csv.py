@@ -6,7 +6,17 @@ from pathlib import Path
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import requests
-import io, csv
+import io, csv, itertools, tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import DSN_manifest
+import DSN_summary
+from DSN_publish import PublishQueue
+from DSN_csvcache import RangeCache, format_times, format_values
+from DSN_inputs import read_processed
+import DSN_sqlstore
+import DSN_binarchive
+import pandas as pd
 
 # ---------- tiny utils ----------
 def run(cmd, cwd=None, check=True, capture=False):
@@ -29,18 +39,6 @@ def git_hard_sync(repo: Path):
     subprocess.call(["git","checkout","main"],cwd=str(repo))
     subprocess.call(["git","reset","--hard","origin/main"], cwd=str(repo))
 
-def git_commit_push(repo: Path, msg: str):
-    subprocess.call(["git","add","-A"], cwd=str(repo))
-    if subprocess.call(["git","diff","--cached","--quiet"], cwd=str(repo)) == 0:
-        return
-    subprocess.call(["git","commit","-m", msg], cwd=str(repo))
-    if subprocess.call(["git","push","origin","main"], cwd=str(repo)) != 0:
-        subprocess.call(["git","fetch","origin"], cwd=str(repo))
-        subprocess.call(["git","reset","--hard","origin/main"], cwd=str(repo))
-        subprocess.call(["git","add","-A"], cwd=str(repo))
-        subprocess.call(["git","commit","-m","republish after reset"], cwd=str(repo))
-        subprocess.call(["git","push","--force-with-lease","origin","main"], cwd=str(repo))
-
 def site_from_label(label: str) -> str:
     return (label or "").split("_", 1)[0].strip()  # "DSN019-S_MtLemmon" -> "DSN019-S"
 
@@ -96,129 +94,236 @@ def looks_like_placeholder(url: str) -> bool:
     u = (url or "").strip().lower()
     return ("<your" in u) or ("{your" in u) or ("example" in u) or ("%3c" in u)  # catches encoded < >
 
-def query_influx_csv(url, org, token, bucket, measurement, start_iso, stop_iso) -> str:
-    flux = f'''
+QUERY_HEADER = "time,SQM,lum,chisquared,moonalt"
+# map original names to pretty header titles
+HEADER_MAP = {
+    "time": "time (UT)",
+    "SQM": "rad (mag/sq asec)",
+    "lum": "rad nW/cm2/sr",
+    "chisquared": "chisquared",
+    "moonalt": "Moon alt (deg)"
+}
+
+# ---------- server-side downsampling ----------
+# every: Flux duration ("1h", "1d", ...) for aggregateWindow, None = raw rows
+# fn:    aggregate per field and window
+# max_chisq: keep only samples with chisquared <= this (cloud filter), None = all
+Downsample = namedtuple("Downsample", "every fn max_chisq")
+AGG_FUNCS = ("mean", "median", "min", "max")
+RESOLUTION_RE = re.compile(r"^[1-9]\d*(m|h|d|w)$")
+CHI_THR = 0.009   # same cloud cut as DSN_generate_analysis
+
+def downsample_spec(args):
+    """Downsample from parsed args, or None for the plain raw export."""
+    if not args.resolution and args.max_chisq is None:
+        return None
+    return Downsample(args.resolution, args.agg, args.max_chisq)
+
+def downsample_suffix(ds) -> str:
+    """
+    File name tag: _1h_mean.ds, _1d_median_chi0.009.ds, _chi0.009.ds ...
+    (.ds.csv is in DSN_manifest.DERIVED_SUFFIXES, so the analysis never
+    mixes these with raw rows)
+    """
+    if ds is None:
+        return ""
+    tag = f"_{ds.every}_{ds.fn}" if ds.every else ""
+    if ds.max_chisq is not None:
+        tag += f"_chi{ds.max_chisq:g}"
+    return tag + ".ds"
+
+def downsample_desc(ds) -> str:
+    desc = f"{ds.every} {ds.fn}" if ds.every else "raw"
+    if ds.max_chisq is not None:
+        desc += f", chisquared <= {ds.max_chisq:g}"
+    return desc
+
+def _flux_query(bucket, measurement, start_iso, stop_iso, downsample=None) -> str:
+    head = f'''
 from(bucket: {json.dumps(bucket)})
   |> range(start: time(v: {json.dumps(start_iso)}), stop: time(v: {json.dumps(stop_iso)}))
   |> filter(fn: (r) => r["_measurement"] == {json.dumps(measurement)})
   |> filter(fn: (r) => contains(value: r["_field"], set: ["SQM","lum","chisquared","moonalt"]))
-  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
-  |> keep(columns: ["_time","SQM","lum","chisquared","moonalt"])
-  |> rename(columns: {{"_time": "time"}})
+'''
+    pivot = '''  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+'''
+    tail = '''  |> keep(columns: ["_time","SQM","lum","chisquared","moonalt"])
+  |> rename(columns: {"_time": "time"})
   |> sort(columns: ["time"])
 '''
+    if downsample is None:
+        return head + pivot + tail
+    body = ""
+    if downsample.max_chisq is not None:
+        # cloud filter needs chisquared beside each sample: pivot, filter,
+        # then back to one series per field for aggregateWindow
+        body += pivot + f'''  |> filter(fn: (r) => exists r.chisquared and r.chisquared <= {float(downsample.max_chisq)!r})
+'''
+        if downsample.every:
+            body += '''  |> experimental.unpivot()
+'''
+    if downsample.every:
+        body += f'''  |> aggregateWindow(every: {downsample.every}, fn: {downsample.fn}, timeSrc: "_start", createEmpty: false)
+''' + pivot
+    imports = 'import "experimental"\n' if downsample.every and downsample.max_chisq is not None else ""
+    return imports + head + body + tail
+
+def downsample_frame(df, ds, lo=None):
+    """
+    pandas twin of the Flux shaping above, for rows in a DataFrame with a
+    UTC column (archive backend, Influx stand-in).  Windows are aligned to
+    the epoch and labelled by their start, the first one clipped to lo
+    (range start) as Influx does.
+    """
+    if ds.max_chisq is not None:
+        df = df[df["chisquared"] <= ds.max_chisq]
+    if not ds.every or df.empty:
+        return df
+    out = (df.set_index("UTC").resample(pd.Timedelta(ds.every), origin="epoch")
+             .agg(ds.fn).dropna(how="all").reset_index())
+    if lo is not None:
+        out["UTC"] = out["UTC"].clip(lower=lo)
+    return out
+
+def iter_text_lines(chunks):
+    """
+    Split decoded text chunks into lines exactly like str.splitlines(),
+    holding back an unterminated tail (or a lone '\r' that may be half of
+    '\r\n') until the next chunk arrives.
+    """
+    pending = ""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pending += chunk
+        lines = pending.splitlines(True)
+        pending = ""
+        last = lines[-1]
+        if last.endswith("\r") or last.splitlines()[0] == last:
+            pending = lines.pop()
+        for ln in lines:
+            yield ln.splitlines()[0]
+    if pending:
+        yield pending.splitlines()[0]
+
+class InfluxQueryError(RuntimeError):
+    """Non-200 answer from /api/v2/query (status kept for retry decisions)."""
+    def __init__(self, status, text):
+        super().__init__(f"Influx query {status}: {text[:400]}")
+        self.status = status
+
+def iter_influx_lines(url, org, token, bucket, measurement, start_iso, stop_iso, session=None,
+                      downsample=None):
+    """Stream the raw Flux CSV response line by line (nothing buffered)."""
     qurl = url.rstrip("/") + "/api/v2/query"
-    r = requests.post(
+    with (session or requests).post(
         qurl,
         params={"org": org},
-        data=flux.encode("utf-8"),
+        data=_flux_query(bucket, measurement, start_iso, stop_iso, downsample).encode("utf-8"),
         headers={
             "Authorization": f"Token {token}",
             "Content-Type": "application/vnd.flux",
             "Accept": "text/csv",
         },
-        timeout=120
-    )
-    if r.status_code != 200:
-        raise RuntimeError(f"Influx query {r.status_code}: {r.text[:400]}")
-    # strip annotations and optional result/table cols
-    lines = [ln for ln in r.text.splitlines() if not ln.startswith("#")]
-    if not lines:
-        return "time,SQM,lum,chisquared,moonalt\n"
-    if lines[0].startswith("result,table,"):
-        out = []
-        for ln in lines:
-            parts = ln.split(",")
-            if len(parts) >= 3:
-                out.append(",".join(parts[2:]))
-        if out and not out[0].startswith("time,"):
-            out.insert(0, "time,SQM,lum,chisquared,moonalt")
-        return "\n".join(out) + ("\n" if out and not out[-1].endswith("\n") else "")
-    if not lines[0].startswith("time,"):
-        lines.insert(0, "time,SQM,lum,chisquared,moonalt")
-    return "\n".join(lines) + ("\n" if lines and not lines[-1].endswith("\n") else "")
-
-def fix_influx_csv(text: str, wanted=("SQM","lum","chisquared","moonalt")) -> str:
+        timeout=120,
+        stream=True,
+    ) as r:
+        if r.status_code != 200:
+            raise InfluxQueryError(r.status_code, r.text)
+        r.encoding = r.encoding or "utf-8"
+        yield from iter_text_lines(r.iter_content(chunk_size=1 << 16, decode_unicode=True))
+
+def strip_query_lines(lines):
+    """
+    Lazy form of query_influx_csv's clean-up: strip annotations and the
+    optional result/table columns, make sure a 'time,' header comes first.
     """
-    Normalize Influx CSV to: time,<wanted...>
+    lines = (ln for ln in lines if not ln.startswith("#"))
+    first = next(lines, None)
+    if first is None:
+        yield QUERY_HEADER
+        return
+    if first.startswith("result,table,"):
+        out = (",".join(parts[2:])
+               for parts in (ln.split(",") for ln in itertools.chain([first], lines))
+               if len(parts) >= 3)
+        first = next(out)
+        lines = out
+    if not first.startswith("time,"):
+        yield QUERY_HEADER
+    yield first
+    yield from lines
+
+def query_influx_csv(url, org, token, bucket, measurement, start_iso, stop_iso,
+                     downsample=None) -> str:
+    lines = strip_query_lines(iter_influx_lines(url, org, token, bucket, measurement,
+                                                start_iso, stop_iso, downsample=downsample))
+    return "\n".join(lines) + "\n"
+
+def iter_fixed_rows(lines, wanted=("SQM","lum","chisquared","moonalt")):
+    """
+    Normalize Influx CSV lines to rows of: time,<wanted...>
     - removes annotation lines starting with '#'
     - drops 'result,table' columns if present
     - removes ',_result,0,' prefixes from data rows
     - guarantees a single header: time,<wanted present in data>
+    Yields the pretty header row first, then data rows; at most three rows
+    are looked ahead to find the header.
     """
-    # strip comment/annotation lines and blanks
-    raw_lines = [ln for ln in text.splitlines() if ln and not ln.startswith("#")]
-    if not raw_lines:
-        return "time," + ",".join(wanted) + "\n"
-
-    # csv-parse
-    reader = csv.reader(raw_lines)
-    rows = [r for r in reader if any(cell.strip() for cell in r)]
-    if not rows:
-        return "time," + ",".join(wanted) + "\n"
+    # strip comment/annotation lines and blanks, csv-parse
+    raw_lines = (ln for ln in lines if ln and not ln.startswith("#"))
+    rows = (r for r in csv.reader(raw_lines) if any(cell.strip() for cell in r))
+    first = next(rows, None)
+    if first is None:
+        yield ["time"] + list(wanted)
+        return
 
     # If header is the annotated one ('result,table,time,...'), drop the first two cols everywhere
-    drop_two = False
-    if rows and len(rows[0]) >= 3 and rows[0][0] == "result" and rows[0][1] == "table" and rows[0][2] == "time":
-        drop_two = True
+    drop_two = len(first) >= 3 and first[0] == "result" and first[1] == "table" and first[2] == "time"
 
     # Some outputs have your desired header on line 1 and the annotated header on line 2.
     # Detect and prefer the clean header if present.
-    prefer_clean_header = rows and rows[0] and rows[0][0] == "time"
-
-    # Build cleaned table
-    cleaned = []
-    for r in rows:
-        # remove leading annotated columns for data rows
-        if drop_two and len(r) >= 3:
-            r = r[2:]
-        # also handle lines that start with an empty cell then '_result,0,...'
-        if r and r[0] == "" and len(r) >= 3 and r[1] == "_result" and r[2] == "0":
-            r = r[3:]
-        # skip any residual duplicate annotated header
-        if r and r[0] in ("result", "table", "_result"):
-            continue
-        cleaned.append(r)
+    prefer_clean_header = first[0] == "time"
+
+    def clean(rs):
+        for r in rs:
+            # remove leading annotated columns for data rows
+            if drop_two and len(r) >= 3:
+                r = r[2:]
+            # also handle lines that start with an empty cell then '_result,0,...'
+            if r and r[0] == "" and len(r) >= 3 and r[1] == "_result" and r[2] == "0":
+                r = r[3:]
+            # skip any residual duplicate annotated header
+            if r and r[0] in ("result", "table", "_result"):
+                continue
+            yield r
+    cleaned = clean(itertools.chain([first], rows))
 
     # If first row is the desired header, use it; otherwise assemble from present columns
     if prefer_clean_header:
-        header = cleaned[0]
-        data_rows = cleaned[1:]
+        header = next(cleaned)
+        data_rows = cleaned
     else:
-        # figure out which of the wanted columns are present after cleaning
-        header = cleaned[0] if cleaned and cleaned[0] and cleaned[0][0] == "time" else None
-        if header is None:
+        head = list(itertools.islice(cleaned, 3))
+        header, data_rows = None, itertools.chain(head, cleaned)
+        if head and head[0] and head[0][0] == "time":
+            header = head[0]
+        else:
             # try to find a header row containing 'time'
-            for i, r in enumerate(cleaned[:3]):
+            for i, r in enumerate(head):
                 if r and "time" in r:
                     header = r
-                    cleaned = cleaned[i+1:]
+                    data_rows = itertools.chain(head[i+1:], cleaned)
                     break
         if header is None:
             # fallback header
             header = ["time"] + list(wanted)
-        data_rows = cleaned
 
     # Map indices and build final columns
     col_index = {name: i for i, name in enumerate(header)}
     final_cols = ["time"] + [c for c in wanted if c in col_index]
-    
-    # map original names to pretty header titles
-    header_map = {
-        "time": "time (UT)",
-        "SQM": "rad (mag/sq asec)",
-        "lum": "rad nW/cm2/sr",
-        "chisquared": "chisquared",
-        "moonalt": "Moon alt (deg)"
-    }
-
-    # build display header row
-    pretty_cols = [header_map.get(c, c) for c in final_cols]
-
-    # write out
-    out = io.StringIO()
-    w = csv.writer(out, lineterminator="\n")
-    w.writerow(pretty_cols)
+
+    yield [HEADER_MAP.get(c, c) for c in final_cols]
 
     iso_re = re.compile(r"^\d{4}-\d{2}-\d{2}T")
     for r in data_rows:
@@ -235,16 +340,304 @@ def fix_influx_csv(text: str, wanted=("SQM","lum","chisquared","moonalt")) -> st
         for c in final_cols:
             idx = col_index.get(c, 0)
             row.append(r[idx] if idx < len(r) else "")
-        
+
         # SWAP values in positions 2 and 3 (columns 3 and 4 in CSV output)
         if len(row) >= 4:
             row[2], row[3] = row[3], row[2]
-        
-        w.writerow(row)
 
+        yield row
+
+def fix_influx_csv(text: str, wanted=("SQM","lum","chisquared","moonalt")) -> str:
+    """Whole-text form of iter_fixed_rows()."""
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(iter_fixed_rows(text.splitlines(), wanted))
     return out.getvalue()
+
+def write_influx_csv(lines, out_csv: Path, wanted=("SQM","lum","chisquared","moonalt")) -> int:
+    """
+    Stream query lines through strip_query_lines/iter_fixed_rows straight
+    into out_csv (written as <out_csv>.part, renamed when complete).
+    Returns the number of data rows written.
+    """
+    part = out_csv.with_name(out_csv.name + ".part")
+    n = -1
+    try:
+        with open(part, "w") as f:
+            w = csv.writer(f, lineterminator="\n")
+            for row in iter_fixed_rows(strip_query_lines(lines), wanted):
+                w.writerow(row)
+                n += 1
+        os.replace(part, out_csv)
+    except BaseException:
+        try:
+            part.unlink()
+        except OSError:
+            pass
+        raise
+    return max(n, 0)
+# ---------- time-sliced parallel queries ----------
+SLICE_DAYS = 30      # one Flux query per slice
+QUERY_WORKERS = 4    # concurrent slice queries
+QUERY_RETRIES = 3    # extra attempts per slice (network errors, 429, 5xx)
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def time_slices(start_iso: str, stop_iso: str, days=SLICE_DAYS, align=None) -> list[tuple[str, str]]:
+    """
+    Split [start, stop) into consecutive slices of at most `days` days.
+    With align (a timedelta), inner cuts fall on epoch multiples of it so
+    no aggregation window is split between two slices.
+    """
+    s = datetime.fromisoformat(start_iso.replace("Z", "+00:00"))
+    e = datetime.fromisoformat(stop_iso.replace("Z", "+00:00"))
+    if days is None or days <= 0 or e <= s:
+        return [(start_iso, stop_iso)]
+    out, step = [], timedelta(days=days)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    while s < e:
+        n = s + step
+        if align:
+            n = epoch + ((n - epoch) // align) * align
+            if n <= s:
+                n = epoch + ((s - epoch) // align + 1) * align
+        n = min(n, e)
+        out.append((_iso(s), _iso(n)))
+        s = n
+    return out
+
+def pooled_session(workers=QUERY_WORKERS) -> requests.Session:
+    """requests.Session whose connection pool fits `workers` threads."""
+    sess = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers))
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+def _retrying(desc, retries, fn):
+    """
+    Call fn(); network errors, 429 and 5xx answers are retried with
+    exponential backoff, anything else raises at once.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except (requests.RequestException, InfluxQueryError) as e:
+            transient = not isinstance(e, InfluxQueryError) or e.status == 429 or e.status >= 500
+            if not transient or attempt == retries:
+                raise RuntimeError(f"{desc}: {e}") from e
+            wait = 2 ** attempt
+            print(f"[retry] {desc} ({e}); again in {wait}s", file=sys.stderr)
+            time.sleep(wait)
+
+def _spool_slice(session, query, start_iso, stop_iso, wanted, tmpdir):
+    """Run one slice query, spool its normalized rows; (header, path, nrows)."""
+    url, org, token, bucket, meas, downsample = query
+    fd, path = tempfile.mkstemp(dir=tmpdir, suffix=".slice")
+    try:
+        with os.fdopen(fd, "w") as f:
+            w = csv.writer(f, lineterminator="\n")
+            rows = iter_fixed_rows(strip_query_lines(iter_influx_lines(
+                url, org, token, bucket, meas, start_iso, stop_iso, session=session,
+                downsample=downsample)), wanted)
+            header = next(rows)
+            n = 0
+            for row in rows:
+                w.writerow(row)
+                n += 1
+    except BaseException:
+        os.unlink(path)
+        raise
+    return header, path, n
+
+def write_influx_sliced(url, org, token, bucket, measurement, start_iso, stop_iso, out_csv: Path,
+                        wanted=("SQM","lum","chisquared","moonalt"),
+                        slice_days=SLICE_DAYS, workers=QUERY_WORKERS, retries=QUERY_RETRIES,
+                        downsample=None) -> int:
+    """
+    Fetch [start, stop) as time slices, `workers` at a time over one pooled
+    session, and stitch them in time order into out_csv (same format as a
+    single query through write_influx_csv).  Returns the number of rows.
+    """
+    align = pd.Timedelta(downsample.every).to_pytimedelta() if downsample and downsample.every else None
+    slices = time_slices(start_iso, stop_iso, slice_days, align)
+    query = (url, org, token, bucket, measurement, downsample)
+    with pooled_session(workers) as sess:
+        if len(slices) == 1:
+            # nothing to parallelize: stream straight to disk
+            return _retrying(f"query {start_iso}..{stop_iso}", retries, lambda: write_influx_csv(
+                iter_influx_lines(url, org, token, bucket, measurement, start_iso, stop_iso, session=sess,
+                                  downsample=downsample),
+                out_csv, wanted))
+        with tempfile.TemporaryDirectory(dir=out_csv.parent, prefix=".slices-") as tmpdir:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(slices)))) as pool:
+                futures = [pool.submit(_retrying, f"slice {s}..{e}", retries,
+                                       lambda s=s, e=e: _spool_slice(sess, query, s, e, wanted, tmpdir))
+                           for s, e in slices]
+                try:
+                    results = [f.result() for f in futures]
+                except BaseException:
+                    for f in futures:
+                        f.cancel()
+                    raise
+            # all slices normally share one header; remap by name if not
+            header = next((h for h, _, n in results if n), results[0][0])
+            part = out_csv.with_name(out_csv.name + ".part")
+            total = 0
+            try:
+                with open(part, "w") as out:
+                    w = csv.writer(out, lineterminator="\n")
+                    w.writerow(header)
+                    for h, path, n in results:
+                        if not n:
+                            continue
+                        with open(path) as f:
+                            if h == header:
+                                shutil.copyfileobj(f, out)
+                            else:
+                                idx = [h.index(c) if c in h else None for c in header]
+                                for r in csv.reader(f):
+                                    w.writerow(["" if i is None else r[i] for i in idx])
+                        total += n
+                os.replace(part, out_csv)
+            except BaseException:
+                try:
+                    part.unlink()
+                except OSError:
+                    pass
+                raise
+    print(f"Fetched {len(slices)} slices ({total} rows)", file=sys.stderr)
+    return total
+def fetch_cached(fetch, cache_dir: Path, start_iso, stop_iso, out_csv: Path) -> int:
+    """
+    Answer [start, stop) from the label's RangeCache, calling
+    fetch(s_iso, e_iso, path) only for the missing sub-ranges.  Falls back
+    to one direct fetch if a fetched range cannot be cached exactly.
+    """
+    cache = RangeCache(cache_dir)
+    gaps = cache.missing(start_iso, stop_iso)
+    print(f"[cache] {cache_dir}: {len(gaps)} missing sub-range(s) {gaps}", file=sys.stderr)
+    for s_iso, e_iso in gaps:
+        tmp = cache_dir / f".fetch-{os.getpid()}.csv"
+        try:
+            fetch(s_iso, e_iso, tmp)
+            if not cache.add(s_iso, e_iso, tmp):
+                print("[cache] rows do not round-trip; querying without cache", file=sys.stderr)
+                return fetch(start_iso, stop_iso, out_csv)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    return cache.write_csv(start_iso, stop_iso, out_csv)
+
+# ---------- local archive backend ----------
+BACKENDS = ("auto", "influx", "archive", "sql", "bin")
+ARCHIVE_SLACK = DSN_manifest.GAP      # holes up to this long are normal (daytime)
+
+def archive_covers(archive_dir, label, start_iso, stop_iso) -> bool:
+    """
+    True if the site's archive files have samples across [start, stop):
+    no hole longer than ARCHIVE_SLACK per the manifest's per-file ranges
+    and gaps (a missing month file or site downtime is not covered).
+    """
+    if not os.path.isdir(archive_dir):
+        return False
+    holes = DSN_manifest.coverage_gaps(archive_dir, site_from_label(label),
+                                       start_iso, stop_iso, gap=ARCHIVE_SLACK)
+    if holes:
+        print(f"[archive] {len(holes)} uncovered sub-range(s) "
+              f"{[(_iso(a), _iso(b)) for a, b in holes[:5]]}", file=sys.stderr)
+    return not holes
+
+def write_archive_csv(archive_dir, label, start_iso, stop_iso, out_csv: Path,
+                      wanted=("SQM","lum","chisquared","moonalt"), downsample=None) -> int:
+    """
+    Answer a label + [start, stop) request from processed archive CSVs
+    (DSNdata/BOX_ANALYSIS: <site>_*.csv), opening only the files the
+    manifest says overlap.  Output has the same header and value format
+    as the Influx path (fix_influx_csv).  Samples repeated in several
+    archive files are kept once (first file in name order).
+    """
+    prefix = site_from_label(label)
+    lo, hi = pd.Timestamp(start_iso), pd.Timestamp(stop_iso)
+    parts = []
+    for name in DSN_manifest.overlapping_files(archive_dir, prefix, lo, hi):
+        try:
+            df = read_processed(os.path.join(archive_dir, name), usecols=wanted, float_dtype="float64")
+        except Exception as e:
+            print(f"[archive] skipping {name}: {e}", file=sys.stderr)
+            continue
+        parts.append(df[(df["UTC"] >= lo) & (df["UTC"] < hi)])
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["UTC"])
+    df = df.drop_duplicates(subset=["UTC"]).sort_values("UTC", kind="stable")
+    write_frame_csv(df, out_csv, wanted, lo, downsample)
+    print(f"[archive] {len(df)} rows for {prefix} from {archive_dir}", file=sys.stderr)
+    return len(df)
+
+def write_frame_csv(df, out_csv: Path, wanted, lo, downsample=None) -> int:
+    """Rows (tz-aware UTC, archive names) -> output CSV in the Influx path's format."""
+    if downsample is not None:
+        df = downsample_frame(df, downsample, lo)
+    cols = [c for c in wanted if c in df.columns]
+    part = out_csv.with_name(out_csv.name + ".part")
+    with open(part, "w") as f:
+        csv.writer(f, lineterminator="\n").writerow([HEADER_MAP[c] for c in ["time"] + cols])
+        if len(df):
+            t = df["UTC"].dt.tz_convert(None).to_numpy("datetime64[ns]").astype("int64")
+            data = [format_times(t)] + [format_values(df[c].to_numpy(float)) for c in cols]
+            f.writelines(",".join(r) + "\n" for r in zip(*data))
+    os.replace(part, out_csv)
+    return len(df)
+
+# ---------- SQL store backend (DSN_sqlstore) ----------
+def sql_covers(sql_db, label, start_iso, stop_iso, archive_dir=None) -> bool:
+    """
+    True if the store's samples of the site cover [start, stop) without a
+    hole longer than ARCHIVE_SLACK and, when archive_dir exists, every
+    archive file overlapping the range is ingested at its current content
+    (a store older than the archive is not preferred to it).
+    """
+    if not os.path.isfile(sql_db):
+        return False
+    prefix = site_from_label(label)
+    holes = DSN_sqlstore.coverage_gaps(prefix, start_iso, stop_iso, ARCHIVE_SLACK, sql_db)
+    if holes:
+        print(f"[sql] {len(holes)} uncovered sub-range(s) "
+              f"{[(_iso(a), _iso(b)) for a, b in holes[:5]]}", file=sys.stderr)
+        return False
+    if archive_dir and os.path.isdir(archive_dir):
+        stale = DSN_sqlstore.stale_files(archive_dir, prefix, start_iso, stop_iso, sql_db)
+        if stale:
+            print(f"[sql] store older than the archive for {stale[:5]}", file=sys.stderr)
+            return False
+    return True
+
+def write_sql_csv(sql_db, label, start_iso, stop_iso, out_csv: Path,
+                  wanted=("SQM","lum","chisquared","moonalt"), downsample=None) -> int:
+    """write_archive_csv from the SQL store: one indexed (site, utc) range read."""
+    prefix = site_from_label(label)
+    df = DSN_sqlstore.read_range(prefix, start_iso, stop_iso, list(wanted), sql_db)
+    write_frame_csv(df, out_csv, wanted, pd.Timestamp(start_iso), downsample)
+    print(f"[sql] {len(df)} rows for {prefix} from {sql_db}", file=sys.stderr)
+    return len(df)
+
+# ---------- binary archive backend (DSN_binarchive) ----------
+def write_bin_csv(bin_dir, label, start_iso, stop_iso, out_csv: Path,
+                  wanted=("SQM","lum","chisquared","moonalt"), downsample=None) -> int:
+    """write_archive_csv from the site's memory-mapped binary archive."""
+    prefix = site_from_label(label)
+    lo = pd.Timestamp(start_iso)
+    df = DSN_binarchive.to_frame(DSN_binarchive.read_range(prefix, lo, pd.Timestamp(stop_iso), bin_dir))
+    write_frame_csv(df, out_csv, wanted, lo, downsample)
+    print(f"[bin] {len(df)} rows for {prefix} from {bin_dir}", file=sys.stderr)
+    return len(df)
+
 # ---------- main ----------
-def parse_args():
+def resolution_arg(text: str) -> str:
+    if not RESOLUTION_RE.match(text):
+        raise argparse.ArgumentTypeError(f"expected <n>m, <n>h, <n>d or <n>w, got {text!r}")
+    return text
+
+def parse_args(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--label", required=True, dest="label")
     ap.add_argument("--from",  required=True, dest="from_date")
@@ -259,15 +652,54 @@ def parse_args():
     ap.add_argument("--influx-org", dest="influx_org", default="DSN")
     ap.add_argument("--influx-bucket", dest="influx_bucket", default="DSNdata")
 
+    # long ranges are fetched as parallel time slices
+    ap.add_argument("--slice-days", dest="slice_days", type=float, default=SLICE_DAYS,
+                    help="days per Influx query slice (0 = one query)")
+    ap.add_argument("--workers", dest="workers", type=int, default=QUERY_WORKERS,
+                    help="concurrent slice queries")
+    ap.add_argument("--retries", dest="retries", type=int, default=QUERY_RETRIES,
+                    help="extra attempts per failed slice")
+
+    # per-label cache of fetched ranges (only missing sub-ranges hit Influx)
+    ap.add_argument("--cache-dir", dest="cache_dir",
+                    help="range cache root (default <site-repo>/DSNdata/CSV_CACHE)")
+    ap.add_argument("--no-cache", dest="no_cache", action="store_true",
+                    help="always query the whole range")
+
+    # where the rows come from: Influx, the local processed archive, the SQL
+    # store, the binary archive (explicit only), or auto = SQL store or
+    # archive when it spans the range, else Influx (archive on failure)
+    ap.add_argument("--backend", choices=BACKENDS, default="auto")
+    ap.add_argument("--archive-dir", dest="archive_dir",
+                    help="processed archive (default <site-repo>/DSNdata/BOX_ANALYSIS)")
+    ap.add_argument("--sql-db", dest="sql_db",
+                    help="SQL store (default <site-repo>/DSNdata/dsn.sqlite)")
+    ap.add_argument("--bin-dir", dest="bin_dir",
+                    help="binary archive (default <site-repo>/DSNdata/BIN)")
+
+    # server-side downsampling for long ranges (output name gets a _<res>_<fn> tag)
+    ap.add_argument("--resolution", type=resolution_arg,
+                    help="aggregate window, e.g. 1h, 1d, 1w (default: raw 5-min rows)")
+    ap.add_argument("--agg", choices=AGG_FUNCS, default="mean",
+                    help="aggregate per field and window")
+    ap.add_argument("--max-chisq", dest="max_chisq", type=float, nargs="?", const=CHI_THR,
+                    help=f"cloud filter: keep chisquared <= value (bare flag: {CHI_THR})")
+
     # legacy inputs (kept for compatibility; not used if Influx is set)
     ap.add_argument("--source")
     ap.add_argument("--cmd")
-    return ap.parse_args()
+    return ap.parse_args(argv)
+
+# published next to each CSV (DSN_summary): kept by delete_non_csv
+KEEP_SUFFIXES = (DSN_manifest.MANIFEST_SUFFIX, ".csv" + DSN_summary.GZ_SUFFIX,
+                 DSN_summary.SUMMARY_SUFFIX)
 
 def delete_non_csv(out_dir: Path):
-    """Remove all files in out_dir that are not .csv files."""
+    """Remove all files in out_dir that are not .csv files (manifest, .csv.gz, summary stay)."""
     removed = 0
     for f in out_dir.iterdir():
+        if f.name.endswith(KEEP_SUFFIXES):
+            continue
         if f.is_file() and f.suffix.lower() != ".csv":
             try:
                 f.unlink()
@@ -277,44 +709,75 @@ def delete_non_csv(out_dir: Path):
     if removed: 
         print(f"[clean] removed {removed} non-CSV files", file=sys.stderr)
 
-def main():
-    args = parse_args()
+def publish_artifacts(out_csv: Path, label, repo: Path, summary=True) -> list[str]:
+    """
+    .csv.gz and (raw exports) .summary.json next to out_csv (DSN_summary).
+    Returns their repo-relative paths; failures only cost the artifacts.
+    """
+    try:
+        paths = DSN_summary.write_artifacts(out_csv, label, repo / "DSNdata" / "DSNsites.csv",
+                                            summary=summary)
+    except Exception as e:
+        print(f"[summary] artifacts for {out_csv.name} failed: {e}", file=sys.stderr)
+        return []
+    print(f"[summary] wrote {', '.join(Path(p).name for p in paths)}", file=sys.stderr)
+    return [str(Path(p).relative_to(repo)) for p in paths]
+
+def artifact_urls(out_csv: Path, repo: Path) -> dict:
+    """Pages URLs of the artifacts that exist next to out_csv."""
+    urls = {}
+    for key, path in (("csv_gz", Path(f"{out_csv}{DSN_summary.GZ_SUFFIX}")),
+                      ("summary", Path(DSN_summary.summary_path(out_csv)))):
+        if path.exists():
+            urls[key] = f"https://soazcomms.github.io/{str(path.relative_to(repo)).replace(os.sep, '/')}"
+    return urls
+
+def build_csv(args, repo: Path, keep=()):
+    """
+    Produce the CSV for one request (args as from parse_args) inside the
+    site repo, without any git operations.  Returns (rc, status, paths):
+    status is the JSON dict we print, paths the repo-relative paths to
+    publish ([] when nothing changed).  Files whose repo-relative path is
+    in keep (queued for publishing) survive the output-dir clean-up.
+    """
     label = args.label
-    repo = Path(args.site_repo).expanduser().resolve()
-    if not repo.exists():
-        print(f"ERROR: site repo not found: {repo}", file=sys.stderr)
-        return 2
-
-    git_identity(repo)
-    git_hard_sync(repo)
-
     ymd_from = ymd(args.from_date)
     ymd_to   = ymd(args.to_date)
+    ds = downsample_spec(args)
+    name = f"{label}_{ymd_from}_{ymd_to}{downsample_suffix(ds)}.csv"
     if args.out:
         # Respect the directory from --out, but normalize the filename
         out_dir = Path(args.out).expanduser().resolve().parent
-        out_csv = out_dir / f"{label}_{ymd_from}_{ymd_to}.csv"
+        out_csv = out_dir / name
     else:
         out_dir = Path(args.site_repo).expanduser().resolve() / "analysis" / label
-        out_csv = out_dir / f"{label}_{ymd_from}_{ymd_to}.csv"
+        out_csv = out_dir / name
+    extra = {"resolution": downsample_desc(ds)} if ds else {}
 
     # Early exit if csv exists       
     if out_csv.exists() and out_csv.stat().st_size > 0:
         # usual status line so the HTML unblocks immediately
         delete_non_csv(out_dir)
-        print(json.dumps({
+        # CSVs published before the .gz/summary artifacts get them now
+        made = []
+        if out_csv.is_relative_to(repo) and (
+                not Path(f"{out_csv}{DSN_summary.GZ_SUFFIX}").exists() or
+                (ds is None and not Path(DSN_summary.summary_path(out_csv)).exists())):
+            made = publish_artifacts(out_csv, label, repo, ds is None)
+        return 0, {
             "status": f"✅ CSV already present for {label} {ymd_from}-{ymd_to}",
             "csv":     f"https://soazcomms.github.io/analysis/{label}/{out_csv.name}",
             "csv_raw": f"https://raw.githubusercontent.com/soazcomms/soazcomms.github.io/main/analysis/{label}/{out_csv.name}",
+            **extra,
+            **(artifact_urls(out_csv, repo) if out_csv.is_relative_to(repo) else {}),
             "timestamp": int(time.time())
-        }))
-        sys.exit(0)
+        }, made
     
     try:
         out_csv.relative_to(repo)
     except ValueError:
         print(f"ERROR: --out must live under site repo: {repo}", file=sys.stderr)
-        return 2
+        return 2, None, []
     # make sure:
     out_dir.mkdir(parents=True, exist_ok=True)
     out_csv.parent.mkdir(parents=True, exist_ok=True)
@@ -323,6 +786,8 @@ def main():
     if os.path.exists(out_dir):
         for filename in os.listdir(out_dir):
             file_path = os.path.join(out_dir, filename)
+            if str(Path(file_path).relative_to(repo)) in keep:
+                continue
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
                     os.unlink(file_path)
@@ -337,41 +802,121 @@ def main():
     INFLUX_ORG    = (args.influx_org   or os.getenv("INFLUX_ORG")   or "DSN").strip()
     INFLUX_BUCKET = (args.influx_bucket or os.getenv("INFLUX_BUCKET") or "DSNdata").strip()
 
+    start_iso, stop_iso = iso_range(args.from_date, args.to_date)
+    archive_dir = args.archive_dir or str(repo / "DSNdata" / "BOX_ANALYSIS")
+    sql_db = args.sql_db or str(repo / "DSNdata" / "dsn.sqlite")
+    bin_dir = args.bin_dir or str(repo / "DSNdata" / "BIN")
+    backend = args.backend
+    if backend == "auto" and sql_covers(sql_db, label, start_iso, stop_iso, archive_dir):
+        backend = "sql"
+    if backend == "auto" and archive_covers(archive_dir, label, start_iso, stop_iso):
+        backend = "archive"
+    influx_ok = (INFLUX_URL and not looks_like_placeholder(INFLUX_URL)
+                 and INFLUX_TOKEN and not looks_like_placeholder(INFLUX_TOKEN))
+    if backend == "auto" and not influx_ok and os.path.isdir(archive_dir):
+        print("Influx not configured; answering from the archive", file=sys.stderr)
+        backend = "archive"
+
     # Guard against placeholders / empty config
-    if not INFLUX_URL or looks_like_placeholder(INFLUX_URL):
+    local = backend in ("archive", "sql", "bin")
+    if not local and (not INFLUX_URL or looks_like_placeholder(INFLUX_URL)):
         print("ERROR: Influx URL not set. Use --influx-url https://<your-cloud2-host> or set INFLUX_URL", file=sys.stderr)
-        return 2
-    if not INFLUX_TOKEN or looks_like_placeholder(INFLUX_TOKEN):
+        return 2, None, []
+    if not local and (not INFLUX_TOKEN or looks_like_placeholder(INFLUX_TOKEN)):
         print("ERROR: Influx token not set. Use --influx-token *** or set INFLUX_TOKEN", file=sys.stderr)
-        return 2
+        return 2, None, []
 
     # Fetch real CSV from Influx for Grafana window
     meas = measurement_from_label(label)  # e.g., DSN019S_MtLemmon
 
-    start_iso, stop_iso = iso_range(args.from_date, args.to_date)
-    print(f"Querying InfluxDB for {label} ({meas})", file=sys.stderr)
+    if backend == "archive":
+        print(f"Reading archive {archive_dir} for {label}", file=sys.stderr)
+    elif backend == "sql":
+        print(f"Reading SQL store {sql_db} for {label}", file=sys.stderr)
+    elif backend == "bin":
+        print(f"Reading binary archive {bin_dir} for {label}", file=sys.stderr)
+    else:
+        print(f"Querying InfluxDB for {label} ({meas})", file=sys.stderr)
     print(f"Time range: {start_iso} to {stop_iso}", file=sys.stderr)
-    
+    if ds:
+        print(f"Resolution: {downsample_desc(ds)}", file=sys.stderr)
+
     try:
-        csv_text = query_influx_csv(INFLUX_URL, INFLUX_ORG, INFLUX_TOKEN, INFLUX_BUCKET, meas, start_iso, stop_iso)
-        csv_text = fix_influx_csv(csv_text, wanted=("SQM","chisquared","lum","moonalt"))
-        out_csv.write_text(csv_text)
+        # parallel time slices, each streamed to disk, stitched in order
+        def fetch(s_iso, e_iso, path):
+            return write_influx_sliced(INFLUX_URL, INFLUX_ORG, INFLUX_TOKEN, INFLUX_BUCKET, meas,
+                                       s_iso, e_iso, path,
+                                       wanted=("SQM","chisquared","lum","moonalt"),
+                                       slice_days=args.slice_days, workers=args.workers,
+                                       retries=args.retries, downsample=ds)
+        if backend == "archive":
+            nrows = write_archive_csv(archive_dir, label, start_iso, stop_iso, out_csv,
+                                      wanted=("SQM","chisquared","lum","moonalt"), downsample=ds)
+        elif backend == "sql":
+            nrows = write_sql_csv(sql_db, label, start_iso, stop_iso, out_csv,
+                                  wanted=("SQM","chisquared","lum","moonalt"), downsample=ds)
+        elif backend == "bin":
+            nrows = write_bin_csv(bin_dir, label, start_iso, stop_iso, out_csv,
+                                  wanted=("SQM","chisquared","lum","moonalt"), downsample=ds)
+        else:
+            try:
+                # the range cache holds raw rows only
+                if args.no_cache or ds:
+                    nrows = fetch(start_iso, stop_iso, out_csv)
+                else:
+                    nrows = fetch_cached(fetch, Path(args.cache_dir or repo / "DSNdata" / "CSV_CACHE") / label,
+                                         start_iso, stop_iso, out_csv)
+            except Exception as e:
+                if backend != "auto" or not os.path.isdir(archive_dir):
+                    raise
+                print(f"Influx failed ({e}); falling back to the archive", file=sys.stderr)
+                nrows = write_archive_csv(archive_dir, label, start_iso, stop_iso, out_csv,
+                                          wanted=("SQM","chisquared","lum","moonalt"), downsample=ds)
+        print(f"Wrote {nrows} rows to {out_csv}", file=sys.stderr)
+        # record the file's UTC range in analysis/<label>/<label>_manifest.json
+        if ds is None:
+            DSN_manifest.update_file(str(out_csv), prefix=label)
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
-        return 2
+        return 2, None, []
+    artifacts = publish_artifacts(out_csv, label, repo, ds is None)
 
-    # commit & push
     rel = out_csv.relative_to(repo)
-    git_commit_push(repo, f"Publish CSV for {label} {ymd_from}..{ymd_to}")
-
     csv_pages = f"https://soazcomms.github.io/{str(rel).replace(os.sep,'/')}"
     csv_raw   = f"https://raw.githubusercontent.com/soazcomms/soazcomms.github.io/main/{str(rel).replace(os.sep,'/')}"
-    print(json.dumps({
+    # the output dir, so the clean-up's deletions are published too, and
+    # the CSV itself (so a queued one is kept by the next clean-up)
+    return 0, {
         "status": f"✅ CSV ready for {label} {ymd_from}-{ymd_to}",
         "csv": csv_pages,
         "csv_raw": csv_raw,
+        **extra,
+        **artifact_urls(out_csv, repo),
         "timestamp": int(time.time())
-    }))
+    }, [str(out_dir.relative_to(repo)), str(rel)] + artifacts
+
+def publish_message(args) -> str:
+    ds = downsample_spec(args)
+    res = f" ({downsample_desc(ds)})" if ds else ""
+    return f"Publish CSV for {args.label} {ymd(args.from_date)}..{ymd(args.to_date)}{res}"
+
+def main():
+    args = parse_args()
+    repo = Path(args.site_repo).expanduser().resolve()
+    if not repo.exists():
+        print(f"ERROR: site repo not found: {repo}", file=sys.stderr)
+        return 2
+
+    git_identity(repo)
+    git_hard_sync(repo)
+
+    rc, status, paths = build_csv(args, repo)
+    if rc:
+        return rc
+    if paths:
+        # commit & push (one request: a batch of one)
+        status = PublishQueue(repo).publish_now(paths, publish_message(args), status)
+    print(json.dumps(status))
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_influx_standin.py
+# Local stand-in for the InfluxDB Cloud /api/v2/query endpoint, for
+# exercising DSN_generate_csv.py without the cloud.  It answers the Flux
+# query DSN_generate_csv sends (range + measurement) with Flux CSV in the
+# same layout Influx returns after pivot/keep/rename:
+#   ,result,table,time,SQM,chisquared,lum,moonalt
+#   ,_result,0,2025-01-01T07:00:00Z,21.74,0.00026,0.03337,-39.73
+# Data come from processed CSVs (--data DSNdata/BOX_ANALYSIS, files of
+# the measurement's site prefix) or, without --data, a synthetic 5-min
+# series.  --delay and --fail-rate make slow or flaky slices for testing
+# the sliced/retrying client.  The downsampled queries of
+# DSN_generate_csv --resolution/--max-chisq (aggregateWindow, chisquared
+# filter) are answered with the same shaping done in pandas.
+#
+# Usage:
+#   python DSN_influx_standin.py [--port 8086] [--data DIR] [--delay S] [--fail-rate P]
+#   python DSN_generate_csv.py ... --influx-url http://127.0.0.1:8086 --influx-token x
+import argparse, os, re, sys, time, random, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+#----
+RANGE_RE = re.compile(r'range\(start: time\(v: "([^"]+)"\), stop: time\(v: "([^"]+)"\)\)')
+MEAS_RE = re.compile(r'r\["_measurement"\] == "([^"]+)"')
+AGG_RE = re.compile(r'aggregateWindow\(every: (\w+), fn: (\w+)')
+CHISQ_RE = re.compile(r'r\.chisquared <= ([0-9.eE+-]+)')
+FIELDS = ["SQM", "chisquared", "lum", "moonalt"]   # pivot order (sorted)
+#******************
+def prefix_from_measurement(meas):
+    """DSN019S_MtLemmon -> DSN019-S (measurement names drop the dash)."""
+    site = meas.split("_", 1)[0]
+    return f"{site[:-1]}-{site[-1]}" if site.startswith("DSN") else site
+#******************
+class Store:
+    """Per-site frames loaded once, indexed by UTC."""
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir
+        self.frames = {}
+        self.lock = threading.Lock()
+    #----
+    def _load(self, prefix):
+        if self.data_dir is None:
+            t = pd.date_range("2017-01-01", "2027-01-01", freq="5min", tz="UTC")
+            ph = np.arange(len(t)) * 2*np.pi / 288.0
+            return pd.DataFrame({"UTC": t,
+                                 "SQM": np.round(21.0 + 0.5*np.sin(ph), 2),
+                                 "chisquared": np.round(0.001 + 0.001*np.cos(ph), 5),
+                                 "lum": np.round(0.05 + 0.01*np.sin(ph), 5),
+                                 "moonalt": np.round(40.0*np.sin(ph/29.5), 2)})
+        from DSN_inputs import RENAME
+        parts = []
+        for f in sorted(os.listdir(self.data_dir)):
+            if not (f.startswith(prefix + "_") and f.endswith(".csv")):
+                continue
+            try:
+                df = pd.read_csv(os.path.join(self.data_dir, f), comment="#", sep=None,
+                                 engine="python").rename(columns=RENAME)
+            except Exception:
+                continue
+            if "UTC" not in df.columns or not set(FIELDS) <= set(df.columns):
+                continue
+            df["UTC"] = pd.to_datetime(df["UTC"], utc=True, errors="coerce")
+            parts.append(df.dropna(subset=["UTC"])[["UTC"] + FIELDS])
+        if not parts:
+            return pd.DataFrame(columns=["UTC"] + FIELDS)
+        df = pd.concat(parts, ignore_index=True)
+        return df.drop_duplicates("UTC").sort_values("UTC").reset_index(drop=True)
+    #----
+    def get(self, meas):
+        prefix = prefix_from_measurement(meas)
+        with self.lock:
+            if prefix not in self.frames:
+                self.frames[prefix] = self._load(prefix)
+            return self.frames[prefix]
+#******************
+def make_handler(store, delay=0.0, fail_rate=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, fmt, *a):
+            print("[standin] " + fmt % a, file=sys.stderr)
+        #----
+        def _send(self, code, body, ctype="application/json"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        #----
+        def _chunk(self, text):
+            data = text.encode("utf-8")
+            if data:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        #----
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+            if not self.path.startswith("/api/v2/query"):
+                return self._send(404, '{"code":"not found","message":"path not found"}')
+            if not self.headers.get("Authorization", "").startswith("Token "):
+                return self._send(401, '{"code":"unauthorized","message":"unauthorized access"}')
+            if delay:
+                time.sleep(delay)
+            if fail_rate and random.random() < fail_rate:
+                return self._send(503, '{"code":"unavailable","message":"stand-in failure"}')
+            rng, meas = RANGE_RE.search(body), MEAS_RE.search(body)
+            if not rng or not meas:
+                return self._send(400, '{"code":"invalid","message":"unsupported query"}')
+            start, stop = pd.Timestamp(rng.group(1)), pd.Timestamp(rng.group(2))
+            df = store.get(meas.group(1))
+            t = df["UTC"]
+            lo, hi = t.searchsorted(start, "left"), t.searchsorted(stop, "left")
+            sel = df.iloc[lo:hi]
+            agg, chi = AGG_RE.search(body), CHISQ_RE.search(body)
+            if agg or chi:
+                from DSN_generate_csv import Downsample, downsample_frame
+                ds = Downsample(agg.group(1) if agg else None, agg.group(2) if agg else None,
+                                float(chi.group(1)) if chi else None)
+                sel = downsample_frame(sel, ds, start)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            if len(sel):
+                self._chunk(",result,table,time," + ",".join(FIELDS) + "\r\n")
+                times = sel["UTC"].dt.strftime("%Y-%m-%dT%H:%M:%SZ").to_numpy()
+                # Influx prints floats in shortest decimal form, no exponent
+                vals = [[np.format_float_positional(x, trim="-") if x == x else ""
+                         for x in row] for row in sel[FIELDS].to_numpy(float).tolist()]
+                for i in range(0, len(sel), 2000):
+                    self._chunk("".join(f",_result,0,{tt},{','.join(v)}\r\n"
+                                        for tt, v in zip(times[i:i+2000], vals[i:i+2000])))
+            self._chunk("\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+    return Handler
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8086)
+    ap.add_argument("--data", help="directory of processed CSVs (e.g. DSNdata/BOX_ANALYSIS)")
+    ap.add_argument("--delay", type=float, default=0.0, help="seconds before each answer")
+    ap.add_argument("--fail-rate", dest="fail_rate", type=float, default=0.0,
+                    help="fraction of queries answered with 503")
+    args = ap.parse_args()
+    srv = ThreadingHTTPServer((args.host, args.port),
+                              make_handler(Store(args.data), args.delay, args.fail_rate))
+    print(f"Influx stand-in on http://{args.host}:{args.port} "
+          f"(data: {args.data or 'synthetic'})", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# DSN_inputs.py
+# Loading processed DSN data for the analysis tools.
+# Handles both layouts we publish:
+#   Box archive   : UTC,SQM,lum,chisquared,moonalt,LST,sunalt[,Skytemp][,qflag]
+#   Influx export : time (UT),rad (mag/sq asec),...,Moon alt (deg)
+# and uses the per-site manifests (DSN_manifest) to open only the files
+# that overlap a requested time window.  ensure_derived() reuses the
+# LST/sunalt columns DSN_V03 already wrote and computes (vectorized) only
+# what is missing or fails validation, e.g. for Influx exports.
+# load_network() also reads the SQL store (DSN_sqlstore) when given its
+# .sqlite file instead of a directory.
+import os
+import numpy as np
+import pandas as pd
+import DSN_manifest
+import DSN_sqlstore
+from DSN_astro import sun_altitude, local_sidereal_time
+
+#----
+# Influx-export headers -> archive names
+RENAME = {
+    "time (UT)": "UTC",
+    "rad (mag/sq asec)": "SQM",
+    "rad nW/cm2/sr": "lum",
+    "chisquared": "chisquared",
+    "Moon alt (deg)": "moonalt",
+}
+NUMERIC = ("SQM", "lum", "chisquared", "moonalt", "LST", "sunalt", "Skytemp")
+# derived columns we can recompute: valid range, spot-check tolerance
+DERIVED = {
+    "sunalt": (-90.0, 90.0, 0.1),   # deg
+    "LST":    (0.0, 24.0, 0.01),    # hours (36 s)
+}
+#******************
+def load_sites(path="DSNsites.csv"):
+    """DSNsites.csv as a DataFrame; adds 'prefix' (DSN014-S) to 'label'."""
+    sites = pd.read_csv(path, comment='#', header=None,
+                        names=['lon', 'lat', 'el', 'sensor', 'ihead', 'dark',
+                               'bright', 'label'])
+    sites['label'] = sites['label'].astype(str).str.strip()
+    sites['sensor'] = sites['sensor'].astype(str).str.strip()
+    sites['prefix'] = sites['label'].str.split('_').str[0]
+    return sites
+#******************
+def read_processed(path, usecols=None, float_dtype="float32"):
+    """
+    Read one processed CSV (either layout) with archive column names,
+    UTC parsed to tz-aware datetimes and numeric columns as float_dtype.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        header = next((ln for ln in f if ln.strip() and not ln.startswith("#")), "")
+    sep = ";" if header.count(";") > header.count(",") else ","
+    cols = [RENAME.get(c.strip(), c.strip()) for c in header.rstrip("\r\n").split(sep)]
+    want = None
+    if usecols is not None:
+        want = [i for i, c in enumerate(cols) if c in set(usecols) | {"UTC"}]
+    df = pd.read_csv(path, comment='#', sep=sep, header=0, usecols=want)
+    df.columns = [RENAME.get(c.strip(), c.strip()) for c in df.columns]
+    df['UTC'] = pd.to_datetime(df['UTC'], utc=True, errors='coerce')
+    for c in NUMERIC:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype(float_dtype)
+    return df.dropna(subset=['UTC'])
+#******************
+def load_network(directory, start=None, end=None, prefixes=None, usecols=None):
+    """
+    Load every site's files in directory (e.g. DSNdata/BOX_ANALYSIS) into
+    one frame with a categorical 'site' column (DSN014-S, ...), keeping
+    only rows in [start, end].  Files outside the window are never opened.
+    A DSN_sqlstore database file in place of directory is range-queried.
+    """
+    if os.path.isfile(directory) and directory.endswith(DSN_sqlstore.SUFFIX):
+        return DSN_sqlstore.load_network(directory, start, end, prefixes, usecols)
+    if prefixes is None:
+        prefixes = sorted({DSN_manifest.site_prefix(f) for f in os.listdir(directory)
+                           if f.startswith("DSN") and f.endswith(".csv")
+                           and not f.endswith(DSN_manifest.DERIVED_SUFFIXES)})
+    start = pd.to_datetime(start, utc=True) if start is not None else None
+    end = pd.to_datetime(end, utc=True) if end is not None else None
+    parts = []
+    for prefix in prefixes:
+        for name in DSN_manifest.overlapping_files(directory, prefix, start, end):
+            try:
+                df = read_processed(os.path.join(directory, name), usecols)
+            except Exception as e:
+                print(f"⚠️ Skipping {name}: {e}")
+                continue
+            if start is not None:
+                df = df[df['UTC'] >= start]
+            if end is not None:
+                df = df[df['UTC'] <= end]
+            df['site'] = prefix
+            parts.append(df)
+    if not parts:
+        return pd.DataFrame(columns=['UTC', 'site'])
+    out = pd.concat(parts, ignore_index=True)
+    # overlapping archive files repeat samples
+    out = out.drop_duplicates(subset=['site', 'UTC'])
+    out['site'] = out['site'].astype('category')
+    return out
+#******************
+def _compute(col, utc, lat, lon):
+    if col == "sunalt":
+        return sun_altitude(utc, lat, lon)
+    return local_sidereal_time(utc, lon)
+#******************
+def derived_status(df, lat, lon, check=32):
+    """
+    For each DERIVED column: 'missing', 'invalid' (out of range or fails a
+    spot check against a recompute on `check` evenly spaced rows),
+    'partial' (valid but has NaNs) or 'ok'.
+    """
+    status = {}
+    for col, (lo, hi, tol) in DERIVED.items():
+        if col not in df.columns:
+            status[col] = "missing"
+            continue
+        v = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+        good = np.isfinite(v)
+        if not good.any() or ((v[good] < lo) | (v[good] > hi)).any():
+            status[col] = "invalid"
+            continue
+        idx = np.flatnonzero(good)
+        idx = idx[np.linspace(0, idx.size - 1, min(check, idx.size)).astype(int)]
+        ref = _compute(col, df['UTC'].iloc[idx], lat, lon)
+        diff = np.abs(v[idx] - ref)
+        if col == "LST":
+            diff = np.minimum(diff, 24.0 - diff)
+        if diff.max() > tol:
+            status[col] = "invalid"
+        else:
+            status[col] = "ok" if good.all() else "partial"
+    return status
+#******************
+def ensure_derived(df, lat, lon, check=32):
+    """
+    Make sure df has valid sunalt and LST columns for the site at lat/lon,
+    reusing archived values where they pass derived_status() and computing
+    only missing rows/columns.  Modifies df in place; returns the status.
+    """
+    status = derived_status(df, lat, lon, check)
+    for col, st in status.items():
+        if st == "ok":
+            continue
+        if st == "partial":
+            v = pd.to_numeric(df[col], errors="coerce")
+            miss = v.isna().to_numpy()
+            v = v.to_numpy(dtype=float)
+            v[miss] = _compute(col, df['UTC'][miss], lat, lon)
+            df[col] = v
+        else:
+            df[col] = _compute(col, df['UTC'], lat, lon)
+    return status
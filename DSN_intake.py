@@ -0,0 +1,210 @@
+# DSN_intake.py
+# Shared intake step of DSN_rename_sqm_files.py and DSN_rename_tess_files.py.
+#
+# The download folder is scanned once; each file is read once, hashing
+# its content and keeping only the leading bytes needed for the name
+# (year of the first data line) and the TESS "# END OF HEADER" check.
+# All renames are planned first, then applied (already applied ones are
+# undone if one fails), and the sequence table and the processed-file
+# index are written once, atomically (temp file + os.replace).
+#
+# The index (<table>_hashes.csv next to the sequence table) records the
+# sha256 of every file taken in.  A re-downloaded file with the same
+# content is moved to <folder>/.duplicates and so never reaches
+# DSNdata/NEW and DSN_V03.
+#
+#   intake = Intake(folder, "DSNdata/SQMtable.csv")
+#   for entry in intake.scan():            # new, non-duplicate files
+#       n = intake.claim(site)             # next sequence number
+#       intake.add(entry, f"{site}_{yy}_{n:03d}.dat")
+#   intake.commit()
+import os
+import shutil
+import hashlib
+import tempfile
+import datetime
+from collections import namedtuple
+import pandas as pd
+
+#----
+CHUNK = 1 << 16
+HEAD_MAX = 1 << 20          # never keep more than this much header
+TESS_MARKER = b"# END OF HEADER"
+DUP_DIR = ".duplicates"
+INDEX_COLUMNS = ["sha256", "size", "source", "renamed", "added"]
+# one scanned file: head = bytes up to and including the first data line
+Entry = namedtuple("Entry", "path name sha256 size head")
+#******************
+def index_path_for(table_path):
+    """DSNdata/SQMtable.csv -> DSNdata/SQMtable_hashes.csv"""
+    stem, _ = os.path.splitext(table_path)
+    return f"{stem}_hashes.csv"
+#******************
+def write_csv_atomic(df, path):
+    """df.to_csv(path) through a temp file in the same directory."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=".tmp-", suffix=".csv")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            df.to_csv(f, index=False)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+#******************
+def _head_complete(head, eof):
+    """True once head holds a whole first data line (not starting with '#')."""
+    lines = head.split(b"\n")
+    if not eof:
+        lines = lines[:-1]          # last piece may be cut
+    return any(not ln.lstrip().startswith(b"#") for ln in lines) or len(head) >= HEAD_MAX
+#******************
+def scan_file(path, need_head=True):
+    """One read of path: (sha256 hex, size, leading bytes through the first data line)."""
+    h = hashlib.sha256()
+    head, size, done = b"", 0, not need_head
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+            if not done:
+                head += chunk
+                done = _head_complete(head, False)
+    if not done:
+        done = _head_complete(head, True)
+    return h.hexdigest(), size, head
+#******************
+def first_data_line(head):
+    """First line not starting with '#' (after leading blanks), as text."""
+    for ln in head.decode("utf-8", errors="ignore").splitlines():
+        if not ln.lstrip().startswith("#"):
+            return ln
+    return ""
+#******************
+def tess_fix_offset(head):
+    """
+    Offset at which a newline must be inserted after '# END OF HEADER'
+    (data glued to the marker), or None if the file is fine.
+    """
+    i = head.find(TESS_MARKER)
+    if i < 0:
+        return None
+    j = i + len(TESS_MARKER)
+    if j < len(head) and head[j:j+1] != b"\n":
+        return j
+    return None
+#******************
+def _copy_with_newline(src, dst, offset):
+    """Write src to dst with b'\\n' inserted at offset (streamed)."""
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        fo.write(fi.read(offset))
+        fo.write(b"\n")
+        shutil.copyfileobj(fi, fo, CHUNK)
+    shutil.copystat(src, dst)
+#******************
+class Intake:
+    def __init__(self, folder, table_path, index_path=None):
+        self.folder = folder
+        self.table_path = table_path
+        self.index_path = index_path or index_path_for(table_path)
+        self.table = pd.read_csv(table_path)
+        self.table.columns = ['Site', 'Sequence', 'Alias']
+        if os.path.exists(self.index_path):
+            self.index = pd.read_csv(self.index_path, dtype=str)
+        else:
+            self.index = pd.DataFrame(columns=INDEX_COLUMNS)
+        self.known = set(self.index["sha256"])
+        self.plan = []              # (Entry, new name, newline offset or None)
+        self.duplicates = []
+        self.changed = False
+    #----
+    def scan(self, match=None, need_head=True):
+        """
+        Regular, non-hidden files of the folder (name order) for which
+        match(name) is true, minus content duplicates of files already
+        taken in (index) or earlier in this scan, which are set aside.
+        """
+        names = sorted(n for n in os.listdir(self.folder)
+                       if not n.startswith(".") and os.path.isfile(os.path.join(self.folder, n)))
+        seen = set()
+        out = []
+        for name in names:
+            if match is not None and not match(name):
+                continue
+            path = os.path.join(self.folder, name)
+            sha, size, head = scan_file(path, need_head)
+            if sha in self.known or sha in seen:
+                self.duplicates.append(path)
+                continue
+            seen.add(sha)
+            out.append(Entry(path, name, sha, size, head))
+        return out
+    #----
+    def row(self, column, value):
+        """Index of the table row with column == value, or None."""
+        hit = self.table.index[self.table[column] == value]
+        return hit[0] if len(hit) else None
+    #----
+    def claim(self, site, bump_first=False):
+        """
+        Next sequence number for site; the table value is incremented.
+        bump_first: increment, then use (TESS) instead of use, then
+        increment (SQM).
+        """
+        i = self.row('Site', site)
+        seq = int(self.table.at[i, 'Sequence'])
+        self.table.at[i, 'Sequence'] = seq + 1
+        self.changed = True
+        return seq + 1 if bump_first else seq
+    #----
+    def add(self, entry, new_name, newline_at=None):
+        self.plan.append((entry, new_name, newline_at))
+    #----
+    def _apply(self):
+        done = []                   # (src, dst, copied)
+        try:
+            for entry, new_name, newline_at in self.plan:
+                dst = os.path.join(self.folder, new_name)
+                if dst != entry.path and os.path.exists(dst):
+                    raise FileExistsError(dst)
+                if newline_at is None:
+                    os.rename(entry.path, dst)
+                else:
+                    _copy_with_newline(entry.path, dst, newline_at)
+                done.append((entry.path, dst, newline_at is not None))
+        except BaseException:
+            for src, dst, copied in reversed(done):
+                if copied:
+                    os.unlink(dst)
+                else:
+                    os.rename(dst, src)
+            raise
+        for src, dst, copied in done:
+            if copied:
+                os.unlink(src)
+    #----
+    def commit(self):
+        """Set duplicates aside, apply the renames, write table and index."""
+        if self.duplicates:
+            dup_dir = os.path.join(self.folder, DUP_DIR)
+            os.makedirs(dup_dir, exist_ok=True)
+            for path in self.duplicates:
+                os.replace(path, os.path.join(dup_dir, os.path.basename(path)))
+                print(f"Duplicate of an earlier download, skipped: {os.path.basename(path)}")
+        self._apply()
+        for entry, new_name, _ in self.plan:
+            print(f"Renamed: {entry.name} -> {new_name}")
+        if self.changed:
+            write_csv_atomic(self.table, self.table_path)
+            print(f"Updated {os.path.basename(self.table_path)} with new sequence numbers.")
+        if self.plan:
+            now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+            new = pd.DataFrame([[e.sha256, str(e.size), e.name, n, now] for e, n, _ in self.plan],
+                               columns=INDEX_COLUMNS)
+            self.index = pd.concat([self.index, new], ignore_index=True)
+            write_csv_atomic(self.index, self.index_path)
+        return [n for _, n, _ in self.plan]
@@ -0,0 +1,206 @@
+# DSN_manifest.py
+# Per-site time-range manifest for directories of processed CSV files.
+#
+# <dir>/<prefix>_manifest.json lists, for every <prefix>*.csv in <dir>:
+#   utc_min, utc_max (ISO, UTC), rows, columns, sep, size, sha256,
+#   gaps ([start, end] pairs of breaks longer than GAP: missing nights)
+# Writers (DSN_V03, DSN-box_merge, DSN_generate_csv) call update_file()
+# after writing; readers call overlapping_files() to open only the files
+# whose [utc_min, utc_max] intersects the requested window.  An entry is
+# rescanned whenever the file size no longer matches, so a stale or
+# missing manifest costs one scan, never a wrong answer.  coverage_gaps()
+# lists the parts of a window no file has samples for (missing files,
+# site downtime), so readers can tell a complete answer from one with holes.
+#
+# Usage: python DSN_manifest.py DIR [DIR ...]   (rebuild/refresh)
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import pandas as pd
+
+#----
+MANIFEST_SUFFIX = "_manifest.json"
+# column holding the time stamp in the known processed layouts
+TIME_COLUMNS = ("UTC", "time (UT)", "time", "_time")
+# tables DSN_generate_analysis writes back next to its input CSVs
+DERIVED_SUFFIXES = ("_monthly_points.csv", "_nights.csv", "_months.csv",
+                    ".ds.csv")   # downsampled exports (DSN_generate_csv --resolution)
+# a break between samples longer than this is a gap (daytime breaks are shorter)
+GAP = pd.Timedelta(days=1)
+#******************
+def site_prefix(filename):
+    """DSN014-S_25_001.csv -> DSN014-S (the part before the first '_')."""
+    return os.path.basename(filename).split("_", 1)[0]
+#******************
+def manifest_path(directory, prefix):
+    return os.path.join(directory, f"{prefix}{MANIFEST_SUFFIX}")
+#******************
+def load_manifest(directory, prefix):
+    path = manifest_path(directory, prefix)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            man = json.load(f)
+    except (OSError, ValueError):
+        man = {}
+    man.setdefault("prefix", prefix)
+    man.setdefault("files", {})
+    return man
+#******************
+def save_manifest(directory, prefix, man):
+    """Atomic write (tmp file + rename)."""
+    path = manifest_path(directory, prefix)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".manifest-", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(man, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+#******************
+def _iso(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+#******************
+def _sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+#******************
+def scan_file(path):
+    """
+    Read only the time column of one processed CSV and return its
+    manifest entry.  Unreadable times give utc_min/utc_max = None.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        header = ""
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                header = line.rstrip("\r\n")
+                break
+    sep = ";" if header.count(";") > header.count(",") else ","
+    columns = [c.strip() for c in header.split(sep)] if header else []
+    tcol = next((c for c in TIME_COLUMNS if c in columns), columns[0] if columns else None)
+    entry = {"columns": columns, "sep": sep, "rows": 0,
+             "utc_min": None, "utc_max": None, "gaps": [],
+             "size": os.path.getsize(path), "sha256": _sha256(path)}
+    if tcol is None:
+        return entry
+    try:
+        t = pd.read_csv(path, comment="#", sep=sep, usecols=[tcol])[tcol]
+    except Exception:
+        return entry
+    entry["rows"] = int(len(t))
+    t = pd.to_datetime(t, utc=True, errors="coerce").dropna().sort_values()
+    if len(t):
+        entry["utc_min"] = _iso(t.iloc[0])
+        entry["utc_max"] = _iso(t.iloc[-1])
+        brk = (t.diff() > GAP).to_numpy()
+        entry["gaps"] = [[_iso(a), _iso(b)] for a, b in
+                         zip(t.shift(1)[brk], t[brk])]
+    return entry
+#******************
+def update_file(path, prefix=None):
+    """Record (or refresh) one freshly written/merged file in its manifest."""
+    directory = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    prefix = prefix or site_prefix(name)
+    man = load_manifest(directory, prefix)
+    man["files"][name] = scan_file(path)
+    return save_manifest(directory, prefix, man)
+#******************
+def refresh(directory, prefix, exclude=DERIVED_SUFFIXES):
+    """
+    Bring <prefix>_manifest.json in line with the directory: add new
+    files, rescan files whose size changed, drop deleted ones.
+    Returns the manifest dict.
+    """
+    man = load_manifest(directory, prefix)
+    files = man["files"]
+    names = sorted(f for f in os.listdir(directory)
+                   if f.startswith(prefix) and f.endswith(".csv")
+                   and not f.endswith(tuple(exclude)))
+    changed = False
+    for name in names:
+        path = os.path.join(directory, name)
+        ent = files.get(name)
+        if ent is None or ent.get("size") != os.path.getsize(path) or "gaps" not in ent:
+            files[name] = scan_file(path)
+            changed = True
+    for name in set(files) - set(names):
+        del files[name]
+        changed = True
+    if changed:
+        save_manifest(directory, prefix, man)
+    return man
+#******************
+def overlapping_files(directory, prefix, start=None, end=None, exclude=DERIVED_SUFFIXES):
+    """
+    Names of <prefix>*.csv files in directory whose time range overlaps
+    [start, end] (tz-aware or UTC strings; None = open ended).  Files
+    without a known range are always returned.
+    """
+    man = refresh(directory, prefix, exclude)
+    start = pd.to_datetime(start, utc=True) if start is not None else None
+    end = pd.to_datetime(end, utc=True) if end is not None else None
+    keep = []
+    for name, ent in sorted(man["files"].items()):
+        lo, hi = ent.get("utc_min"), ent.get("utc_max")
+        if lo is None or hi is None:
+            keep.append(name)
+            continue
+        if end is not None and pd.Timestamp(lo) > end:
+            continue
+        if start is not None and pd.Timestamp(hi) < start:
+            continue
+        keep.append(name)
+    return keep
+#******************
+def time_span(directory, prefix, exclude=DERIVED_SUFFIXES):
+    """(first, last) UTC Timestamps over all <prefix>*.csv, or (None, None)."""
+    files = refresh(directory, prefix, exclude)["files"].values()
+    lo = [e["utc_min"] for e in files if e.get("utc_min")]
+    hi = [e["utc_max"] for e in files if e.get("utc_max")]
+    if not lo:
+        return None, None
+    return pd.Timestamp(min(lo)), pd.Timestamp(max(hi))
+#******************
+def coverage_gaps(directory, prefix, start, end, gap=GAP, exclude=DERIVED_SUFFIXES):
+    """
+    [(lo, hi), ...] parts of [start, end] longer than gap that no
+    <prefix>*.csv has samples for: before the first file, between files,
+    inside a file's own gaps, after the last.  [] = fully covered.
+    """
+    start, end = pd.to_datetime(start, utc=True), pd.to_datetime(end, utc=True)
+    spans = []
+    for ent in refresh(directory, prefix, exclude)["files"].values():
+        if not ent.get("utc_min") or not ent.get("utc_max"):
+            continue
+        edges = [ent["utc_min"]] + [x for g in ent.get("gaps", []) for x in g] + [ent["utc_max"]]
+        edges = [pd.Timestamp(x) for x in edges]
+        spans += zip(edges[0::2], edges[1::2])
+    holes, cursor = [], start
+    for lo, hi in sorted(spans):
+        if hi < cursor:
+            continue
+        if lo - cursor > gap:
+            holes.append((cursor, min(lo, end)))
+        cursor = max(cursor, hi)
+        if cursor >= end:
+            break
+    if end - cursor > gap:
+        holes.append((cursor, end))
+    return [(lo, hi) for lo, hi in holes if hi - lo > gap]
+#******************
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python DSN_manifest.py DIR [DIR ...]")
+        sys.exit(1)
+    for directory in sys.argv[1:]:
+        prefixes = sorted({site_prefix(f) for f in os.listdir(directory)
+                           if f.endswith(".csv") and not f.endswith(DERIVED_SUFFIXES)})
+        for prefix in prefixes:
+            man = refresh(directory, prefix)
+            rows = sum(e.get("rows", 0) for e in man["files"].values())
+            print(f"{manifest_path(directory, prefix)}: "
+                  f"{len(man['files'])} files, {rows} rows")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_network_analysis.py
+# Network-wide comparison of all DSN sites from one load and one grouped
+# pass over the processed archive (DSNdata/BOX_ANALYSIS by default, or the
+# SQL store DSNdata/dsn.sqlite given as --input_dir).
+#
+# Usage:
+#   python DSN_network_analysis.py [--input_dir DSNdata/BOX_ANALYSIS]
+#          [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--outdir analysis/NETWORK]
+# Writes network_summary.csv/.json, network_monthly.csv and
+# DSN_network.analysis.html (plus a files_<from>_<to> marker) to --outdir.
+import argparse, sys, time, datetime, json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from DSN_inputs import load_network, load_sites
+from DSN_astro import zenith_mwlat
+
+#----
+version_date = "10/19/2026"
+# same cuts as DSN_generate_analysis
+SUN_DARK = -18.0
+MOON_THR = -10.0
+CHI_THR = 0.009
+MW_THR = 20.0
+MODE_BIN = 0.1   # mag, histogram bin for the SQM mode
+#******************
+def network_tables(df, sites):
+    """
+    One grouped pass keyed by site over the loaded archive.
+    Returns (summary per site, monthly per site) DataFrames.
+    """
+    lat = df['site'].map(sites.set_index('prefix')['lat']).astype(float)
+    mwlat = zenith_mwlat(df['LST'], lat)
+    dark = (df['sunalt'] <= SUN_DARK).to_numpy()
+    clear = dark & (df['chisquared'] <= CHI_THR).to_numpy()
+    good = clear & (df['moonalt'] <= MOON_THR).to_numpy() & (mwlat > MW_THR)
+    local = df['UTC'].dt.tz_convert(None) - pd.Timedelta(hours=7)   # MST
+    work = pd.DataFrame({
+        'site': df['site'],
+        'month': local.dt.to_period('M'),
+        'UTC': df['UTC'],
+        'dark': dark,
+        'clear': clear,
+        'SQM_good': df['SQM'].where(good).astype(float),
+    })
+    work['bin'] = np.floor(work['SQM_good'] / MODE_BIN)
+
+    aggs = dict(n=('UTC', 'size'), first=('UTC', 'min'), last=('UTC', 'max'),
+                n_dark=('dark', 'sum'), n_clear=('clear', 'sum'),
+                n_good=('SQM_good', 'count'), SQM_median=('SQM_good', 'median'))
+    summary = work.groupby('site', observed=True).agg(**aggs)
+    monthly = work.groupby(['site', 'month'], observed=True).agg(
+        **{k: v for k, v in aggs.items() if k not in ('first', 'last')})
+
+    # SQM mode: peak of the 0.1-mag histogram of filtered samples
+    hist = work.dropna(subset=['bin']).groupby(['site', 'bin'], observed=True).size()
+    if len(hist):
+        peak = hist.groupby(level='site', observed=True).idxmax().map(lambda k: k[1])
+        summary['SQM_mode'] = (peak + 0.5) * MODE_BIN
+    else:
+        summary['SQM_mode'] = np.nan
+
+    for tab in (summary, monthly):
+        tab['clear_frac'] = tab['n_clear'] / tab['n_dark'].where(tab['n_dark'] > 0)
+    labels = sites.drop_duplicates('prefix').set_index('prefix')['label']
+    summary = summary.reset_index()
+    summary.insert(1, 'label', summary['site'].map(labels).fillna(summary['site']))
+    monthly = monthly.reset_index()
+    monthly['month'] = monthly['month'].astype(str)
+    return (summary.round({'SQM_median': 3, 'SQM_mode': 2, 'clear_frac': 4}),
+            monthly.round({'SQM_median': 3, 'clear_frac': 4}))
+#******************
+def render(summary, monthly, outdir, title_range):
+    """Comparison dashboard: monthly medians, modes, clear fraction, table."""
+    figs = []
+    f1 = go.Figure()
+    for site, g in monthly.groupby('site', observed=True):
+        g = g[g['n_good'] > 0]
+        if len(g):
+            f1.add_trace(go.Scatter(x=g['month'], y=g['SQM_median'],
+                                    mode='lines+markers', name=str(site)))
+    f1.update_layout(title="Monthly median SQM (filtered)", title_x=0.5,
+                     xaxis=dict(title="Month (MST)"),
+                     yaxis=dict(title="SQM (mag/arcsec²)", autorange="reversed"),
+                     width=1050, height=520)
+    figs.append(("monthly", "Monthly medians", f1))
+
+    s = summary.sort_values('SQM_mode', ascending=False)
+    f2 = go.Figure(go.Bar(x=s['label'], y=s['SQM_mode'], marker=dict(color="steelblue"),
+                          hovertemplate="%{x}<br>Mode %{y:.2f}<extra></extra>"))
+    f2.update_layout(title="SQM mode per site (moonalt ≤ −10°, χ² ≤ 0.009, "
+                           f"Zenith-MW > {MW_THR:.0f}°)", title_x=0.5,
+                     yaxis=dict(title="SQM (mag/arcsec²)",
+                                range=[max(15.0, float(np.nanmin(s['SQM_mode'])) - 0.5)
+                                       if s['SQM_mode'].notna().any() else 15.0, 22.5]),
+                     width=1050, height=480)
+    figs.append(("mode", "SQM modes", f2))
+
+    s = summary.sort_values('clear_frac', ascending=False)
+    f3 = go.Figure(go.Bar(x=s['label'], y=100*s['clear_frac'], marker=dict(color="seagreen"),
+                          hovertemplate="%{x}<br>%{y:.1f}% clear<extra></extra>"))
+    f3.update_layout(title="Cloud-free fraction of dark time (χ² ≤ 0.009)", title_x=0.5,
+                     yaxis=dict(title="% of dark samples"), width=1050, height=480)
+    figs.append(("clear", "Clear fraction", f3))
+
+    timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
+    table = summary.assign(
+        first=summary['first'].dt.strftime('%Y-%m-%d'),
+        last=summary['last'].dt.strftime('%Y-%m-%d'),
+        clear_frac=(100*summary['clear_frac']).round(1),
+    ).rename(columns={'clear_frac': 'clear %'}).to_html(index=False, na_rep="–", border=0)
+    html = [f"""<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>DSN network comparison</title>
+  <style>
+    body {{ font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
+           background: #f8fafc; color: #0f172a; margin: 22px 28px; }}
+    table {{ border-collapse: collapse; background: #ffffff; font-size: 14px; }}
+    th, td {{ border: 1px solid #cbd5e1; padding: 4px 8px; text-align: right; }}
+    section {{ margin-bottom: 28px; }}
+  </style>
+</head>
+<body>
+  <h1>DSN network comparison {title_range}</h1>
+  <p>Generated: {timestamp} — <a href="network_summary.csv">summary CSV</a>,
+     <a href="network_monthly.csv">monthly CSV</a>,
+     <a href="network_summary.json">JSON</a></p>
+  <section id="summary"><h2>Summary</h2>
+{table}
+  </section>
+"""]
+    for i, (key, title, fig) in enumerate(figs):
+        js = "cdn" if i == 0 else False
+        html.append(f'  <section id="{key}"><h2>{title}</h2>\n'
+                    + pio.to_html(fig, full_html=False, include_plotlyjs=js)
+                    + "\n  </section>\n")
+    html.append("</body>\n</html>\n")
+    out = outdir / "DSN_network.analysis.html"
+    out.write_text("".join(html), encoding="utf-8")
+    return out
+#******************
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input_dir", default="DSNdata/BOX_ANALYSIS",
+                    help="processed archive directory or DSN_sqlstore .sqlite file")
+    ap.add_argument("--from", dest="from_time")
+    ap.add_argument("--to", dest="to_time")
+    ap.add_argument("--outdir", default="analysis/NETWORK")
+    ap.add_argument("--sites", default="DSNdata/DSNsites.csv")
+    return ap.parse_args()
+#******************
+def main():
+    args = parse_args()
+    print("DSN_network_analysis.py version ", version_date)
+    t0 = time.time()
+    outdir = Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    sites = load_sites(args.sites)
+    df = load_network(args.input_dir, args.from_time, args.to_time,
+                      usecols=["SQM", "chisquared", "moonalt", "LST", "sunalt"])
+    if df.empty:
+        print(f"No data in {args.input_dir} for the requested range.", file=sys.stderr)
+        return 1
+    print(f"📄 Loaded {len(df)} rows for {df['site'].nunique()} sites "
+          f"in {time.time()-t0:.1f} s")
+    summary, monthly = network_tables(df, sites)
+    summary.to_csv(outdir / "network_summary.csv", index=False)
+    monthly.to_csv(outdir / "network_monthly.csv", index=False)
+    lo, hi = df['UTC'].min(), df['UTC'].max()
+    with open(outdir / "network_summary.json", "w", encoding="utf-8") as f:
+        json.dump({"generated": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "from": lo.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "to": hi.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "cuts": {"sunalt": SUN_DARK, "moonalt": MOON_THR,
+                            "chisquared": CHI_THR, "mwlat": MW_THR},
+                   "sites": json.loads(summary.to_json(orient="records",
+                                                       date_format="iso"))},
+                  f, indent=1)
+    out = render(summary, monthly, outdir,
+                 f"[{lo:%Y-%m-%d} to {hi:%Y-%m-%d}]")
+    (outdir / f"files_{lo:%Y%m%d}_{hi:%Y%m%d}").write_text(f"{len(summary)} sites\n")
+    print(f"✅ Wrote {out} ({len(summary)} sites) in {time.time()-t0:.1f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# DSN_publish.py
+# Batched git publishing for generated files (DSN_generate_csv, DSN_service).
+#
+# Requests are queued with submit(paths, message, status) and published
+# together: one fetch, one commit and one push per batch instead of a
+# hard reset/clean/fetch/checkout/commit/push per request.  The sync is
+# `git reset --mixed origin/main`, which moves the branch to the remote
+# tip but leaves the working tree (the freshly written files) alone, so
+# only the queued paths are staged.  A rejected push is retried from a
+# fresh fetch; the last resort is --force-with-lease, as before.
+#
+# Each request's status dict (same shape as DSN_generate_csv prints:
+# status, csv, csv_raw, timestamp) is returned when its batch is done;
+# a failed publish gets a "❌ ..." status and an "error" entry.
+#
+#   q = PublishQueue(repo, interval=5).start()
+#   req = q.submit(["analysis/DSN019-S_MtLemmon"], "Publish CSV ...", status)
+#   req.wait() -> status dict
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+#----
+PUBLISH_INTERVAL = 5.0   # seconds between batches
+PUSH_TRIES = 3
+#******************
+def _git(repo, *args, capture=False):
+    kw = dict(cwd=str(repo), text=True)
+    if capture:
+        kw.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return subprocess.run(["git", *args], **kw)
+#******************
+class PublishRequest:
+    def __init__(self, paths, message, status):
+        self.paths = [str(p) for p in paths]
+        self.message = message
+        self.status = dict(status)
+        self.result = None
+        self.done = threading.Event()
+    #----
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+#******************
+class PublishQueue:
+    def __init__(self, repo, interval=PUBLISH_INTERVAL, remote="origin", branch="main",
+                 tries=PUSH_TRIES):
+        self.repo = Path(repo)
+        self.interval = interval
+        self.remote = remote
+        self.branch = branch
+        self.tries = tries
+        self.pending = []
+        self.lock = threading.Lock()        # guards self.pending
+        self.git_lock = threading.Lock()    # one batch at a time
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.batches = 0
+    #----
+    def submit(self, paths, message, status):
+        req = PublishRequest(paths, message, status)
+        with self.lock:
+            self.pending.append(req)
+        return req
+    #----
+    def pending_paths(self):
+        with self.lock:
+            return {p for r in self.pending for p in r.paths}
+    #----
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="publish", daemon=True)
+        self.thread.start()
+        return self
+    #----
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+    #----
+    def _run(self):
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+    #----
+    def flush(self):
+        """Publish everything queued so far as one batch (in this thread)."""
+        with self.git_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if batch:
+                self._publish(batch)
+    #----
+    def publish_now(self, paths, message, status):
+        """Single request, published immediately (CLI use)."""
+        req = self.submit(paths, message, status)
+        self.flush()
+        return req.result
+    #----
+    def _sync(self):
+        """Move the branch to the remote tip, keeping the working tree."""
+        _git(self.repo, "fetch", self.remote, self.branch, capture=True)
+        ref = f"{self.remote}/{self.branch}"
+        if _git(self.repo, "rev-parse", "--verify", "--quiet", ref, capture=True).returncode == 0:
+            _git(self.repo, "reset", "--mixed", "--quiet", ref)
+    #----
+    def _stage(self, batch):
+        paths = sorted({p for r in batch for p in r.paths})
+        _git(self.repo, "add", "-A", "--", *paths)
+        return _git(self.repo, "diff", "--cached", "--quiet").returncode != 0
+    #----
+    def _publish(self, batch):
+        if len(batch) == 1:
+            msg = batch[0].message
+        else:
+            msg = f"Publish {len(batch)} requests\n\n" + "\n".join(r.message for r in batch)
+        error = None
+        try:
+            for attempt in range(self.tries):
+                self._sync()
+                if not self._stage(batch):
+                    break                                   # nothing new to commit
+                _git(self.repo, "commit", "--quiet", "-m", msg)
+                p = _git(self.repo, "push", self.remote, f"HEAD:{self.branch}", capture=True)
+                if p.returncode == 0:
+                    break
+                print(f"[publish] push rejected (attempt {attempt+1}): {p.stdout.strip()[-200:]}",
+                      file=sys.stderr)
+            else:
+                # last resort, as git_commit_push did
+                self._sync()
+                self._stage(batch)
+                _git(self.repo, "commit", "--quiet", "-m", "republish after reset")
+                p = _git(self.repo, "push", "--force-with-lease", self.remote,
+                         f"HEAD:{self.branch}", capture=True)
+                if p.returncode != 0:
+                    error = p.stdout.strip()[-400:] or "push failed"
+        except Exception as e:
+            error = str(e)
+        self.batches += 1
+        now = int(time.time())
+        for r in batch:
+            st = dict(r.status, timestamp=now)
+            if error:
+                st["status"] = f"❌ Publish failed: {r.message}"
+                st["error"] = error
+            r.result = st
+            r.done.set()
+        print(f"[publish] batch of {len(batch)} {'failed' if error else 'pushed'}", file=sys.stderr)
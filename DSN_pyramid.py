@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_pyramid.py
+# Downsampled SQM pyramids of processed site data, so long-range views
+# need not read the 5-minute rows:
+#   DSNdata/PYRAMID/<site>/5m_<YYYY-MM>.csv   5-minute buckets, one file per
+#                                             month of nights
+#   DSNdata/PYRAMID/<site>/1h.csv             hourly buckets
+#   DSNdata/PYRAMID/<site>/night.csv          one row per night
+# Every level has the columns
+#   t,night,n,n_clear,mean,median,min,max
+# t is the bucket start (UTC, the night's first bucket for the night
+# level), night the local night date (DSN_stats.night_date), n the SQM
+# samples, n_clear those with sunalt <= -18 and chisquared <= 0.009 (as in
+# the night table), then SQM statistics over all samples of the bucket.
+#
+# Updates are incremental per night: new rows replace the 5-minute buckets
+# they cover (the month files of their nights only), and the 1h and night
+# rows of those nights are rebuilt from the 5-minute level.  Hourly and
+# nightly mean/min/max/counts are exact; their median is the median of the
+# 5-minute medians, which is the sample median at the 5-minute cadence of
+# the processed data.
+#
+# The files are derived and rewritten on every DSN_V03 run, so they are
+# git-ignored: the process workflow keeps DSNdata/PYRAMID in the Actions
+# cache and seeds it from DSNdata/BOX_ANALYSIS when the cache has none.
+#
+# Usage:
+#   python DSN_pyramid.py update DSNdata/BOX_ANALYSIS/DSN019-S_24_*.csv
+#   python DSN_pyramid.py query DSN019-S 1h --from 2024-01-01 --to 2024-03-01
+#
+#   from DSN_pyramid import update, read_range, level_for
+#   update("DSN019-S", df)                       # Box columns, UTC
+#   level = level_for("2020-01-01", "2025-01-01") # coarsest level needed
+#   rows = read_range("DSN019-S", level, "2020-01-01", "2025-01-01")
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+import DSN_manifest
+from DSN_intake import write_csv_atomic
+from DSN_stats import night_date, SUN_DARK, CHI_CLEAR
+
+#----
+PYRAMID_DIR = "DSNdata/PYRAMID"
+LEVELS = ("5m", "1h", "night")
+BUCKET = {"5m": pd.Timedelta(minutes=5), "1h": pd.Timedelta(hours=1),
+          "night": pd.Timedelta(hours=24)}
+COLUMNS = ["t", "night", "n", "n_clear", "mean", "median", "min", "max"]
+DTYPES = {"t": "datetime64[ns]", "night": object, "n": np.int64, "n_clear": np.int64,
+          "mean": float, "median": float, "min": float, "max": float}
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"          # as the Box archive UTC column
+MAX_POINTS = 5000                            # level_for default
+#******************
+def level_path(site, level, month=None, directory=PYRAMID_DIR):
+    """File of one level; the 5m level needs the month (YYYY-MM) of the night."""
+    name = f"5m_{month}.csv" if level == "5m" else f"{level}.csv"
+    return os.path.join(directory, site, name)
+#******************
+def _empty():
+    return pd.DataFrame(columns=COLUMNS).astype(DTYPES)
+#******************
+def _read(path):
+    if not os.path.exists(path):
+        return _empty()
+    df = pd.read_csv(path, dtype={"night": str})
+    df["t"] = pd.to_datetime(df["t"], format=TIME_FORMAT)
+    return df.astype(DTYPES)
+#******************
+def _write(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = df.sort_values("t", kind="stable")[COLUMNS]
+    # TIME_FORMAT, without the per-row strftime
+    iso = np.char.add(np.datetime_as_string(out["t"].to_numpy(), unit="s"), "Z")
+    write_csv_atomic(out.assign(t=iso), path)
+#******************
+def base_level(df, ts_col="UTC", sunalt=None, sun_thr=SUN_DARK, chi_thr=CHI_CLEAR):
+    """5-minute level of processed rows (SQM, chisquared, sunalt columns)."""
+    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True, format="ISO8601")
+    g = pd.DataFrame({
+        "t": t.dt.tz_localize(None),
+        "sqm": pd.to_numeric(df["SQM"], errors="coerce"),
+        "sun": pd.to_numeric(df["sunalt"] if sunalt is None else
+                             pd.Series(np.asarray(sunalt), index=df.index), errors="coerce"),
+        "chi": pd.to_numeric(df["chisquared"], errors="coerce"),
+    }).dropna(subset=["t", "sqm"])
+    if g.empty:
+        return _empty()
+    g["clear"] = (g["sun"] <= sun_thr) & (g["chi"] <= chi_thr)
+    g["night"] = pd.Index(night_date(pd.DatetimeIndex(g["t"]))).astype(str)
+    g["t"] = g["t"].dt.floor(BUCKET["5m"])
+    by = g.groupby("t", sort=True)
+    out = by["sqm"].agg(n="count", mean="mean", median="median", min="min", max="max")
+    out["n_clear"] = by["clear"].sum().astype(int)
+    out["night"] = by["night"].first()
+    out = out.reset_index()
+    out[["mean", "median"]] = out[["mean", "median"]].round(3)
+    return out[COLUMNS].astype(DTYPES)
+#******************
+def roll_up(base, level):
+    """1h or night level from 5-minute rows (see module header)."""
+    if base.empty:
+        return _empty()
+    key = base["night"] if level == "night" else base["t"].dt.floor(BUCKET[level])
+    b = base.assign(key=key.to_numpy(), w=base["mean"] * base["n"])
+    by = b.groupby("key", sort=True)
+    out = pd.DataFrame({
+        "t": by["t"].min(), "night": by["night"].first(),
+        "n": by["n"].sum(), "n_clear": by["n_clear"].sum(),
+        "mean": (by["w"].sum() / by["n"].sum()).round(3),
+        "median": by["median"].median().round(3),
+        "min": by["min"].min(), "max": by["max"].max(),
+    })
+    return out.reset_index(drop=True)[COLUMNS].astype(DTYPES)
+#******************
+def update(site, df, ts_col="UTC", directory=PYRAMID_DIR, sunalt=None, clear=False):
+    """
+    Fold processed rows of one site into its pyramid.  The 5-minute
+    buckets of df replace stored ones (clear: all stored buckets in its
+    time range, a reprocessed range); the 1h and night rows of every
+    night df touches are rebuilt.  Returns {level: rows written}.
+    """
+    new = base_level(df, ts_col, sunalt=sunalt)
+    counts = {level: 0 for level in LEVELS}
+    if new.empty:
+        return counts
+    nights = set(new["night"])
+    lo, hi = new["t"].min(), new["t"].max()
+    touched = []
+    for month, part in new.groupby(new["night"].str[:7]):
+        path = level_path(site, "5m", month, directory)
+        old = _read(path)
+        if clear:
+            old = old[~old["t"].between(lo, hi)]
+        merged = pd.concat([old, part], ignore_index=True) \
+                   .drop_duplicates(subset=["t"], keep="last")
+        _write(merged, path)
+        counts["5m"] += len(part)
+        touched.append(merged[merged["night"].isin(nights)])
+    base = pd.concat(touched, ignore_index=True).sort_values("t", kind="stable")
+    for level in ("1h", "night"):
+        path = level_path(site, level, directory=directory)
+        old = _read(path)
+        fresh = roll_up(base, level)
+        _write(pd.concat([old[~old["night"].isin(nights)], fresh], ignore_index=True), path)
+        counts[level] = len(fresh)
+    return counts
+#******************
+def _months(start, end):
+    """YYYY-MM of the nights between UTC times start and end."""
+    first, last = night_date(pd.DatetimeIndex([start, end]))
+    return [p.strftime("%Y-%m") for p in pd.period_range(first, last, freq="M")]
+#******************
+def read_range(site, level, start=None, end=None, directory=PYRAMID_DIR):
+    """Rows of one level with start <= t < end (UTC, naive or ISO strings)."""
+    if level not in LEVELS:
+        raise ValueError(f"unknown level {level!r}, use one of {LEVELS}")
+    lo = pd.Timestamp(start) if start is not None else None
+    hi = pd.Timestamp(end) if end is not None else None
+    lo, hi = [x.tz_convert("UTC").tz_localize(None) if x is not None and x.tzinfo else x
+              for x in (lo, hi)]
+    if level == "5m":
+        if lo is not None and hi is not None:
+            paths = [level_path(site, "5m", m, directory) for m in _months(lo, hi)]
+        else:
+            paths = sorted(glob.glob(os.path.join(directory, site, "5m_*.csv")))
+        parts = [_read(p) for p in paths if os.path.exists(p)]
+        df = pd.concat(parts, ignore_index=True) if parts else _read("")
+    else:
+        df = _read(level_path(site, level, directory=directory))
+    t = pd.to_datetime(df["t"])
+    keep = np.ones(len(df), dtype=bool)
+    if lo is not None:
+        keep &= (t >= lo).to_numpy()
+    if hi is not None:
+        keep &= (t < hi).to_numpy()
+    return df[keep].reset_index(drop=True)
+#******************
+def level_for(start, end, max_points=MAX_POINTS):
+    """Finest level with at most max_points buckets between start and end."""
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for level in LEVELS:
+        if span / BUCKET[level] <= max_points:
+            return level
+    return LEVELS[-1]
+#******************
+def update_files(paths, site=None, directory=PYRAMID_DIR):
+    """update() from Box-format CSV files; site defaults to the file prefix."""
+    for path in paths:
+        if path.endswith(DSN_manifest.DERIVED_SUFFIXES):
+            continue
+        df = pd.read_csv(path, dtype={"UTC": str})
+        label = site or DSN_manifest.site_prefix(os.path.basename(path))
+        counts = update(label, df, directory=directory)
+        print(f"✅ {path}: {label} " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("update", help="add processed Box-format CSV files")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--site", help="default: file name prefix (DSN019-S)")
+    p.add_argument("--dir", default=PYRAMID_DIR)
+    q = sub.add_parser("query", help="print one level of one site")
+    q.add_argument("site")
+    q.add_argument("level", choices=LEVELS)
+    q.add_argument("--from", dest="start")
+    q.add_argument("--to", dest="end")
+    q.add_argument("--dir", default=PYRAMID_DIR)
+    args = ap.parse_args()
+    if args.cmd == "update":
+        update_files(args.files, args.site, args.dir)
+    else:
+        df = read_range(args.site, args.level, args.start, args.end, args.dir)
+        df.assign(t=df["t"].dt.strftime(TIME_FORMAT)).to_csv(sys.stdout, index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
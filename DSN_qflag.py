@@ -0,0 +1,158 @@
+# DSN_qflag.py
+# Quality-flag stage of DSN_V03: marks single-sample glitches and level
+# shifts in the SQM series, per night, as bits of a small integer column
+# 'qflag' written with the Box archive and Influx outputs:
+#   QF_SPIKE (1)  sample far from the centered rolling median of its
+#                 neighbours (|SQM - med| > max(nsig * 1.4826 * MAD, min_dev))
+#   QF_STEP  (2)  first sample of a persistent level change: the medians of
+#                 the windows before and after it differ by more than
+#                 max(nsig * noise, min_step), noise being the larger
+#                 IQR/1.349 of the two windows (a smooth twilight/moon ramp
+#                 gives a ratio near 3 and is not flagged), most of which
+#                 (STEP_SHARE) happens between two consecutive samples,
+#                 also of the change over the three steps around it (a
+#                 ramp spreads its change over neighbouring samples)
+# 0 = no flag.  Only astronomical night is tested: given the sun altitude,
+# samples with sunalt > SUN_DARK are left out of the windows and never
+# flagged (twilight ramps are steep and curved).  Everything is rolling
+# medians over groupby(night), so the cost is linear in the number of
+# samples (times log window).
+#
+# Parameters are per sensor type (SENSOR_PARAMS); None switches the stage
+# off for that sensor, as does listing it in the environment variable
+# DSN_QFLAG_OFF (comma separated, e.g. DSN_QFLAG_OFF=SQM1,TESS).
+#
+#   from DSN_qflag import qflag_params, quality_flags
+#   params = qflag_params(sensor_name)
+#   if params: qflag, counts = quality_flags(SQM, night_count, sunalt=sunalt, **params)
+#
+#   python DSN_qflag.py        (check: smooth ramps and dusk raise no flags)
+import os
+import numpy as np
+import pandas as pd
+
+#----
+QF_SPIKE = 1
+QF_STEP = 2
+MAD_SIGMA = 1.4826      # MAD -> sigma for Gaussian noise
+IQR_SIGMA = 1.349       # IQR -> sigma
+STEP_SHARE = 0.6        # fraction of a step taken in one sample
+SIGMA_FLOOR = 0.02      # mag, readings are quantized to 0.01
+SUN_DARK = -18.0        # astronomical night, as DSN_stats
+# window lengths in samples (5 min cadence unless noted)
+DEFAULT_PARAMS = dict(spike_window=5, spike_nsig=5.0, min_dev=0.5,
+                      step_window=6, step_nsig=5.0, min_step=0.5)
+SENSOR_PARAMS = {
+    "SQM":  DEFAULT_PARAMS,
+    "SQM2": DEFAULT_PARAMS,
+    "SQM3": DEFAULT_PARAMS,
+    "SQM4": DEFAULT_PARAMS,
+    "TESS": DEFAULT_PARAMS,
+    "TESS1": DEFAULT_PARAMS,
+    # Sugarloaf/Bonita .xlsx, 10 min cadence: shorter windows in samples
+    "SQM1": dict(DEFAULT_PARAMS, spike_window=3, step_window=4),
+}
+#******************
+def qflag_params(sensor):
+    """Parameters for sensor type, or None if the stage is off for it."""
+    off = {s.strip() for s in os.environ.get("DSN_QFLAG_OFF", "").split(",") if s.strip()}
+    if sensor in off:
+        return None
+    return SENSOR_PARAMS.get(sensor, DEFAULT_PARAMS)
+#******************
+def _rolling(g, window, func, center=False, min_periods=None, **kw):
+    if min_periods is None:
+        min_periods = max(2, window // 2 + 1)
+    r = g.rolling(window, min_periods=min_periods, center=center)
+    return getattr(r, func)(**kw).reset_index(level=0, drop=True).sort_index()
+#******************
+def spike_mask(s, night, window, nsig, min_dev):
+    g = s.groupby(night, sort=False)
+    med = _rolling(g, window, "median", center=True)
+    dev = (s - med).abs()
+    mad = _rolling(dev.groupby(night, sort=False), window, "median", center=True)
+    thr = np.maximum(nsig * np.maximum(MAD_SIGMA * mad, SIGMA_FLOOR), min_dev)
+    return (dev > thr).to_numpy()
+#******************
+def step_mask(s, night, window, nsig, min_step, exclude=None):
+    """
+    Level changes between the window samples before i and i..i+window-1.
+    Samples in exclude (spikes) are left out of the windows.
+    """
+    if exclude is not None:
+        s = s.mask(exclude)
+    g = s.groupby(night, sort=False)
+    # trailing windows, at most one sample missing, so night edges are not flagged
+    n = max(2, window - 1)
+    med = _rolling(g, window, "median", min_periods=n)
+    iqr = (_rolling(g, window, "quantile", min_periods=n, q=0.75)
+           - _rolling(g, window, "quantile", min_periods=n, q=0.25))
+    ahead = lambda x: x.groupby(night, sort=False).shift(-(window - 1))
+    behind = lambda x: x.groupby(night, sort=False).shift(1)
+    # spread of the windows: IQR/1.349 (a ramp has a large one, a flat level not)
+    noise = np.maximum(np.fmax(behind(iqr), ahead(iqr)) / IQR_SIGMA, SIGMA_FLOOR)
+    jump = (ahead(med) - behind(med)).abs()
+    # abrupt: most of the change between two consecutive samples, and
+    # not one step of a ramp (neighbouring steps of similar size)
+    d = g.diff().abs()
+    around = d.groupby(night, sort=False).shift(1).fillna(0) + d \
+        + d.groupby(night, sort=False).shift(-1).fillna(0)
+    sharp = d >= STEP_SHARE * np.fmax(jump, around)
+    cand = (jump > np.maximum(nsig * noise, min_step)) & sharp
+    # one flag per step: the candidate with the largest change within
+    # +-window (jump itself is flat across a step)
+    score = d.where(cand)
+    peak = score >= _rolling(score.groupby(night, sort=False), 2 * window + 1, "max",
+                             center=True, min_periods=1)
+    return (cand & peak).to_numpy()
+#******************
+def quality_flags(sqm, night, spike_window, spike_nsig, min_dev,
+                  step_window, step_nsig, min_step, sunalt=None, sun_thr=SUN_DARK):
+    """
+    uint8 flag array for the SQM series sqm (time ordered) split into
+    nights by the integer array night, and the {"spike", "step"} counts.
+    With sunalt, only samples with sunalt <= sun_thr are tested.
+    """
+    s = pd.Series(np.asarray(sqm, dtype=float))
+    if sunalt is not None:
+        s = s.where(np.asarray(sunalt, dtype=float) <= sun_thr)
+    night = pd.Series(np.asarray(night)).to_numpy()
+    spikes = spike_mask(s, night, spike_window, spike_nsig, min_dev)
+    steps = step_mask(s, night, step_window, step_nsig, min_step, exclude=spikes)
+    flags = np.zeros(len(s), dtype=np.uint8)
+    flags[spikes] |= QF_SPIKE
+    flags[steps] |= QF_STEP
+    return flags, {"spike": int(spikes.sum()), "step": int(steps.sum())}
+#******************
+def check(cadence_min=5.0, sensor="SQM"):
+    """
+    Flags on synthetic nights that must stay clean: a smooth dusk-night-
+    dawn curve (twilight ramps included), a slow moon ramp and a linear
+    ramp, with 0.02 mag noise.  Returns {case: counts}.
+    """
+    rng = np.random.default_rng(1)
+    params = SENSOR_PARAMS.get(sensor, DEFAULT_PARAMS)
+    n = int(12 * 60 / cadence_min)
+    h = np.arange(n) * cadence_min / 60                 # hours since sunset
+    sun = -3 - 60 * np.sin(np.pi * h / 12)              # -3 .. -63 .. -3
+    dark_sky = 21.5 - 0.25 * np.clip(sun + 18, 0, None) * (sun > -18) \
+        - 1.0 * np.clip((sun + 18) / 15, 0, 1)
+    cases = {"twilight": dark_sky,
+             "moon": 21.5 - 2.0 * np.clip((h - 4) / 6, 0, 1),
+             "linear": np.linspace(18.0, 22.0, n)}
+    out = {}
+    for name, y in cases.items():
+        y = y + rng.normal(0, 0.02, n)
+        _, counts = quality_flags(y, np.zeros(n, dtype=int), sunalt=sun, **params)
+        out[name] = counts
+    return out
+
+if __name__ == "__main__":
+    import sys
+    bad = 0
+    for sensor, cadence in (("SQM", 5.0), ("SQM1", 10.0), ("TESS", 5.0)):
+        for name, counts in check(cadence, sensor).items():
+            ok = counts["spike"] == 0 and counts["step"] == 0
+            bad += not ok
+            print(f"{'✅' if ok else '❌'} {sensor} {name}: {counts}")
+    sys.exit(1 if bad else 0)
@@ -1,24 +1,18 @@
 import os
-import pandas as pd
 import re
 import sys
+from DSN_intake import Intake, first_data_line
 
-def extract_year_from_file(filepath):
-    """Extracts last two digits of the year (YY) from first data line """
+def extract_year_from_file(filepath, head=b""):
+    """Extracts last two digits of the year (YY) from first data line
+       (head: the file's leading bytes, as read by DSN_intake.scan_file)"""
     _, sqm_ext = os.path.splitext(filepath)
     sqm_ext = sqm_ext.lower()
-    with open(filepath, "r",encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            if not line.lstrip().startswith("#"):
-                break
     if sqm_ext in ['.dat', '.csv']:
-        with open(filepath, "r",encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                if not line.lstrip().startswith("#"):
-                    break
+        line = first_data_line(head)
         match = re.search(r'20(\d{2})', line)  # Matches 20xx
     elif (sqm_ext == '.xlsx'):
-         match =re.search(r'^[^_]*_(.{2})', filepath)
+         match =re.search(r'^[^_]*_(.{2})', os.path.basename(filepath))
     else:    
         print(f"Error: file {filepath} wrong extension.")
         sys.exit(1)
@@ -29,48 +23,30 @@ def extract_year_from_file(filepath):
  #
 def rename_files_and_update_table(sqm_folder, sqm_table_path):
     """Rename files using the Site name and update \
-       SQMtable.csv with incremented sequence numbers."""
+       SQMtable.csv with incremented sequence numbers.
+       All renames are planned first and SQMtable.csv is written once
+       (DSN_intake); re-downloaded duplicates are set aside."""
 
     if not os.path.exists(sqm_table_path):
         print(sqm_table_path," not found, Skip.")
         return
 #
-    site_name = os.path.basename(sqm_folder)
+    site_name = os.path.basename(os.path.normpath(sqm_folder))
 #
-    sqm_table = pd.read_csv(sqm_table_path)
-    sqm_table.columns = ['Site', 'Sequence','Alias']
+    intake = Intake(sqm_folder, sqm_table_path)
 #
-    row = sqm_table.loc[sqm_table['Site'] == site_name]
-#    print(row)
-    if row.empty:
+    if intake.row('Site', site_name) is None:
         print(f"Site {site_name} not found in SQMtable.csv, Skip.")
         return
 #
-    seq_number = int(row['Sequence'].values[0])
-#    all_items = os.listdir(sqm_folder)
-#    if all_items and all(f.startswith("DSN") for f in all_items):
-#        print("Files already labeled, skip.")
-#        return
-#    print(sqm_folder,"\n",seq_number)
-    for filename in os.listdir(sqm_folder):
-        file_path = os.path.join(sqm_folder, filename)
-        _, sqm_ext = os.path.splitext(filename)
-        # Create new filename if needed
-        if (not filename.startswith("DSN")):
-            # Extract year from file
-            year = extract_year_from_file(file_path)
-            new_filename = f"{site_name}_{year}_{seq_number:03d}{sqm_ext}"
-            new_filepath = os.path.join(sqm_folder, new_filename)
-            # Rename the file
-            os.rename(file_path, new_filepath)
-            print(f"Renamed: {filename} -> {new_filename}")
-        # Save updated SQMtable.csv
-        # Increment sequence number
-        seq_number += 1
-        sqm_table.loc[sqm_table['Site'] == site_name, 'Sequence'] \
-            = seq_number  # Update sequence
-        sqm_table.to_csv(sqm_table_path, index=False)
-        print("Updated SQMtable.csv with new sequence numbers.")
+    # files already labeled DSN* are left alone
+    for entry in intake.scan(match=lambda name: not name.startswith("DSN")):
+        _, sqm_ext = os.path.splitext(entry.name)
+        # Extract year from file
+        year = extract_year_from_file(entry.path, entry.head)
+        seq_number = intake.claim(site_name)
+        intake.add(entry, f"{site_name}_{year}_{seq_number:03d}{sqm_ext}")
+    intake.commit()
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -1,74 +1,51 @@
 import os
-import pandas as pd
 import re
 import sys
-from pathlib import Path
+from DSN_intake import Intake, tess_fix_offset
 
-def extract_year_from_file(filepath):
-    """Extracts the first two digits of the year (YY) from the first data entry after # comments."""
-    try:
-        with open(filepath, 'r') as file:
-            for line in file:
-                if not line.startswith('#'):
-                    match = re.search(r'\b(20\d{2})\b', line)  # Match a year (e.g., 2025)
-                    if match:
-                        return match.group(1)[2:]  # Return last two digits of year
-    except Exception as e:
-        print(f"Error reading file {filepath}: {e}")
+def extract_year_from_file(head):
+    """Extracts the last two digits of the year (YY) from the first data entry after # comments.
+       head: the file's leading bytes (DSN_intake.scan_file), header newline already fixed."""
+    for line in head.decode("utf-8", errors="ignore").splitlines():
+        if not line.startswith('#'):
+            match = re.search(r'\b(20\d{2})\b', line)  # Match a year (e.g., 2025)
+            if match:
+                return match.group(1)[2:]  # Return last two digits of year
     return "00"  # Default if no year is found
 
 def rename_files_and_update_table(tess_folder, tess_table_path):
     """Rename files using the Site name and update \
-       TESStable.csv with incremented sequence numbers."""
+       TESStable.csv with incremented sequence numbers.
+       All renames are planned first and TESStable.csv is written once
+       (DSN_intake); re-downloaded duplicates are set aside."""
 
     if not os.path.exists(tess_table_path):
         print(tess_table_path," not found, Skip.")
         return
     #
-    tess_table = pd.read_csv(tess_table_path)
-    tess_table.columns = ['Site', 'Sequence','Alias']
+    intake = Intake(tess_folder, tess_table_path)
     #
-    directory = Path(tess_folder)
-    files_only = [f for f in directory.iterdir() if f.is_file() \
-                  and not f.name.startswith('.')]    #
-    files_s = [f for f in files_only if "stars" in f.name]
-    print("******** files_s : ",files_s)
-    for file_path in files_s:
-        print(" file_path ",file_path)
-        filename = os.path.basename(file_path)
-        alias_name = filename.split('_')[0]
-        row = tess_table.loc[tess_table['Alias'] == alias_name]
-        if row.empty:
+    files_s = intake.scan(match=lambda name: "stars" in name)
+    print("******** files_s : ",[e.name for e in files_s])
+    for entry in files_s:
+        alias_name = entry.name.split('_')[0]
+        i = intake.row('Alias', alias_name)
+        if i is None:
             print(f"Alias {alias_name} not found in ",tess_table_path," Skip.")
-            return
-        seq_number = int(row['Sequence'].values[0])
-        site_name = row['Site'].values[0]
-        #
-        with open(file_path,"r") as f:
-            content=f.read()
-        marker = "# END OF HEADER"
-        if marker in content:
-            parts = content.split(marker, 1)
-            # If after marker is non-blank, insert newline
-            if parts[1] and not parts[1].startswith("\n"):
-                content = parts[0] + marker + "\n" + parts[1]
-            # Save back
-            with open(file_path, "w") as f:
-                f.write(content)
+            continue
+        site_name = intake.table.at[i, 'Site']
+        # data glued to "# END OF HEADER": a newline goes in while renaming
+        head = entry.head
+        fix_at = tess_fix_offset(head)
+        if fix_at is not None:
+            head = head[:fix_at] + b"\n" + head[fix_at:]
         # Extract year from file
-        year = extract_year_from_file(file_path)
+        year = extract_year_from_file(head)
         # Increment sequence number
-        seq_number += 1
-        tess_table.loc[tess_table['Site'] == site_name, 'Sequence'] = seq_number  # Update sequence
+        seq_number = intake.claim(site_name, bump_first=True)
         # Create new filename
-        new_filename = f"{site_name}_{year}_{seq_number:03d}.dat"
-        new_filepath = os.path.join(tess_folder, new_filename)
-        # Rename the file
-        os.rename(file_path, new_filepath)
-        print(f"Renamed: {filename} -> {new_filename}")
-    # Save updated TESStable.csv
-    tess_table.to_csv(tess_table_path, index=False)
-    print("Updated TESStable.csv with new sequence numbers.")
+        intake.add(entry, f"{site_name}_{year}_{seq_number:03d}.dat", newline_at=fix_at)
+    intake.commit()
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_reprocess.py
+# Rebuild the processed archive from raw SQM/TESS files, e.g. after a
+# zeropoint (mag_zero, fnwcm2sr) or cloud-algorithm change in DSN_V03.
+#
+#   python DSN_reprocess.py [--raw DIR ...] [--out DSNdata/REPROCESSED]
+#                           [--workers N] [--sites DSN021-S,DSN022-S] [--restart]
+#                           [--stores DSNdata]
+#
+# Raw files (.dat/.csv/.txt/.xlsx; Influx-annotated CSVs are not raw and
+# are skipped) are grouped by site (DSN021S_VATT_25_001.dat -> DSN021-S) and
+# ordered by their first time stamp.  Sites run in parallel, one worker
+# process each.  Within a site the files run in order, each through an
+# unchanged `python DSN_V03.py FILE` in a scratch directory of its own,
+# and its Box rows are merged into fresh per-site, per-year archives:
+#   <out>/<site>_<yy>.csv   (+ <site>_manifest.json, see DSN_manifest)
+#   <out>/NIGHTS/<site>_nights.csv   per-night table (DSN_stats.night_table)
+# Rows of a later file replace rows with the same UTC.
+#
+# Resumable: <out>/.state/<site>.json records each finished raw file
+# (size, mtime) and a hash of DSN_V03.py/DSN_qflag.py/DSNsites.csv.  A rerun
+# skips finished files.  A site starts over if the code or site table
+# changed or a finished file was modified.  Logs of each DSN_V03 run go to
+# <out>/logs/, the run report to <out>/reprocess_report.json.
+#
+# With --stores (opt-in, e.g. DSNdata), the stores derived from the
+# archive that exist under it,
+#   PYRAMID/<site>/ (DSN_pyramid), BIN/<site>.dsnb (DSN_binarchive),
+#   dsn.sqlite rows of the site (DSN_sqlstore),
+# get a site's reprocessed values once it is done: the site's rows are
+# split where samples are more than a day apart, and only the time range
+# of each piece is replaced, so the rest of the site's history is kept.
+# The SQL store marks the archive files ingested over those ranges stale
+# (DSN_sqlstore.stale_files), so DSN_generate_csv --backend auto answers
+# them from the archive until it is ingested again.
+# <out>/.state/<site>.stores.json records the archive files (SHA-256) the
+# stores were refreshed from; an unchanged site is not applied again.
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import datetime
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+import DSN_manifest
+import DSN_stats
+import DSN_xlsx
+import DSN_pyramid
+import DSN_binarchive
+import DSN_sqlstore
+from DSN_intake import write_csv_atomic
+
+#----
+HERE = os.path.dirname(os.path.abspath(__file__))
+V03 = os.path.join(HERE, "DSN_V03.py")
+CODE_FILES = ("DSN_V03.py", "DSN_qflag.py")
+RAW_DIRS = ["DSNdata/SAVE"]
+OUT_DIR = "DSNdata/REPROCESSED"
+SITES_CSV = "DSNdata/DSNsites.csv"
+RAW_SUFFIXES = (".dat", ".csv", ".txt", ".xlsx")
+SITE_RE = re.compile(r"^(DSN\d{3})-?([A-Z])")
+REPORT_NAME = "reprocess_report.json"
+#******************
+def site_key(name):
+    """DSN021S_VATT_25_001.dat -> DSN021-S; other names: the part before '_'."""
+    m = SITE_RE.match(name)
+    return f"{m.group(1)}-{m.group(2)}" if m else name.split("_", 1)[0]
+#******************
+def first_time(path, max_lines=500):
+    """First data time stamp of a raw text file (as written), None if not found."""
+    if path.endswith(".xlsx"):
+        return None
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for i, line in enumerate(f):
+            if i >= max_lines:
+                break
+            if line.startswith("#"):
+                continue
+            first = re.split(r"[;,]", line, 1)[0].strip()
+            if first[:4].isdigit():
+                return first
+    return None
+#******************
+def is_raw(path):
+    """Not an Influx-annotated export (what DSN_V03 writes to DSNdata/INFLUX)."""
+    if path.endswith(".xlsx"):
+        return True
+    with open(path, "rb") as f:
+        return not f.read(64).startswith(b"#group")
+#******************
+def discover(raw_dirs, sites=None):
+    """{site: [raw paths in time order]}"""
+    found = {}
+    for d in raw_dirs:
+        for name in sorted(os.listdir(d)):
+            path = os.path.join(d, name)
+            if name.startswith(".") or not name.endswith(RAW_SUFFIXES) or not os.path.isfile(path):
+                continue
+            if not is_raw(path):
+                continue
+            site = site_key(name)
+            if sites and site not in sites:
+                continue
+            found.setdefault(site, []).append(path)
+    for site, paths in found.items():
+        paths.sort(key=lambda p: (first_time(p) or "", os.path.basename(p)))
+    return found
+#******************
+def config_hash(sites_csv):
+    h = hashlib.sha256()
+    for path in [os.path.join(HERE, f) for f in CODE_FILES] + [sites_csv]:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+#******************
+def _stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+#******************
+class SiteState:
+    def __init__(self, out, site, config):
+        self.path = os.path.join(out, ".state", f"{site}.json")
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+        except (OSError, ValueError):
+            st = {}
+        self.fresh = st.get("config") != config
+        self.state = {"config": config, "done": {} if self.fresh else st.get("done", {})}
+    #----
+    def finished(self, path):
+        e = self.state["done"].get(os.path.basename(path))
+        return e is not None and {k: e.get(k) for k in ("size", "mtime_ns")} == _stamp(path)
+    #----
+    def changed(self, paths):
+        """True if a finished file is gone or was modified (the site must start over)."""
+        names = {os.path.basename(p): p for p in paths}
+        return any(n not in names or not self.finished(names[n]) for n in self.state["done"])
+    #----
+    def record(self, path, **info):
+        self.state["done"][os.path.basename(path)] = dict(_stamp(path), **info)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+#******************
+def archive_files(out, site):
+    return sorted(n for n in os.listdir(out)
+                  if n.startswith(f"{site}_") and n.endswith(".csv"))
+#******************
+def merge_rows(out, site, rows):
+    """Merge Box rows (str frame) into <out>/<site>_<yy>.csv; returns the files touched."""
+    touched = []
+    years = rows["UTC"].str[2:4]
+    for yy, part in rows.groupby(years, sort=True):
+        path = os.path.join(out, f"{site}_{yy}.csv")
+        if os.path.exists(path):
+            old = pd.read_csv(path, dtype=str, keep_default_na=False)
+            cols = list(old.columns) + [c for c in part.columns if c not in old.columns]
+            part = pd.concat([old, part], ignore_index=True).reindex(columns=cols).fillna("")
+        part = part.drop_duplicates(subset=["UTC"], keep="last")
+        part = part.sort_values("UTC", kind="stable")
+        write_csv_atomic(part, path)
+        DSN_manifest.update_file(path, site)
+        touched.append(os.path.basename(path))
+    return touched
+#******************
+def run_v03(raw, scratch, log_path):
+    """
+    DSN_V03 on one raw file in scratch; returns (Box rows or None, metrics,
+    night tables {name: frame}, exit code).  The Influx output is discarded.
+    """
+    for sub in ("DSNdata/BOX", "DSNdata/INFLUX", "DSNdata/NIGHTS"):
+        shutil.rmtree(os.path.join(scratch, sub), ignore_errors=True)
+        os.makedirs(os.path.join(scratch, sub))
+    metrics = os.path.join(scratch, "DSNdata", "RUN_METRICS.jsonl")
+    if os.path.exists(metrics):
+        os.unlink(metrics)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    env.pop("TESTING", None)
+    # parsed SQM1 workbooks are shared between runs, not left in scratch
+    env.setdefault("DSN_XLSX_CACHE", os.path.abspath(DSN_xlsx.default_cache_dir()))
+    with open(log_path, "w", encoding="utf-8") as log:
+        rc = subprocess.call([sys.executable, V03, os.path.abspath(raw)], cwd=scratch,
+                             env=env, stdout=log, stderr=subprocess.STDOUT)
+    box = os.path.join(scratch, "DSNdata", "BOX")
+    outs = [n for n in os.listdir(box) if n.endswith(".csv")]
+    rows = pd.read_csv(os.path.join(box, outs[0]), dtype=str, keep_default_na=False) if outs else None
+    nights_dir = os.path.join(scratch, "DSNdata", "NIGHTS")
+    nights = {n: pd.read_csv(os.path.join(nights_dir, n), dtype={"night": str})
+              for n in os.listdir(nights_dir) if n.endswith("_nights.csv")}
+    info = {}
+    if os.path.exists(metrics):
+        with open(metrics, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        info = json.loads(lines[-1]) if lines else {}
+    return rows, info, nights, rc
+#******************
+def reprocess_site(site, paths, out, sites_csv, config):
+    """Worker: all raw files of one site, in order.  Returns the site's report entry."""
+    t0 = time.time()
+    state = SiteState(out, site, config)
+    if state.fresh or state.changed(paths):
+        state.state["done"] = {}
+        for name in archive_files(out, site):
+            os.unlink(os.path.join(out, name))
+        for name in (os.listdir(os.path.join(out, "NIGHTS")) if os.path.isdir(os.path.join(out, "NIGHTS")) else []):
+            if name.startswith(f"{site}_"):
+                os.unlink(os.path.join(out, "NIGHTS", name))
+        if os.path.exists(DSN_manifest.manifest_path(out, site)):
+            os.unlink(DSN_manifest.manifest_path(out, site))
+    logs = os.path.join(out, "logs")
+    os.makedirs(logs, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=f".scratch-{site}-", dir=out)
+    shutil.copy(sites_csv, os.path.join(scratch, "DSNsites.csv"))
+    report = {"files": len(paths), "processed": 0, "resumed": 0, "empty": [], "failed": [],
+              "rows": 0, "stages": {}}
+    try:
+        for raw in paths:
+            name = os.path.basename(raw)
+            if state.finished(raw):
+                report["resumed"] += 1
+                continue
+            f0 = time.time()
+            log_path = os.path.join(logs, f"{os.path.splitext(name)[0]}.log")
+            rows, info, nights, rc = run_v03(raw, scratch, log_path)
+            if rc != 0:
+                report["failed"].append({"file": name, "rc": rc, "log": os.path.relpath(log_path, out)})
+                print(f"❌ {site}: {name} failed (exit {rc}), see {log_path}", flush=True)
+                continue
+            n = 0
+            if rows is None or rows.empty:
+                report["empty"].append(name)
+            else:
+                merge_rows(out, site, rows)
+                n = len(rows)
+            for nname, table in nights.items():
+                DSN_stats.upsert_nights(os.path.join(out, "NIGHTS", nname), table)
+            for k, v in info.get("stages", {}).items():
+                report["stages"][k] = round(report["stages"].get(k, 0) + v, 3)
+            state.record(raw, rows=n, seconds=round(time.time() - f0, 2), qflag=info.get("qflag"))
+            report["processed"] += 1
+            print(f"✅ {site}: {name} -> {n} rows ({time.time() - f0:.1f} s)", flush=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    report["rows"] = sum(e.get("rows", 0) for e in state.state["done"].values())
+    report["archives"] = archive_files(out, site)
+    report["seconds"] = round(time.time() - t0, 1)
+    return site, report
+#******************
+def covered_ranges(out, site, gap=DSN_manifest.GAP):
+    """The site's rows in out, split where samples are more than gap apart."""
+    paths = [os.path.join(out, n) for n in archive_files(out, site)]
+    if not paths:
+        return []
+    rows = pd.concat([pd.read_csv(p, dtype={"UTC": str}) for p in paths], ignore_index=True)
+    t = pd.to_datetime(rows["UTC"], errors="coerce", utc=True, format="ISO8601")
+    rows = rows[t.notna()].iloc[np.argsort(t[t.notna()].to_numpy(), kind="stable")]
+    t = pd.to_datetime(rows["UTC"], utc=True, format="ISO8601")
+    piece = (t.diff() > gap).cumsum().to_numpy()
+    return [part for _, part in rows.groupby(piece, sort=True)]
+#******************
+def refresh_stores(out, site, stores):
+    """
+    Replace, in the existing derived stores under stores, the site's
+    values in the time ranges its reprocessed rows cover (see header).
+    Returns the stores refreshed.
+    """
+    marker = os.path.join(out, ".state", f"{site}.stores.json")
+    files = DSN_manifest.refresh(out, site)["files"]
+    sig = {"stores": os.path.abspath(stores),
+           "archives": {n: e.get("sha256") for n, e in sorted(files.items())}}
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == sig:
+                return []
+    except (OSError, ValueError):
+        pass
+    pieces = covered_ranges(out, site)
+    done = []
+    pyramid = os.path.join(stores, os.path.basename(DSN_pyramid.PYRAMID_DIR))
+    if os.path.isdir(pyramid):
+        for part in pieces:
+            DSN_pyramid.update(site, part, directory=pyramid, clear=True)
+        done.append("PYRAMID")
+    bin_dir = os.path.join(stores, os.path.basename(DSN_binarchive.BIN_DIR))
+    if os.path.isdir(bin_dir):
+        for part in pieces:
+            DSN_binarchive.append(site, part, directory=bin_dir, clear=True)
+        done.append("BIN")
+    db = os.path.join(stores, os.path.basename(DSN_sqlstore.DB_PATH))
+    if os.path.exists(db):
+        con = DSN_sqlstore.connect(db)
+        for part in pieces:
+            DSN_sqlstore.add_samples(con, site, part, clear=True)
+        con.close()
+        done.append("sqlite")
+    if pieces:
+        print(f"🔄 {site}: {', '.join(done) or 'no stores'} refreshed over {len(pieces)} range(s) "
+              f"{pieces[0]['UTC'].iloc[0]} .. {pieces[-1]['UTC'].iloc[-1]}", flush=True)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(sig, f, indent=1)
+    return done
+#******************
+def main():
+    ap = argparse.ArgumentParser(description="Reprocess raw SQM/TESS files into fresh archives")
+    ap.add_argument("--raw", action="append", help=f"raw file directory (repeatable; default {RAW_DIRS[0]})")
+    ap.add_argument("--out", default=OUT_DIR)
+    ap.add_argument("--sites-csv", default=SITES_CSV)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--sites", help="comma separated site keys, e.g. DSN021-S,DSN022-S")
+    ap.add_argument("--restart", action="store_true", help="discard previous state and archives in --out")
+    ap.add_argument("--stores",
+                    help="also refresh the derived stores under this root (PYRAMID/, BIN/, "
+                         "dsn.sqlite; e.g. DSNdata) over the reprocessed ranges")
+    args = ap.parse_args()
+
+    raw_dirs = args.raw or RAW_DIRS
+    sites = {s.strip() for s in args.sites.split(",")} if args.sites else None
+    if args.restart and os.path.isdir(args.out):
+        shutil.rmtree(args.out)
+    os.makedirs(args.out, exist_ok=True)
+    # scratch directories of an interrupted run
+    for name in os.listdir(args.out):
+        if name.startswith(".scratch-"):
+            shutil.rmtree(os.path.join(args.out, name), ignore_errors=True)
+    config = config_hash(args.sites_csv)
+    work = discover(raw_dirs, sites)
+    nfiles = sum(len(v) for v in work.values())
+    print(f"🔁 {nfiles} raw files, {len(work)} sites, {args.workers} workers, config {config}")
+    if not work:
+        print(f"No raw files in {', '.join(raw_dirs)}")
+        return 0
+
+    started = datetime.datetime.utcnow()
+    t0 = time.time()
+    reports = {}
+    # largest sites first, so the slowest one does not start last
+    order = sorted(work, key=lambda s: -sum(os.path.getsize(p) for p in work[s]))
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(work)))) as pool:
+        futs = [pool.submit(reprocess_site, s, work[s], args.out, args.sites_csv, config)
+                for s in order]
+        for fut in as_completed(futs):
+            site, rep = fut.result()
+            if args.stores:
+                rep["stores"] = refresh_stores(args.out, site, args.stores)
+            reports[site] = rep
+            print(f"🏁 {site}: {rep['processed']} processed, {rep['resumed']} resumed, "
+                  f"{len(rep['failed'])} failed, {rep['rows']} rows in {rep['seconds']} s", flush=True)
+
+    report = {
+        "started": started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "seconds": round(time.time() - t0, 1),
+        "config": config,
+        "raw_dirs": raw_dirs,
+        "workers": args.workers,
+        "sites": {s: reports[s] for s in sorted(reports)},
+        "rows": sum(r["rows"] for r in reports.values()),
+        "failed": sum(len(r["failed"]) for r in reports.values()),
+    }
+    path = os.path.join(args.out, REPORT_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"📄 {report['rows']} rows, {report['failed']} failed files, "
+          f"{report['seconds']} s; report {path}")
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_service.py
+# Long-running CSV / analysis request service.  Wraps DSN_generate_csv
+# (build_csv) and DSN_generate_analysis in one warm Python process:
+# pandas, plotly, matplotlib and the DSN modules are imported once, site
+# metadata is loaded once, jobs run on a bounded worker pool, identical
+# in-flight requests share one job, and git publishing goes through one
+# DSN_publish.PublishQueue (one commit/push per interval).
+#
+# HTTP (local):
+#   GET|POST /csv?label=DSN019-S_MtLemmon&from=2025-01-01&to=2025-02-01[&wait=1]
+#            [&resolution=1d&agg=median&max_chisq=0.009]   (DSN_generate_csv options)
+#   GET|POST /analysis?label=...&from=...&to=...[&wait=1]
+#   GET      /jobs/<id>     -> {"job", "kind", "state", "result"}
+#   GET      /health
+# "result" (and the body with wait=1) is the same status JSON as today:
+#   csv:      {"status", "csv", "csv_raw", "timestamp"}
+#   analysis: {"timestamp", "phase", "status", "html", "raw_label"}
+#
+# Usage:
+#   python DSN_service.py --site-repo ~/DSN/soazcomms.github.io [--port 8765]
+#          [--workers 4] [--publish-interval 10] [--backend auto] [--no-publish]
+# Influx settings: --influx-url/--influx-token, else INFLUX_URL / INFLUX_TOKEN;
+# DSN_influx_standin.py serves as a local Influx for testing.
+import argparse, contextlib, io, json, os, runpy, shutil, sys, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot            # noqa: F401  (warm imports for the analysis jobs)
+import numpy, pandas               # noqa: F401
+import plotly.graph_objects, plotly.io   # noqa: F401
+
+import DSN_generate_csv as gencsv
+from DSN_publish import PublishQueue
+from DSN_inputs import load_sites
+
+#----
+version_date = "10/19/2026"
+HERE = Path(__file__).resolve().parent
+MAX_DONE = 500          # finished jobs kept for /jobs/<id>
+#******************
+CSV_OPTS = ("resolution", "agg", "max_chisq")   # passed through to DSN_generate_csv
+#******************
+class ThreadStdout:
+    """
+    sys.stdout stand-in: a thread inside capture() writes to its own
+    buffer, every other thread to the real stream.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+    #----
+    def _target(self):
+        buf = getattr(self._local, "buf", None)
+        return self._stream if buf is None else buf
+    #----
+    def write(self, text):
+        return self._target().write(text)
+    #----
+    def flush(self):
+        return self._target().flush()
+    #----
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+    #----
+    @contextlib.contextmanager
+    def capture(self, buf):
+        self._local.buf = buf
+        try:
+            yield buf
+        finally:
+            self._local.buf = None
+#******************
+class Job:
+    def __init__(self, kind, label, start, stop, opts=()):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind, self.label, self.start, self.stop = kind, label, start, stop
+        self.opts = tuple(opts)     # ((name, value), ...) sorted
+        self.state = "queued"
+        self.result = None
+        self.done = threading.Event()
+        self.created = time.time()
+    #----
+    def key(self):
+        return (self.kind, self.label, self.start, self.stop, self.opts)
+    #----
+    def as_dict(self):
+        return {"job": self.id, "kind": self.kind, "label": self.label,
+                "from": self.start, "to": self.stop, **dict(self.opts),
+                "state": self.state, "result": self.result}
+#******************
+class Service:
+    def __init__(self, repo, workers=4, publish_interval=10.0, backend="auto", publish=True,
+                 csv_argv=()):
+        self.repo = Path(repo).expanduser().resolve()
+        self.backend = backend
+        self.csv_argv = list(csv_argv)   # extra DSN_generate_csv options (Influx creds ...)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.queue = PublishQueue(self.repo, interval=publish_interval).start() if publish else None
+        self.jobs = {}            # id -> Job
+        self.inflight = {}        # key -> Job
+        self.lock = threading.Lock()
+        # per label: held from writing a label's files until they are staged,
+        # since its whole analysis/<label> directory is published
+        self.label_locks = {}
+        self.analysis_lock = threading.Lock()   # runpy: argv/cwd are process-wide
+        if not isinstance(sys.stdout, ThreadStdout):   # per-thread analysis logs
+            sys.stdout = ThreadStdout(sys.stdout)
+        self.sites_csv = self.repo / "DSNdata" / "DSNsites.csv"
+        self.sites = load_sites(self.sites_csv)
+        self.labels = set(self.sites["label"])
+    #----
+    def _label_lock(self, label):
+        with self.lock:
+            return self.label_locks.setdefault(label, threading.RLock())
+    #----
+    def submit(self, kind, label, start, stop, opts=None):
+        """Queue a job, or return the identical one already in flight."""
+        if label not in self.labels:
+            raise ValueError(f"unknown label {label!r}")
+        opts = tuple(sorted((k, str(v)) for k, v in (opts or {}).items() if v not in (None, "")))
+        if opts:
+            try:        # validate here so a bad option is a 400, not a failed job
+                gencsv.parse_args(["--label", label, "--from", start, "--to", stop,
+                                   *self._opt_argv(opts)])
+            except SystemExit:
+                raise ValueError(f"bad options {dict(opts)}")
+        key = (kind, label, start, stop, opts)
+        with self.lock:
+            job = self.inflight.get(key)
+            if job is not None:
+                return job
+            job = Job(kind, label, start, stop, opts)
+            self.jobs[job.id] = job
+            self.inflight[key] = job
+            if len(self.jobs) > MAX_DONE:
+                for jid in sorted((j for j in self.jobs.values() if j.done.is_set()),
+                                  key=lambda j: j.created)[:len(self.jobs) - MAX_DONE]:
+                    self.jobs.pop(jid.id, None)
+        self.pool.submit(self._run, job)
+        return job
+    #----
+    def _run(self, job):
+        job.state = "running"
+        try:
+            if job.kind == "csv":
+                job.result = self._csv(job)
+            else:
+                job.result = self._analysis(job)
+            job.state = "failed" if job.result.get("status", "").startswith("❌") else "done"
+        except Exception as e:
+            job.state = "failed"
+            job.result = {"status": f"❌ {job.kind} failed for {job.label}: {e}",
+                          "timestamp": int(time.time())}
+        finally:
+            with self.lock:
+                self.inflight.pop(job.key(), None)
+            job.done.set()
+            print(f"[service] {job.kind} {job.label} {job.start}..{job.stop}: {job.state}",
+                  file=sys.stderr)
+    #----
+    def _publish(self, paths, message, status):
+        if self.queue is None:
+            return status
+        return self.queue.submit(paths, message, status).wait()
+    #----
+    @staticmethod
+    def _opt_argv(opts):
+        return [a for k, v in opts for a in ("--" + k.replace("_", "-"), v)]
+    #----
+    def _csv_args(self, job, out=None):
+        argv = ["--label", job.label, "--from", job.start, "--to", job.stop,
+                "--site-repo", str(self.repo), "--backend", self.backend, *self.csv_argv,
+                *self._opt_argv(job.opts)]
+        if out:
+            argv += ["--out", str(out)]
+        return gencsv.parse_args(argv)
+    #----
+    def _build(self, args):
+        keep = self.queue.pending_paths() if self.queue else set()
+        with self._label_lock(args.label):
+            return gencsv.build_csv(args, self.repo, keep=keep)
+    #----
+    def _csv(self, job):
+        args = self._csv_args(job)
+        with self._label_lock(job.label):
+            rc, status, paths = self._build(args)
+            if rc:
+                return {"status": f"❌ CSV failed for {job.label} "
+                                  f"{gencsv.ymd(job.start)}-{gencsv.ymd(job.stop)}",
+                        "timestamp": int(time.time())}
+            if paths:
+                status = self._publish(paths, gencsv.publish_message(args), status)
+        return status
+    #----
+    def _write_status(self, label, phase, status, **extra):
+        st = {"timestamp": int(time.time()), "phase": phase, "status": status, **extra,
+              "raw_label": label}
+        path = self.repo / "status" / f"status-{label}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(st, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        return st
+    #----
+    def _analysis(self, job):
+        """Same steps as the DSN Analysis workflow, in this process."""
+        with self._label_lock(job.label):
+            label = job.label
+            outdir = self.repo / "analysis" / label
+            fromd, tod = gencsv.ymd(job.start), gencsv.ymd(job.stop)
+            self._write_status(label, "running", f"⏳ Running analysis for {label}...")
+            csv = outdir / f"{label}_{fromd}_{tod}.csv"
+            if not (csv.exists() and csv.stat().st_size > 0):
+                rc, _, _ = self._build(self._csv_args(job, out=csv))
+                if rc or not csv.exists():
+                    return self._write_status(label, "failed", f"❌ CSV generation failed for {label}")
+            if not (outdir / f"files_{fromd}_{tod}").exists():
+                log = io.StringIO()
+                with self.analysis_lock, contextlib.chdir(self.repo), \
+                        sys.stdout.capture(log):
+                    argv = sys.argv
+                    sys.argv = ["DSN_generate_analysis.py", "--label", label, "--from", job.start,
+                                "--to", job.stop, "--input_dir", str(outdir),
+                                "--sites", str(self.sites_csv)]
+                    try:
+                        runpy.run_path(str(HERE / "DSN_generate_analysis.py"), run_name="__main__")
+                    except SystemExit as e:
+                        if e.code:
+                            raise RuntimeError(f"DSN_generate_analysis exited with {e.code}")
+                    finally:
+                        sys.argv = argv
+                (outdir / f"{label}_{fromd}_{tod}.analysis.log").write_text(log.getvalue(), encoding="utf-8")
+            endpoint = self.repo / "tools" / "DSN_endpoint.html"
+            if endpoint.exists():
+                shutil.copyfile(endpoint, outdir / "index.html")
+            html = f"/analysis/{label}/{label}.analysis.html"
+            if not (self.repo / html.lstrip("/")).exists():
+                return self._write_status(label, "failed", f"❌ Missing {html.lstrip('/')}")
+            status = self._write_status(label, "done", f"✅ Analysis complete for {label}", html=html)
+            return self._publish([f"analysis/{label}", f"status/status-{label}.json"],
+                                 f"[analysis] {label} complete", status)
+    #----
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        if self.queue is not None:
+            self.queue.stop()
+#******************
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a):
+            print("[http] " + fmt % a, file=sys.stderr)
+        #----
+        def _json(self, code, obj):
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(data)
+        #----
+        def _params(self):
+            q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            n = int(self.headers.get("Content-Length") or 0)
+            if n:
+                try:
+                    q.update(json.loads(self.rfile.read(n) or b"{}"))
+                except ValueError:
+                    pass
+            return q
+        #----
+        def _handle(self):
+            path = urlparse(self.path).path.rstrip("/")
+            if path == "/health":
+                return self._json(200, {"ok": True, "version": version_date,
+                                        "jobs": len(service.jobs),
+                                        "inflight": len(service.inflight)})
+            if path.startswith("/jobs/"):
+                job = service.jobs.get(path.rsplit("/", 1)[1])
+                if job is None:
+                    return self._json(404, {"error": "unknown job"})
+                return self._json(200, job.as_dict())
+            if path not in ("/csv", "/analysis"):
+                return self._json(404, {"error": "not found"})
+            q = self._params()
+            missing = [k for k in ("label", "from", "to") if not q.get(k)]
+            if missing:
+                return self._json(400, {"error": f"missing {', '.join(missing)}"})
+            try:
+                opts = {k: q.get(k) for k in CSV_OPTS} if path == "/csv" else None
+                job = service.submit(path[1:], q["label"].strip(), q["from"].strip(),
+                                     q["to"].strip(), opts)
+            except ValueError as e:
+                return self._json(400, {"error": str(e)})
+            if str(q.get("wait", "")).lower() in ("1", "true", "yes"):
+                job.done.wait()
+                return self._json(200, job.result)
+            return self._json(202, job.as_dict())
+        #----
+        do_GET = _handle
+        do_POST = _handle
+    return Handler
+#******************
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--site-repo", dest="site_repo",
+                    default=str(Path("~/DSN/soazcomms.github.io").expanduser()))
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--publish-interval", dest="publish_interval", type=float, default=10.0)
+    ap.add_argument("--backend", choices=gencsv.BACKENDS, default="auto")
+    ap.add_argument("--influx-url", dest="influx_url")
+    ap.add_argument("--influx-token", dest="influx_token")
+    ap.add_argument("--no-publish", dest="no_publish", action="store_true",
+                    help="write files but never commit/push")
+    return ap.parse_args()
+#******************
+def main():
+    args = parse_args()
+    print("DSN_service.py version ", version_date)
+    repo = Path(args.site_repo).expanduser().resolve()
+    if not repo.exists():
+        print(f"ERROR: site repo not found: {repo}", file=sys.stderr)
+        return 2
+    if not args.no_publish:
+        gencsv.git_identity(repo)
+        gencsv.git_hard_sync(repo)
+    csv_argv = []
+    for opt, val in (("--influx-url", args.influx_url or os.getenv("INFLUX_URL")),
+                     ("--influx-token", args.influx_token)):
+        if val:
+            csv_argv += [opt, val]
+    service = Service(repo, workers=args.workers, publish_interval=args.publish_interval,
+                      backend=args.backend, publish=not args.no_publish, csv_argv=csv_argv)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port} ({len(service.labels)} sites, "
+          f"{args.workers} workers)", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_sqlstore.py
+# Embedded SQL store (SQLite, one file) of the processed data for ad hoc
+# and dashboard queries, without a server:
+#   samples(site, utc, SQM, lum, chisquared, moonalt, LST, sunalt, Skytemp, qflag)
+#           primary key (site, utc); utc in seconds since 1970 (UTC)
+#   nights(site, night, <DSN_stats.NIGHT_COLUMNS>)   primary key (site, night)
+#   ingested(path, size, mtime_ns, site, rows, utc_min, utc_max, sha256)
+#   samples_iso   view of samples with utc as ISO text
+# Both tables are clustered on their key (WITHOUT ROWID), so a site/time
+# range is an index range scan.
+#
+# Filled incrementally from the processed Box-format CSVs (default
+# DSNdata/BOX_ANALYSIS): a file whose size and mtime (or, after a fresh
+# checkout, SHA-256) are unchanged since its last ingest is skipped.
+# Files are read in name order and, as in the CSV readers, a sample
+# already stored from another file is kept; rows of a changed file
+# (reprocessed) replace stored rows of the same (site, utc).  The nights
+# of the ingested rows are recomputed from the store with
+# DSN_stats.night_table.  DSN_V03 adds its rows when the database file
+# exists.
+#
+# stale_files() and coverage_gaps() tell whether the store can answer a
+# site/time range as the archive would: every archive file overlapping it
+# ingested at its current content, no hole longer than DSN_manifest.GAP.
+#
+# Usage:
+#   python DSN_sqlstore.py ingest [DSNdata/BOX_ANALYSIS ...] [--db DSNdata/dsn.sqlite]
+#   python DSN_sqlstore.py query "SELECT site, substr(night,1,7) AS month,
+#          round(sum(clear_hours),1) AS clear_h FROM nights GROUP BY 1, 2"
+#   python DSN_sqlstore.py query "SELECT night, SQM_median_clear FROM nights
+#          WHERE site = 'DSN006-S' AND SQM_median_clear > 21.5"
+#   python DSN_sqlstore.py range DSN019-S --from 2024-01-01 --to 2024-02-01
+#   python DSN_sqlstore.py info
+#
+#   from DSN_sqlstore import read_range, query, load_network
+#   df = read_range("DSN019-S", "2024-01-01", "2024-02-01")   # UTC tz-aware
+import os
+import sys
+import glob
+import hashlib
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+
+import DSN_manifest
+from DSN_stats import night_date, night_table, NIGHT_COLUMNS
+
+#----
+DB_PATH = "DSNdata/dsn.sqlite"
+SUFFIX = ".sqlite"
+SOURCE_DIRS = ["DSNdata/BOX_ANALYSIS"]
+VALUE_COLUMNS = ["SQM", "lum", "chisquared", "moonalt", "LST", "sunalt", "Skytemp", "qflag"]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    site TEXT NOT NULL, utc INTEGER NOT NULL,
+    SQM REAL, lum REAL, chisquared REAL, moonalt REAL, LST REAL, sunalt REAL,
+    Skytemp REAL, qflag INTEGER,
+    PRIMARY KEY (site, utc)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS nights (
+    site TEXT NOT NULL, night TEXT NOT NULL,
+    n INTEGER, n_dark INTEGER, dark_hours REAL, clear_hours REAL, clear_frac REAL,
+    SQM_median_clear REAL, darkest_clear_SQM REAL, moon_down_frac REAL, gap_minutes REAL,
+    PRIMARY KEY (site, night)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, site TEXT,
+    rows INTEGER, utc_min INTEGER, utc_max INTEGER, sha256 TEXT);
+CREATE VIEW IF NOT EXISTS samples_iso AS
+    SELECT site, strftime('%Y-%m-%dT%H:%M:%SZ', utc, 'unixepoch') AS UTC,
+           SQM, lum, chisquared, moonalt, LST, sunalt, Skytemp, qflag
+    FROM samples;
+"""
+#******************
+def connect(db=DB_PATH):
+    """Connection to the store, schema created if needed."""
+    directory = os.path.dirname(os.path.abspath(db))
+    os.makedirs(directory, exist_ok=True)
+    con = sqlite3.connect(db)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.executescript(SCHEMA)
+    known = {r[1] for r in con.execute("PRAGMA table_info(ingested)")}
+    if "sha256" not in known:                    # stores made before sha256
+        con.execute("ALTER TABLE ingested ADD COLUMN sha256 TEXT")
+    return con
+#******************
+def _seconds(t):
+    """Timestamp/ISO (naive = UTC) -> int seconds since 1970."""
+    t = pd.Timestamp(t)
+    return int((t.tz_convert("UTC").tz_localize(None) if t.tzinfo else t).value // 10**9)
+#******************
+def _none(a):
+    """NaN -> None for sqlite."""
+    a = np.asarray(a, dtype=object)
+    a[pd.isna(a)] = None
+    return a
+#******************
+def add_samples(con, site, df, ts_col="UTC", replace=True, clear=False):
+    """
+    Store processed rows (Box archive columns) of one site, replacing rows
+    of the same utc (else keeping them); refresh the nights they touch.
+    clear: the stored samples and nights in the rows' time range are
+    dropped first (a reprocessed range), and the files ingested over it
+    are marked stale (stale_files) until they are ingested again.
+    Returns (rows, utc_min, utc_max).
+    """
+    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True, format="ISO8601")
+    ok = t.notna().to_numpy()
+    if not ok.any():
+        return 0, None, None
+    utc = t[ok].dt.tz_localize(None).to_numpy(dtype="datetime64[s]").astype(np.int64)
+    cols = [np.full(len(utc), site, dtype=object), utc.tolist()]
+    for c in VALUE_COLUMNS:
+        v = pd.to_numeric(df[c], errors="coerce")[ok] if c in df.columns \
+            else pd.Series(np.nan, index=range(len(utc)))
+        if c == "qflag":
+            v = v.astype("Int64")
+        cols.append(_none(v))
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    lo, hi = int(utc.min()), int(utc.max())
+    with con:
+        if clear:
+            first, last = night_date(pd.to_datetime([lo, hi], unit="s", utc=True))
+            con.execute("DELETE FROM samples WHERE site = ? AND utc BETWEEN ? AND ?", (site, lo, hi))
+            con.execute("DELETE FROM nights WHERE site = ? AND night BETWEEN ? AND ?",
+                        (site, str(first), str(last)))
+            con.execute("UPDATE ingested SET sha256 = NULL "
+                        "WHERE site = ? AND utc_max >= ? AND utc_min <= ?", (site, lo, hi))
+        con.executemany(
+            f"{verb} INTO samples (site, utc, {', '.join(VALUE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (2 + len(VALUE_COLUMNS)))})", zip(*cols))
+    refresh_nights(con, site, lo, hi)
+    return int(ok.sum()), lo, hi
+#******************
+def refresh_nights(con, site, lo, hi):
+    """Recompute the nights of site with samples in [lo, hi] (seconds)."""
+    day = 86400
+    df = pd.read_sql_query(
+        "SELECT utc, SQM, chisquared, moonalt, sunalt FROM samples "
+        "WHERE site = ? AND utc BETWEEN ? AND ? ORDER BY utc",
+        con, params=(site, lo - day, hi + day))
+    if df.empty:
+        return 0
+    df.insert(0, "UTC", pd.to_datetime(df.pop("utc"), unit="s", utc=True))
+    table = night_table(df)
+    inside = df["UTC"].between(pd.Timestamp(lo, unit="s", tz="UTC"),
+                               pd.Timestamp(hi, unit="s", tz="UTC"))
+    touched = set(pd.Index(night_date(df["UTC"][inside])).astype(str))
+    table = table[table["night"].astype(str).isin(touched)]
+    rows = [(site, str(r[0]), *_none(r[1:])) for r in table[NIGHT_COLUMNS].itertuples(index=False)]
+    with con:
+        con.executemany(
+            f"INSERT OR REPLACE INTO nights (site, {', '.join(NIGHT_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (1 + len(NIGHT_COLUMNS)))})", rows)
+    return len(rows)
+#******************
+def _csv_files(paths):
+    for p in paths:
+        if os.path.isdir(p):
+            for f in sorted(glob.glob(os.path.join(p, "DSN*.csv"))):
+                if not f.endswith(DSN_manifest.DERIVED_SUFFIXES):
+                    yield f
+        elif p.endswith(".csv"):
+            yield p
+#******************
+def _sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+#******************
+def ingest(paths=SOURCE_DIRS, db=DB_PATH, force=False):
+    """Add new or changed processed CSV files (files or directories)."""
+    con = connect(db)
+    done = {r[0]: r[1:] for r in con.execute("SELECT path, size, mtime_ns, sha256 FROM ingested")}
+    n_files = n_rows = 0
+    for path in _csv_files(paths):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        size, mtime_ns, sha = done.get(key, (None, None, None))
+        if not force and sha and size == st.st_size:
+            if mtime_ns == st.st_mtime_ns:
+                continue
+            if sha == _sha256(path):             # touched (checkout), same content
+                with con:
+                    con.execute("UPDATE ingested SET mtime_ns = ? WHERE path = ?",
+                                (st.st_mtime_ns, key))
+                continue
+        site = DSN_manifest.site_prefix(path)
+        df = pd.read_csv(path, dtype={"UTC": str})
+        if "UTC" not in df.columns:
+            print(f"⚠️ Skipping {path}: no UTC column")
+            continue
+        rows, lo, hi = add_samples(con, site, df, replace=key in done)
+        with con:
+            con.execute("INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, st.st_size, st.st_mtime_ns, site, rows, lo, hi, _sha256(path)))
+        n_files += 1
+        n_rows += rows
+        print(f"✅ {path}: {rows} rows ({site})")
+    con.close()
+    return n_files, n_rows
+#******************
+def query(sql, params=(), db=DB_PATH):
+    """Any SQL over the store as a DataFrame."""
+    con = connect(db)
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+#******************
+def _frame(df, float_dtype="float64"):
+    """utc seconds -> tz-aware UTC first; typed value columns."""
+    df.insert(0, "UTC", pd.to_datetime(df.pop("utc").to_numpy(dtype=np.int64) * 10**9, utc=True))
+    for c in df.columns.intersection(VALUE_COLUMNS):
+        df[c] = pd.to_numeric(df[c]).astype("Int64" if c == "qflag" else float_dtype)
+    return df
+#******************
+def read_range(site, start=None, end=None, columns=None, db=DB_PATH):
+    """Samples of site with start <= UTC < end, UTC tz-aware, time ordered."""
+    cols = ", ".join(columns or VALUE_COLUMNS)
+    lo = _seconds(start) if start is not None else -2**62
+    hi = _seconds(end) if end is not None else 2**62
+    df = query(f"SELECT utc, {cols} FROM samples WHERE site = ? AND utc >= ? AND utc < ? "
+               "ORDER BY utc", (site, lo, hi), db)
+    return _frame(df)
+#******************
+def time_span(site, db=DB_PATH):
+    """(first, last) UTC of a site's samples, (None, None) if none."""
+    lo, hi = query("SELECT min(utc) AS lo, max(utc) AS hi FROM samples WHERE site = ?",
+                   (site,), db).iloc[0]
+    if pd.isna(lo):
+        return None, None
+    return pd.Timestamp(int(lo), unit="s", tz="UTC"), pd.Timestamp(int(hi), unit="s", tz="UTC")
+#******************
+def coverage_gaps(site, start, end, gap=DSN_manifest.GAP, db=DB_PATH):
+    """
+    [(lo, hi), ...] parts of [start, end) longer than gap without samples
+    of site (as DSN_manifest.coverage_gaps).  [] = fully covered.
+    """
+    lo, hi, step = _seconds(start), _seconds(end), int(gap.total_seconds())
+    breaks = query(
+        "SELECT prev, utc FROM (SELECT utc, lag(utc) OVER (ORDER BY utc) AS prev "
+        "FROM samples WHERE site = ? AND utc >= ? AND utc < ?) WHERE utc - prev > ?",
+        (site, lo, hi, step), db)
+    first, last = query("SELECT min(utc), max(utc) FROM samples "
+                        "WHERE site = ? AND utc >= ? AND utc < ?", (site, lo, hi), db).iloc[0]
+    if pd.isna(first):
+        holes = [(lo, hi)]
+    else:
+        holes = [(lo, int(first))] + list(breaks.itertuples(index=False, name=None)) \
+            + [(int(last), hi)]
+    return [(pd.Timestamp(a, unit="s", tz="UTC"), pd.Timestamp(b, unit="s", tz="UTC"))
+            for a, b in holes if b - a > step]
+#******************
+def stale_files(directory, site, start=None, end=None, db=DB_PATH):
+    """
+    Names of site's archive files in directory overlapping [start, end]
+    that the store has not ingested at their current content (SHA-256
+    from the directory's manifest).
+    """
+    man = DSN_manifest.refresh(directory, site)["files"]
+    stored = {os.path.basename(p): sha for p, sha in
+              query("SELECT path, sha256 FROM ingested WHERE site = ?", (site,), db)
+              .itertuples(index=False, name=None)}
+    return [name for name in DSN_manifest.overlapping_files(directory, site, start, end)
+            if name.startswith("DSN") and stored.get(name) != man[name].get("sha256")]
+#******************
+def load_network(db=DB_PATH, start=None, end=None, prefixes=None, usecols=None):
+    """
+    Same frame as DSN_inputs.load_network (rows in [start, end], UTC
+    tz-aware, categorical 'site'), read from the store.
+    """
+    cols = [c for c in (usecols or VALUE_COLUMNS) if c in VALUE_COLUMNS]
+    where, params = [], []
+    if start is not None:
+        where.append("utc >= ?")
+        params.append(_seconds(pd.to_datetime(start, utc=True)))
+    if end is not None:
+        where.append("utc <= ?")
+        params.append(_seconds(pd.to_datetime(end, utc=True)))
+    if prefixes is not None:
+        where.append(f"site IN ({', '.join('?' * len(prefixes))})")
+        params += list(prefixes)
+    sql = f"SELECT site, utc, {', '.join(cols)} FROM samples"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    df = _frame(query(sql + " ORDER BY site, utc", params, db), "float32")
+    df["site"] = df["site"].astype("category")
+    return df
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    i = sub.add_parser("ingest", help="add new/changed processed CSVs")
+    i.add_argument("paths", nargs="*", help=f"files or directories (default {SOURCE_DIRS[0]})")
+    i.add_argument("--force", action="store_true", help="re-read unchanged files too")
+    q = sub.add_parser("query", help="run SQL, print CSV")
+    q.add_argument("sql")
+    r = sub.add_parser("range", help="print one site's samples")
+    r.add_argument("site")
+    r.add_argument("--from", dest="start")
+    r.add_argument("--to", dest="end")
+    sub.add_parser("info", help="rows and time span per site")
+    for p in (i, q, r, sub.choices["info"]):
+        p.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    if args.cmd == "ingest":
+        files, rows = ingest(args.paths or SOURCE_DIRS, args.db, args.force)
+        print(f"{files} files, {rows} rows -> {args.db}")
+    elif args.cmd == "query":
+        query(args.sql, db=args.db).to_csv(sys.stdout, index=False)
+    elif args.cmd == "range":
+        df = read_range(args.site, args.start, args.end, db=args.db)
+        df["UTC"] = df["UTC"].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        df.to_csv(sys.stdout, index=False)
+    else:
+        query("SELECT s.site, s.rows, datetime(s.lo, 'unixepoch') AS first, "
+              "datetime(s.hi, 'unixepoch') AS last, "
+              "(SELECT count(*) FROM nights n WHERE n.site = s.site) AS nights "
+              "FROM (SELECT site, count(*) AS rows, min(utc) AS lo, max(utc) AS hi "
+              "FROM samples GROUP BY site) s ORDER BY s.site",
+              db=args.db).to_csv(sys.stdout, index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+# DSN_stats.py
+# Observing-time statistics for processed SQM/TESS data.
+# The timeline is sorted once; run, dark and cloud-free hours are all
+# derived from the same cadence mask, together with per-night and
+# per-month tables.
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+#----
+MST_OFFSET = pd.Timedelta(hours=7)   # Arizona: UTC-7, no DST
+SUN_DARK = -18.0                     # astronomical twilight
+CHI_CLEAR = 0.009                    # cloud-free threshold
+MOON_DOWN = 0.0                      # moonalt below this: moon down
+NIGHT_COLUMNS = ["night", "n", "n_dark", "dark_hours", "clear_hours", "clear_frac",
+                 "SQM_median_clear", "darkest_clear_SQM", "moon_down_frac", "gap_minutes"]
+#******************
+def night_date(utc):
+    """
+    Night label for each UTC timestamp: the local (MST) calendar date of
+    the evening the night started, i.e. date(UTC - 7h - 12h).
+    Accepts a tz-aware or naive-UTC Series/DatetimeIndex.
+    """
+    t = pd.to_datetime(utc, utc=True, errors="coerce")
+    if isinstance(t, pd.Series):
+        return (t - MST_OFFSET - pd.Timedelta(hours=12)).dt.date
+    return pd.Index((t - MST_OFFSET - pd.Timedelta(hours=12)).date)
+#******************
+def _cadence(diffs, q=10):
+    """q-th percentile of positive diffs (sec), min() as fallback."""
+    pos = diffs[np.isfinite(diffs) & (diffs > 0)]
+    if pos.size == 0:
+        return np.nan
+    cadence = np.percentile(pos, q)
+    if not np.isfinite(cadence) or cadence <= 0:
+        cadence = np.min(pos)
+    return cadence
+#******************
+def _interval_seconds(diffs, ok, pair):
+    """
+    Seconds kept for the intervals selected by pair (both ends qualify).
+    Mirrors the old gap_corrected_hours fallback: if nothing survives
+    the cadence cut, clip at the 95th percentile of the subset diffs.
+    """
+    sec = np.where(ok & pair, diffs, 0.0)
+    if sec.sum() == 0:
+        sub = diffs[pair & (diffs > 0)]
+        if sub.size:
+            cap = np.percentile(sub, 95)
+            sec = np.where(pair & (diffs > 0) & (diffs <= cap), diffs, 0.0)
+    return sec
+#******************
+def observing_time_stats(df, ts_col="UTC", sqm_col="SQM", chi_col="chisquared",
+                         sunalt=None, sun_thr=SUN_DARK, chi_thr=CHI_CLEAR,
+                         q=10, tol=1.25):
+    """
+    Single-pass replacement for three gap_corrected_hours() calls.
+
+    The timeline is sorted once and the cadence is estimated once (q-th
+    percentile of positive diffs).  An interval between consecutive
+    samples counts when 0 < dt <= cadence*tol; it counts as dark when
+    both ends have sunalt <= sun_thr, and as clear when both ends are
+    also chisquared <= chi_thr.  Intervals are credited to the night of
+    their first sample.
+
+    sunalt: array aligned with df (or None to use df['sunalt']).
+    Returns (summary dict, per-night DataFrame, per-month DataFrame).
+    """
+    empty_n = pd.DataFrame(columns=["night", "n", "run_hours", "dark_hours",
+                                    "clear_hours", "clear_frac", "darkest_clear_SQM"])
+    empty_m = empty_n.rename(columns={"night": "month"}).assign(n_nights=[])
+    summary = dict(run_hours=0.0, night_hours=0.0, clear_hours=0.0,
+                   pct_night=0.0, pct_clear=0.0, cadence_sec=None, n=int(len(df)))
+    if df.empty:
+        return summary, empty_n, empty_m
+
+    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True)
+    if sunalt is None:
+        sunalt = df["sunalt"] if "sunalt" in df.columns else np.full(len(df), np.nan)
+    sun = pd.to_numeric(pd.Series(np.asarray(sunalt), index=df.index), errors="coerce").to_numpy(float)
+    chi = pd.to_numeric(df[chi_col], errors="coerce").to_numpy(float) \
+        if chi_col in df.columns else np.full(len(df), np.nan)
+    sqm = pd.to_numeric(df[sqm_col], errors="coerce").to_numpy(float) \
+        if sqm_col in df.columns else np.full(len(df), np.nan)
+
+    valid = t.notna().to_numpy()
+    tns = t.to_numpy(dtype="datetime64[ns]")[valid].astype(np.int64)
+    order = np.argsort(tns, kind="stable")   # the one and only sort
+    tns = tns[order]
+    sun, chi, sqm = sun[valid][order], chi[valid][order], sqm[valid][order]
+    n = tns.size
+    if n < 2:
+        summary["n"] = int(n)
+        return summary, empty_n, empty_m
+
+    dark = sun <= sun_thr
+    clear = dark & (chi <= chi_thr)
+    diffs = np.diff(tns) / 1e9
+    cadence = _cadence(diffs, q)
+    if not np.isfinite(cadence) or cadence <= 0:
+        return summary, empty_n, empty_m
+    ok = (diffs > 0) & (diffs <= cadence * tol)
+
+    run_s = _interval_seconds(diffs, ok, np.ones(n - 1, bool))
+    dark_s = _interval_seconds(diffs, ok, dark[:-1] & dark[1:])
+    clear_s = _interval_seconds(diffs, ok, clear[:-1] & clear[1:])
+
+    run_h, dark_h, clear_h = run_s.sum()/3600, dark_s.sum()/3600, clear_s.sum()/3600
+    summary.update(
+        run_hours=float(run_h), night_hours=float(dark_h), clear_hours=float(clear_h),
+        pct_night=float(100*dark_h/run_h) if run_h else 0.0,
+        pct_clear=float(100*clear_h/dark_h) if dark_h > 0 else 0.0,
+        cadence_sec=float(cadence), n=int(n))
+
+    # per-night / per-month tables, one bincount per quantity
+    nights = night_date(pd.DatetimeIndex(tns.astype("datetime64[ns]"), tz="UTC"))
+    codes, uniq = pd.factorize(nights, sort=True)
+    k = len(uniq)
+    icode = codes[:-1]
+    sqm_clear = np.where(clear & np.isfinite(sqm), sqm, -np.inf)
+    darkest = np.full(k, -np.inf)
+    np.maximum.at(darkest, codes, sqm_clear)
+    per_night = pd.DataFrame({
+        "night": pd.to_datetime(pd.Index(uniq)),
+        "n": np.bincount(codes, minlength=k),
+        "run_hours": np.bincount(icode, run_s, k) / 3600,
+        "dark_hours": np.bincount(icode, dark_s, k) / 3600,
+        "clear_hours": np.bincount(icode, clear_s, k) / 3600,
+        "darkest_clear_SQM": np.where(np.isfinite(darkest), darkest, np.nan),
+    })
+    per_night = _with_clear_frac(per_night)
+
+    per_night["month"] = per_night["night"].dt.to_period("M").astype(str)
+    per_month = per_night.groupby("month", sort=True).agg(
+        n=("n", "sum"), n_nights=("night", "size"),
+        run_hours=("run_hours", "sum"), dark_hours=("dark_hours", "sum"),
+        clear_hours=("clear_hours", "sum"),
+        darkest_clear_SQM=("darkest_clear_SQM", "max")).reset_index()
+    per_month = _with_clear_frac(per_month)
+    per_night = per_night.drop(columns="month")
+    per_night["night"] = per_night["night"].dt.strftime("%Y-%m-%d")
+    return summary, per_night, per_month
+#******************
+def _with_clear_frac(tab):
+    dark_h = tab["dark_hours"].to_numpy(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(dark_h > 0, tab["clear_hours"] / dark_h, np.nan)
+    tab.insert(tab.columns.get_loc("clear_hours") + 1, "clear_frac", frac)
+    return tab.round({"run_hours": 3, "dark_hours": 3, "clear_hours": 3,
+                      "clear_frac": 4, "darkest_clear_SQM": 3})
+#******************
+def write_stats(outdir, label, summary, per_night, per_month):
+    """
+    Export the tables next to the dashboard:
+      <label>_nights.csv, <label>_months.csv and <label>_stats.json
+    Returns the list of paths written.
+    """
+    nights_csv = outdir / f"{label}_nights.csv"
+    months_csv = outdir / f"{label}_months.csv"
+    stats_json = outdir / f"{label}_stats.json"
+    per_night.to_csv(nights_csv, index=False)
+    per_month.to_csv(months_csv, index=False)
+    payload = {
+        "label": label,
+        "summary": summary,
+        "nights": json.loads(per_night.to_json(orient="records")),
+        "months": json.loads(per_month.to_json(orient="records")),
+    }
+    with open(stats_json, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=1)
+    return [nights_csv, months_csv, stats_json]
+#******************
+def night_table(df, ts_col="UTC", sunalt=None, sun_thr=SUN_DARK, chi_thr=CHI_CLEAR,
+                moon_thr=MOON_DOWN, q=10, tol=1.25):
+    """
+    Compact per-night table (NIGHT_COLUMNS) of one site's processed rows:
+    observing_time_stats' per-night hours plus the dark sample count,
+    median and darkest clear SQM, the fraction of dark samples with the
+    moon down, and the minutes lost in gaps longer than cadence*tol
+    between samples of the same night.
+    """
+    _, per_night, _ = observing_time_stats(df, ts_col=ts_col, sunalt=sunalt,
+                                           sun_thr=sun_thr, chi_thr=chi_thr, q=q, tol=tol)
+    if per_night.empty:
+        return pd.DataFrame(columns=NIGHT_COLUMNS)
+    t = pd.to_datetime(df[ts_col], errors="coerce", utc=True)
+    if sunalt is None:
+        sunalt = df["sunalt"]
+    g = pd.DataFrame({
+        "t": t,
+        "sun": pd.to_numeric(pd.Series(np.asarray(sunalt), index=df.index), errors="coerce"),
+        "chi": pd.to_numeric(df["chisquared"], errors="coerce"),
+        "sqm": pd.to_numeric(df["SQM"], errors="coerce"),
+        "moon": pd.to_numeric(df["moonalt"], errors="coerce"),
+    }).dropna(subset=["t"]).sort_values("t", kind="stable")
+    g["night"] = pd.Index(night_date(pd.DatetimeIndex(g["t"]))).astype(str)
+    dark = g["sun"] <= sun_thr
+    clear = dark & (g["chi"] <= chi_thr)
+    # gaps: time beyond one cadence in over-long steps within a night
+    dt = g.groupby("night", sort=False)["t"].diff().dt.total_seconds()
+    cadence = _cadence(np.diff(g["t"].to_numpy(dtype="datetime64[ns]").astype(np.int64)) / 1e9, q)
+    gap = np.where(dt > cadence * tol, dt - cadence, 0.0)
+    extra = pd.DataFrame({
+        "n_dark": dark.groupby(g["night"]).sum(),
+        "SQM_median_clear": g["sqm"].where(clear).groupby(g["night"]).median().round(3),
+        "moon_down_frac": ((g["moon"] < moon_thr) & dark).groupby(g["night"]).sum()
+                          / dark.groupby(g["night"]).sum().replace(0, np.nan),
+        "gap_minutes": pd.Series(gap, index=g.index).groupby(g["night"]).sum() / 60,
+    })
+    extra["moon_down_frac"] = extra["moon_down_frac"].round(4)
+    extra["gap_minutes"] = extra["gap_minutes"].round(1)
+    out = per_night.merge(extra, how="left", left_on="night", right_index=True)
+    out["n_dark"] = out["n_dark"].fillna(0).astype(int)
+    return out[NIGHT_COLUMNS]
+#******************
+def upsert_nights(path, table):
+    """
+    Merge table into the per-site nights CSV at path: rows of the same
+    night are replaced, the file stays sorted by night.  Atomic write.
+    """
+    if os.path.exists(path):
+        old = pd.read_csv(path, dtype={"night": str})
+        table = pd.concat([old, table], ignore_index=True)
+    table = table.drop_duplicates(subset=["night"], keep="last").sort_values("night")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".nights-", suffix=".tmp")
+    with os.fdopen(fd, "w", newline="") as f:
+        table.to_csv(f, index=False)
+    os.replace(tmp, path)
+    return path
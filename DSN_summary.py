@@ -0,0 +1,135 @@
+# DSN_summary.py
+# Small pre-aggregated payloads published next to each CSV in
+# analysis/<label>/ by DSN_generate_csv, so dashboards and downstream
+# users need not fetch the full-resolution file:
+#   <label>_<from>_<to>.csv.gz        gzip copy of the CSV (mtime fixed, so
+#                                     an unchanged CSV gives the same bytes)
+#   <label>_<from>_<to>.summary.json  compact JSON:
+#     {"label", "from", "to", "generated", "cuts",
+#      "summary": observing-time stats + n_good, SQM_median, SQM_mode,
+#      "nights":  [{"night", "n", "dark_hours", "clear_hours", "clear_frac",
+#                   "n_good", "SQM_median"}, ...],
+#      "months":  [{"month", "n_good", "SQM_median", "time", "MWlat_at_median"}, ...]}
+# "good" samples pass the same cuts as DSN_generate_analysis: sunalt <= -18,
+# moonalt <= -10, chisquared <= 0.009, zenith |b| > 20 deg.
+import os
+import sys
+import gzip
+import json
+import shutil
+import datetime
+import numpy as np
+import pandas as pd
+
+from DSN_inputs import read_processed, ensure_derived, load_sites
+from DSN_astro import zenith_mwlat
+from DSN_stats import observing_time_stats, night_date, MST_OFFSET, SUN_DARK, CHI_CLEAR
+
+#----
+MOON_THR = -10.0
+MW_THR = 20.0
+MODE_BIN = 0.1      # mag, histogram bin for the SQM mode
+GZ_SUFFIX = ".gz"
+SUMMARY_SUFFIX = ".summary.json"
+#******************
+def gzip_copy(path):
+    """path -> path.gz (level 9, no name/mtime in the header); returns the .gz path."""
+    gz = f"{path}{GZ_SUFFIX}"
+    part = f"{gz}.part"
+    with open(path, "rb") as src, open(part, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=9, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(part, gz)
+    return gz
+#******************
+def summary_path(csv_path):
+    base = str(csv_path)
+    return (base[:-4] if base.endswith(".csv") else base) + SUMMARY_SUFFIX
+#******************
+def _median_table(df, key):
+    g = df.groupby(key, sort=True)["SQM"]
+    return pd.DataFrame({"n_good": g.size(), "SQM_median": g.median().round(3)})
+#******************
+def range_summary(df, lat, lon):
+    """
+    Summary dict, per-night and per-month tables for one site's rows
+    (archive column names, tz-aware UTC).  Derived columns are added in
+    place when missing (ensure_derived).
+    """
+    ensure_derived(df, lat, lon)
+    stats, nights, _ = observing_time_stats(df, ts_col="UTC", sunalt=df["sunalt"],
+                                            chi_thr=CHI_CLEAR)
+    mwlat = zenith_mwlat(df["LST"], lat)
+    good = ((df["sunalt"] <= SUN_DARK) & (df["moonalt"] <= MOON_THR)
+            & (df["chisquared"] <= CHI_CLEAR) & (mwlat > MW_THR) & df["SQM"].notna()).to_numpy()
+    g = pd.DataFrame({"UTC": df["UTC"].to_numpy()[good],
+                      "SQM": df["SQM"].to_numpy(float)[good],
+                      "MWlat": np.asarray(mwlat)[good]})
+    g["night"] = pd.Index(night_date(pd.DatetimeIndex(g["UTC"]))).astype(str)
+    g["month"] = (g["UTC"].dt.tz_convert(None) - MST_OFFSET).dt.to_period("M").astype(str)
+
+    keep = ["night", "n", "dark_hours", "clear_hours", "clear_frac"]
+    nights = nights[keep].merge(_median_table(g, "night"), how="left",
+                                left_on="night", right_index=True)
+    nights["n_good"] = nights["n_good"].fillna(0).astype(int)
+
+    # monthly points: the good sample closest to the month's median
+    months = _median_table(g, "month").reset_index()
+    if len(g):
+        dist = (g["SQM"] - g["month"].map(g.groupby("month")["SQM"].median())).abs()
+        j = dist.groupby(g["month"]).idxmin()
+        months["time"] = (g.loc[j.values, "UTC"].dt.tz_convert(None) - MST_OFFSET) \
+            .dt.strftime("%Y-%m-%dT%H:%M:%S").to_numpy()
+        months["MWlat_at_median"] = g.loc[j.values, "MWlat"].round(1).to_numpy()
+
+    sqm = g["SQM"].to_numpy()
+    if sqm.size:
+        bins = np.floor(sqm / MODE_BIN)
+        vals, counts = np.unique(bins, return_counts=True)
+        mode = round(float((vals[np.argmax(counts)] + 0.5) * MODE_BIN), 2)
+    else:
+        mode = None
+    summary = {k: (round(v, 3) if isinstance(v, float) else v) for k, v in stats.items()}
+    summary.update(n_good=int(sqm.size),
+                   SQM_median=round(float(np.median(sqm)), 3) if sqm.size else None,
+                   SQM_mode=mode)
+    return summary, nights, months
+#******************
+def write_summary(csv_path, label, lat, lon):
+    """Write <csv stem>.summary.json for csv_path; returns its path."""
+    df = read_processed(csv_path, float_dtype="float64")
+    summary, nights, months = range_summary(df, lat, lon)
+    payload = {
+        "label": label,
+        "from": df["UTC"].min().strftime("%Y-%m-%dT%H:%M:%SZ") if len(df) else None,
+        "to": df["UTC"].max().strftime("%Y-%m-%dT%H:%M:%SZ") if len(df) else None,
+        "generated": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "cuts": {"sunalt": SUN_DARK, "moonalt": MOON_THR, "chisquared": CHI_CLEAR,
+                 "mwlat": MW_THR},
+        "summary": summary,
+        "nights": json.loads(nights.to_json(orient="records")),
+        "months": json.loads(months.to_json(orient="records")),
+    }
+    out = summary_path(csv_path)
+    with open(f"{out}.part", "w", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(f"{out}.part", out)
+    return out
+#******************
+def write_artifacts(csv_path, label, sites_csv, summary=True):
+    """
+    gzip copy and (if summary) the summary JSON for one published CSV.
+    The summary needs the site's lat/lon from sites_csv; it is skipped
+    with a note if the label is not listed there.  Returns the paths written.
+    """
+    paths = [gzip_copy(csv_path)]
+    if not summary:
+        return paths
+    sites = load_sites(sites_csv) if os.path.exists(sites_csv) else None
+    row = sites[sites["label"] == label] if sites is not None else ()
+    if not len(row):
+        print(f"[summary] {label} not in {sites_csv}; summary skipped", file=sys.stderr)
+        return paths
+    paths.append(write_summary(csv_path, label, float(row["lat"].iloc[0]),
+                               float(row["lon"].iloc[0])))
+    return paths
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_tail.py
+# Live mode of DSN_V03 for a raw SQM/TESS log that is still being written.
+# The file is followed by byte offset; newly appended complete lines are
+# parsed and run in small batches through the same steps as DSN_V03:
+# 1-min data thinned to every 5th row, rows with sunalt > -3 dropped,
+# nights split at daylight (or a 6 h gap), short nights (< 3*ndata rows)
+# dropped, SQM <= 1 dropped, chisquared from the same windowed polynomial
+# fits, and the DSN_qflag flags.  Sun/moon altitude and LST come from the
+# vectorized DSN_astro formulae instead of astropy (sun ~0.02 deg, moon
+# ~0.3 deg, LST ~1 s).
+#
+# A row is written once its chisquared can no longer change: DSN_V03 fits
+# the last 2*ndata rows of a night differently, so a row is final when
+# 2*ndata+1 later rows of its night exist, or at the end of the night; the
+# first rows of a night also wait until it has 3*ndata rows.  The latency
+# is therefore about 2*ndata samples plus the poll interval (~1.6 h at
+# 5-min cadence) and is bounded.  Rows are appended to
+#   <out>/<stem>.csv          Box archive columns (UTC,SQM,lum,...)
+#   <out>/INFLUX/<stem>.csv   annotated CSV as DSN_V03 writes for Influx
+# and the follow state (offset, open night) is kept in
+# <out>/.tail/<stem>.json, so a restart resumes where it stopped; the open
+# night is re-read and its rows already written are skipped.  A file that
+# shrinks (rotated) is followed from its start again.
+#
+# Usage:
+#   python DSN_tail.py follow DSNdata/LIVE/DSN019S_MtLemmon.dat [--site DSN019-S]
+#          [--out DSNdata/LIVE] [--poll 30] [--once]
+#   python DSN_tail.py synth /tmp/DSN019S_test.dat --start 2025-03-01T12:00:00 \
+#          --rows 3000 [--every 0.05] [--chunk 7]      (test writer, in the
+#          raw layout of the site's sensor type, here SQM3)
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+import DSN_qflag
+from DSN_astro import sun_altitude, moon_altitude, local_sidereal_time
+from DSN_inputs import load_sites
+from DSN_reprocess import site_key, SITES_CSV
+
+#----
+LIVE_DIR = "DSNdata/LIVE"
+POLL_S = 30.0
+SUN_KEEP = -3.0                 # DSN_V03 sun_3
+JD_THR = 6/24.                  # DSN_V03 jd_thr, days
+MAG_ZERO = 21.15                # as DSN_V03
+FNWCM2SR = 0.05746
+# column of SQM (and sky temperature) in the raw lines, per sensor type
+SQM_COL = {"SQM": 4, "SQM2": 5, "SQM3": 2, "SQM4": 5, "TESS": 5}
+SKY_COL = {"TESS": 3}
+# raw columns synth() writes per sensor type (SQM at SQM_COL, sky at SKY_COL)
+SYNTH_COLS = {
+    "SQM": ["UTC", "Local", "Temp", "Volt", "MSAS", "Record"],
+    "SQM2": ["UTC", "Local", "Temp", "Counts", "Freq", "MSAS"],
+    "SQM3": ["UTC", "Local", "MSAS", "Temp"],
+    "SQM4": ["UTC", "Local", "Temp", "Counts", "Freq", "MSAS"],
+    "TESS": ["UTC", "Local", "Tamb", "Tsky", "Freq", "MAG"],
+}
+SYNTH_FILL = {"Temp": "12.5", "Volt": "4.9", "Counts": "1", "Freq": "200.0",
+              "Tamb": "12.5", "Tsky": "-15.0"}
+INF_FIELDS = ["SQM", "lum", "chisquared", "moonalt"]
+INF_HEAD = ("#group,false,false,false,false,true,true\n"
+            "#datatype,string,long,dateTime:RFC3339,double,string,string\n"
+            "#default,,,,,,\n")
+#******************
+def site_row(site, sites_csv=SITES_CSV):
+    """DSNsites.csv row of site (DSN019-S); SystemExit if unknown."""
+    sites = load_sites(sites_csv)
+    row = sites[sites["prefix"] == site]
+    if row.empty:
+        raise SystemExit(f"❌ site {site} not in {sites_csv}")
+    return row.iloc[0]
+#******************
+def measurement(label):
+    """DSN019-S_MtLemmon -> DSN019S_MtLemmon (Influx measurement)."""
+    prefix, _, name = label.partition("_")
+    return f"{prefix[:6]}{prefix[-1]}_{name}" if prefix.startswith("DSN") else label
+#******************
+def cadence(t1, t2):
+    """(read interval in min, ndata, thin to every 5th) as DSN_V03 picks them."""
+    delta = (pd.Timestamp(t2) - pd.Timestamp(t1)).total_seconds() / 60.
+    if delta < 1:
+        delta = 1
+    if delta == 10.:
+        return delta, 10, False
+    if delta == 1:
+        return delta, 19, True
+    return delta, (19 if delta == 5. else 9), False
+#******************
+def mycurve_fit(x, y, degree):
+    """DSN_V03 mycurve_fit: residual sum of squares of a polynomial fit."""
+    xxx = x - np.mean(x)
+    y_fit = np.poly1d(np.polyfit(xxx, y, degree))
+    y_dif = y_fit(xxx) - y
+    return np.max([np.sum(y_dif*y_dif), 1.E-5])
+#******************
+def night_chisquared(jd, sqm, ndata, ks):
+    """
+    chisquared of rows ks of one night (jd, sqm its SQM > 1 rows), with
+    DSN_V03's windows: quadratic over the next hndata rows for the first
+    2*ndata+1 rows, quadratic over the previous hndata rows for the last
+    2*ndata+1, linear over [k-hndata, k+hndata) in between.
+    """
+    hndata = int((ndata-1)/2)
+    m = len(jd)
+    n2, n3 = 2*ndata, m-1-2*ndata
+    out = np.zeros(len(ks))
+    for i, k in enumerate(ks):
+        if k >= n3:
+            lo, hi, deg = max(k-hndata, 0), k, 2
+        elif k <= n2:
+            lo, hi, deg = k, k+hndata, 2
+        else:
+            lo, hi, deg = k-hndata, k+hndata, 1
+        out[i] = mycurve_fit(jd[lo:hi], sqm[lo:hi], deg)
+    return np.around(out, 5)
+#******************
+class Night:
+    """
+    Sun-filtered rows of the open night and how many were written; offset,
+    row and last_before (time of the row before it) say where to re-read
+    it from after a restart.
+    """
+    def __init__(self, offset=0, row=None, emitted=0, last_before=None):
+        self.offset, self.row, self.emitted = offset, row, emitted
+        self.last_before = last_before
+        self.t = np.empty(0, dtype=np.int64)
+        self.sqm = np.empty(0)
+        self.sky = np.empty(0)
+    #----
+    def add(self, t, sqm, sky):
+        self.t = np.concatenate([self.t, t])
+        self.sqm = np.concatenate([self.sqm, sqm])
+        self.sky = np.concatenate([self.sky, sky])
+#******************
+class Tail:
+    """Follows one raw file; poll() processes what was appended since."""
+    def __init__(self, path, site, out=LIVE_DIR, sites_csv=SITES_CSV):
+        row = site_row(site, sites_csv)
+        self.path, self.site, self.out = path, site, out
+        self.lat, self.lon = float(row["lat"]), float(row["lon"])
+        self.sensor = row["sensor"]
+        if self.sensor not in SQM_COL:
+            raise SystemExit(f"❌ no live mode for sensor type {self.sensor} ({path})")
+        self.measurement = measurement(row["label"])
+        stem = os.path.splitext(os.path.basename(path))[0]
+        self.box_file = os.path.join(out, stem + ".csv")
+        self.inf_file = os.path.join(out, "INFLUX", stem + ".csv")
+        self.state_file = os.path.join(out, ".tail", stem + ".json")
+        self.cols = (["UTC", "SQM", "lum", "chisquared", "moonalt", "LST", "sunalt"]
+                     + (["Skytemp"] if self.sensor == "TESS" else []))
+        self.qflag = DSN_qflag.qflag_params(self.sensor)
+        if self.qflag:
+            self.cols.append("qflag")
+        self.fields = INF_FIELDS + (["qflag"] if self.qflag else [])
+        self.load_state()
+    #----
+    def load_state(self):
+        """Resume from the state file; the open night is read again."""
+        self.ino = None
+        self.offset = 0           # bytes consumed
+        self.row = None           # data rows seen (None: header not read yet)
+        self.header = 0           # header lines
+        self.ndata = self.thin = None
+        self.last_t = None        # last time stamp accepted
+        self.night = Night()
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                s = json.load(f)
+            st = os.stat(self.path) if os.path.exists(self.path) else None
+            if st and st.st_ino == s["ino"] and st.st_size >= s["offset"]:
+                n = s["night"]
+                self.ino, self.ndata, self.thin = s["ino"], s["ndata"], s["thin"]
+                self.offset, self.row = n["offset"], n["row"]
+                self.header = s["header"] if n["row"] is not None else 0
+                self.last_t = n["last_before"]
+                self.night = Night(n["offset"], n["row"], n["emitted"], n["last_before"])
+    #----
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        n = self.night
+        s = {"path": self.path, "ino": self.ino, "offset": self.offset,
+             "header": self.header, "ndata": self.ndata, "thin": self.thin,
+             "night": {"offset": n.offset, "row": n.row, "emitted": n.emitted,
+                       "last_before": n.last_before}}
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(s, f)
+        os.replace(tmp, self.state_file)
+    #----
+    def read_lines(self):
+        """Complete new lines and their start offsets."""
+        if not os.path.exists(self.path):       # not created yet
+            return [], []
+        st = os.stat(self.path)
+        if self.ino is not None and (st.st_ino != self.ino or st.st_size < self.offset):
+            print(f"⚠️ {self.path} was replaced or truncated, starting over")
+            self.offset, self.row, self.header = 0, None, 0
+            self.last_t, self.night = None, Night()
+        self.ino = st.st_ino
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1          # a partial last line waits
+        lines, offs, pos = [], [], self.offset
+        for raw in data[:end].split(b"\n")[:-1]:
+            lines.append(raw.decode("utf-8", errors="ignore").rstrip("\r"))
+            offs.append(pos)
+            pos += len(raw) + 1
+        self.offset += end
+        return lines, offs
+    #----
+    def parse(self, lines, offs):
+        """
+        Data rows of new lines as arrays (offset, row number, t ns, SQM,
+        sky temperature).  Header lines are skipped as DSN_V03 does; its
+        read_csv(skiprows=1) also skips the first data row of a file
+        without header, and so do we.
+        """
+        recs = []
+        for line, off in zip(lines, offs):
+            first = line.split(";" if ";" in line else ",", 1)[0].strip()
+            if self.row is None:
+                if line.startswith("#") or not first[:4].isdigit():
+                    self.header += 1
+                    continue
+                self.row = 0 if self.header else -1
+            if not first[:4].isdigit():
+                continue
+            parts = line.split(";" if ";" in line else ",")
+            recs.append((off, self.row, first, parts))
+            self.row += 1
+        if self.ndata is None:
+            data = [r for r in recs if r[1] >= 0]
+            if len(data) < 2:       # wait for two rows to know the cadence
+                self.offset = recs[0][0] if recs else self.offset
+                self.row = None
+                return None
+            _, self.ndata, self.thin = cadence(data[0][2], data[1][2])
+        col, sky = SQM_COL[self.sensor], SKY_COL.get(self.sensor)
+        get = lambda p, c: p[c] if c is not None and c < len(p) else "nan"
+        df = pd.DataFrame({
+            "off": [r[0] for r in recs], "row": [r[1] for r in recs],
+            "t": [r[2] for r in recs],
+            "sqm": [get(r[3], col) for r in recs], "sky": [get(r[3], sky) for r in recs]})
+        df = df[df["row"] >= 0]
+        if self.thin:
+            df = df[df["row"] % 5 == 0]
+        t = pd.to_datetime(df["t"].str.strip(), errors="coerce", format="ISO8601", utc=True)
+        df["t"] = t.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        df["sqm"] = pd.to_numeric(df["sqm"], errors="coerce")
+        df["sky"] = pd.to_numeric(df["sky"], errors="coerce")
+        return df[(df["t"] != np.iinfo(np.int64).min) & df["sqm"].notna()]
+    #----
+    def poll(self):
+        """Process appended lines; returns the number of rows written."""
+        lines, offs = self.read_lines()
+        if not lines:
+            return 0
+        df = self.parse(lines, offs)
+        if df is None or df.empty:
+            self.save_state()
+            return 0
+        # rows at or before the last accepted time (repeats) are dropped
+        if self.last_t is not None:
+            df = df[df["t"] > self.last_t]
+        keep = df["t"].to_numpy()
+        df = df[np.concatenate([[True], keep[1:] > np.maximum.accumulate(keep)[:-1]])] \
+            if len(df) else df
+        written = 0
+        if len(df):
+            utc = pd.DatetimeIndex(df["t"].to_numpy().view("datetime64[ns]"))
+            dark = sun_altitude(utc, self.lat, self.lon) <= SUN_KEEP
+            written = self.feed(df, dark)
+            self.last_t = int(df["t"].iloc[-1])
+        self.save_state()
+        return written
+    #----
+    def feed(self, df, dark):
+        """
+        Add a batch to the open night.  Daylight after night rows, or a gap
+        over JD_THR, ends the night: all its rows are written and a new
+        night starts at that row.
+        """
+        t, off, row = df["t"].to_numpy(), df["off"].to_numpy(), df["row"].to_numpy()
+        sqm, sky = df["sqm"].to_numpy(), df["sky"].to_numpy()
+        n = self.night
+        last = n.t[-1] if len(n.t) else None
+        seg, written = [], 0
+        for i in range(len(t)):
+            if dark[i] and (last is None or t[i] - last <= JD_THR*86400e9):
+                seg.append(i)
+                last = t[i]
+                continue
+            if len(n.t) or seg:
+                n.add(t[seg], sqm[seg], sky[seg])
+                written += self.emit(closed=True)
+                before = int(t[i-1]) if i else self.last_t
+                n = self.night = Night(int(off[i]), int(row[i]), 0, before)
+                seg = []
+            last = t[i] if dark[i] else None
+            if dark[i]:
+                seg.append(i)
+        n.add(t[seg], sqm[seg], sky[seg])
+        return written + self.emit(closed=False)
+    #----
+    def emit(self, closed):
+        """Write the rows of the open night that are final."""
+        n = self.night
+        long_enough = len(n.t) - 1 >= 3*self.ndata
+        if not long_enough:
+            return 0
+        good = n.sqm > 1.
+        t, sqm, sky = n.t[good], n.sqm[good], n.sky[good]
+        m = len(t)
+        last = m if closed else m - 2*self.ndata - 1
+        if last <= n.emitted:
+            return 0
+        ks = np.arange(n.emitted, last)
+        utc = pd.DatetimeIndex(t.view("datetime64[ns]"))
+        jd = np.asarray(utc.to_julian_date())
+        chi = night_chisquared(jd, sqm, self.ndata, ks)
+        u = utc[ks]
+        df = pd.DataFrame({
+            "UTC": u.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "SQM": np.around(sqm[ks], 3),
+            "lum": np.around(FNWCM2SR*10**((MAG_ZERO-sqm[ks])/2.5), 5),
+            "chisquared": chi,
+            "moonalt": np.around(moon_altitude(u, self.lat, self.lon), 2),
+            "LST": np.around(local_sidereal_time(u, self.lon), 5),
+            "sunalt": np.around(sun_altitude(u, self.lat, self.lon), 3)})
+        if self.sensor == "TESS":
+            df["Skytemp"] = np.around(sky[ks], 2)
+        if self.qflag:
+            flags, _ = DSN_qflag.quality_flags(sqm, np.zeros(m, dtype=int),
+                                               sunalt=sun_altitude(utc, self.lat, self.lon),
+                                               **self.qflag)
+            df["qflag"] = flags[ks]
+        self.write(df[self.cols])
+        n.emitted = last
+        return len(ks)
+    #----
+    def write(self, df):
+        """Append rows to the Box-format and the Influx CSV."""
+        os.makedirs(os.path.dirname(self.inf_file), exist_ok=True)
+        new_box = not os.path.exists(self.box_file) or os.path.getsize(self.box_file) == 0
+        df.to_csv(self.box_file, mode="a", header=new_box, index=False)
+        new_inf = not os.path.exists(self.inf_file) or os.path.getsize(self.inf_file) == 0
+        with open(self.inf_file, "a", newline="") as f:
+            if new_inf:
+                f.write(INF_HEAD)
+            for field in self.fields:
+                df1 = pd.DataFrame({"": "", " ": "", "table": "", "_time": df["UTC"],
+                                    "_value": df[field], "_field": field,
+                                    "_measurement": self.measurement})
+                df1.to_csv(f, header=["", "", "table", "_time", "_value", "_field",
+                                      "_measurement"] if new_inf and field == "SQM" else False,
+                           index=False)
+        print(f"✅ {self.site}: {len(df)} rows up to {df['UTC'].iloc[-1]} -> {self.box_file}")
+#******************
+def follow(path, site=None, out=LIVE_DIR, poll=POLL_S, once=False, sites_csv=SITES_CSV):
+    tail = Tail(path, site or site_key(os.path.basename(path)), out, sites_csv)
+    while True:
+        tail.poll()
+        if once:
+            return tail
+        time.sleep(poll)
+#******************
+def synth(path, start, rows, every=0.0, chunk=1, interval=5.0, site=None, sites_csv=SITES_CSV):
+    """
+    Test writer: appends raw lines in the layout of the site's sensor type
+    (SYNTH_COLS; site defaults to the file name, as follow()), one every
+    interval minutes from start, chunk lines at a time with a partial
+    line at the end of each write, sleeping every seconds between writes.
+    SQM is a dark-sky curve with noise and a passing cloud.
+    """
+    row = site_row(site or site_key(os.path.basename(path)), sites_csv)
+    sensor = row["sensor"]
+    if sensor not in SYNTH_COLS:
+        raise SystemExit(f"❌ no raw layout for sensor type {sensor} ({path})")
+    names = SYNTH_COLS[sensor]
+    rng = np.random.default_rng(0)
+    t = pd.date_range(start, periods=rows, freq=pd.Timedelta(minutes=interval))
+    sun = sun_altitude(t, float(row["lat"]), float(row["lon"]))
+    sqm = 21.3 - 0.25*np.clip(sun + 18, 0, None) + rng.normal(0, 0.02, rows)
+    sqm -= np.where((np.arange(rows) // 40) % 7 == 3, 1.5, 0.0)         # clouds
+    loc = t - pd.Timedelta(hours=7)
+    fields = [SYNTH_FILL.get(c, "{i}") for c in names]
+    fields[0], fields[1] = "{a:%Y-%m-%dT%H:%M:%S}.000", "{b:%Y-%m-%dT%H:%M:%S}.000"
+    fields[SQM_COL[sensor]] = "{s:.2f}"
+    line = ";".join(fields) + "\n"
+    text = "".join(line.format(a=a, b=b, s=v, i=i)
+                   for i, (a, b, v) in enumerate(zip(t, loc, sqm)))
+    lines = text.splitlines(keepends=True)
+    new = not os.path.exists(path)
+    with open(path, "a") as f:
+        if new:
+            f.write(f"# Synthetic {sensor} log\n# {';'.join(names)}\n")
+        pending = ""
+        for i in range(0, len(lines), chunk):
+            block = pending + "".join(lines[i:i+chunk])
+            cut = max(len(block) - 5, 0) if i + chunk < len(lines) else len(block)
+            f.write(block[:cut])
+            f.flush()
+            pending = block[cut:]
+            if every:
+                time.sleep(every)
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("follow", help="follow a growing raw file")
+    p.add_argument("file")
+    p.add_argument("--site", help="default: from the file name (DSN019S_... -> DSN019-S)")
+    p.add_argument("--out", default=LIVE_DIR)
+    p.add_argument("--poll", type=float, default=POLL_S, help="seconds between reads")
+    p.add_argument("--once", action="store_true", help="process what is there and exit")
+    p.add_argument("--sites-csv", default=SITES_CSV)
+    s = sub.add_parser("synth", help="append a synthetic raw log (for testing)")
+    s.add_argument("file")
+    s.add_argument("--site", help="default: from the file name; sets the raw layout")
+    s.add_argument("--sites-csv", default=SITES_CSV)
+    s.add_argument("--start", required=True)
+    s.add_argument("--rows", type=int, default=2000)
+    s.add_argument("--every", type=float, default=0.0, help="seconds between writes")
+    s.add_argument("--chunk", type=int, default=1, help="lines per write")
+    args = ap.parse_args()
+    if args.cmd == "follow":
+        follow(args.file, args.site, args.out, args.poll, args.once, args.sites_csv)
+    else:
+        synth(args.file, args.start, args.rows, args.every, args.chunk,
+              site=args.site, sites_csv=args.sites_csv)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_tess_temp.py
+# Store of TESS/SQM enclosure temperatures, one file per site:
+#   DSNdata/TESS_TEMP/<label>_T.csv   UT,T   (sorted by UT, no repeats)
+# filled from the ';'-separated .dat files in DSNdata/NEW (UT in column 0,
+# enclosure temperature in column 2, as before).
+#
+# Files are kept sorted, so the last line is the site's high-water mark:
+# readings newer than it are appended without reading the file.  Only a
+# batch that reaches back into the covered span (late/backfilled data)
+# merges with the existing rows, rewriting the file once.  index.json
+# records each file's size and last UT; a file changed behind our back
+# (size mismatch) is verified, and sorted if needed, before use.
+# Sorted files also allow range reads by byte-offset bisection and an
+# as-of join onto processed SQM rows.
+#
+# Usage:
+#   python DSN_tess_temp.py ingest [DSNdata/NEW/*.dat ...]
+#   python DSN_tess_temp.py query DSN014-S --from 2025-03-01 --to 2025-03-02
+#
+#   from DSN_tess_temp import read_range, attach_temperature
+#   df = attach_temperature(df, "DSN014-S")   # adds T (nearest within 10 min)
+import os
+import sys
+import json
+import glob
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+#----
+TEMP_DIR = "DSNdata/TESS_TEMP"
+NEW_GLOB = "DSNdata/NEW/*.dat"
+INDEX_NAME = "index.json"
+EOL = "\r\n"                 # as csv.writer wrote the existing files
+HEADER = "UT,T" + EOL
+JOIN_TOLERANCE = pd.Timedelta(minutes=10)
+#******************
+def temp_path(label, directory=TEMP_DIR):
+    return os.path.join(directory, f"{label}_T.csv")
+#******************
+def _ns(ut):
+    """UT string(s) -> int64 ns (NaT -> min int64)."""
+    t = pd.to_datetime(ut, errors="coerce", format="ISO8601")
+    if isinstance(t, pd.Timestamp) or t is pd.NaT:
+        return np.iinfo(np.int64).min if t is pd.NaT else t.value
+    return np.asarray(t, dtype="datetime64[ns]").astype(np.int64)
+#******************
+def _utc_ns(t):
+    """Timestamp or string (naive = UTC) -> int64 ns."""
+    t = pd.Timestamp(t)
+    return (t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")).value
+#******************
+def read_dat(path):
+    """(UT, T) string pairs of one .dat file, NaN/empty temperatures dropped."""
+    rows = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(";")
+            if len(parts) < 3:
+                continue
+            ut, temp = parts[0].strip(), parts[2].strip()
+            if not ut or not temp or temp.lower() == "nan":
+                continue
+            rows.append((ut, temp))
+    return pd.DataFrame(rows, columns=["UT", "T"])
+#******************
+def _sorted_unique(df):
+    """Sort by parsed UT, keep the first reading of each UT, drop unparsable."""
+    df = df.assign(_t=_ns(df["UT"]))
+    df = df[df["_t"] != np.iinfo(np.int64).min]
+    df = df.drop_duplicates("UT", keep="first").sort_values("_t", kind="stable")
+    return df
+#******************
+def _write_atomic(path, df):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".csv")
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+        f.write(HEADER)
+        f.writelines(f"{u},{t}{EOL}" for u, t in zip(df["UT"], df["T"]))
+    os.replace(tmp, path)
+#******************
+def _last_line(path):
+    """Last non-empty line of a file, read from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos, buf = end, b""
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = buf.rstrip(b"\r\n").split(b"\n")
+            if len(lines) > 1 or pos == 0:
+                return lines[-1].decode("utf-8", errors="ignore")
+    return ""
+#******************
+class TempStore:
+    def __init__(self, directory=TEMP_DIR):
+        self.dir = directory
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, INDEX_NAME)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+    #----
+    def save_index(self):
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=".index-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+    #----
+    def _record(self, label):
+        path = temp_path(label, self.dir)
+        last = _last_line(path).split(",")[0]
+        self.index[label] = {"size": os.path.getsize(path),
+                             "last": last if last != "UT" else None}
+        return self.index[label]
+    #----
+    def high_water(self, label):
+        """Last UT stored for label (None if empty); verifies/sorts the file if needed."""
+        path = temp_path(label, self.dir)
+        if not os.path.exists(path):
+            return None
+        entry = self.index.get(label)
+        if entry is None or entry.get("size") != os.path.getsize(path):
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            t = _ns(df["UT"]) if len(df) else np.empty(0, np.int64)
+            if len(df) and (np.any(np.diff(t) <= 0) or df["UT"].duplicated().any()):
+                print(f"Sorting {path} ({len(df)} rows)")
+                _write_atomic(path, _sorted_unique(df))
+            entry = self._record(label)
+        return entry["last"]
+    #----
+    def ingest(self, label, new):
+        """
+        Add (UT, T) rows for label.  Newer than the high-water mark:
+        appended; otherwise merged (existing readings win).  Returns the
+        number of rows added.
+        """
+        path = temp_path(label, self.dir)
+        new = _sorted_unique(new)
+        if new.empty:
+            return 0
+        hw = self.high_water(label)
+        if hw is None:
+            _write_atomic(path, new)
+            self._record(label)
+            return len(new)
+        hw_ns = _ns(hw)
+        newer = new[new["_t"] > hw_ns]
+        older = new[new["_t"] <= hw_ns]
+        added = 0
+        if len(older):
+            old = pd.read_csv(path, dtype=str, keep_default_na=False)
+            merged = _sorted_unique(pd.concat([old, older[["UT", "T"]]], ignore_index=True))
+            added = len(merged) - len(old)
+            if added:
+                print(f"Merging {added} earlier readings into {path}")
+                _write_atomic(path, merged)
+        if len(newer):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                glued = f.read(1) != b"\n"
+            with open(path, "a", encoding="utf-8", newline="") as out:
+                if glued:
+                    out.write(EOL)
+                out.writelines(f"{u},{t}{EOL}" for u, t in zip(newer["UT"], newer["T"]))
+            added += len(newer)
+        self._record(label)
+        return added
+#******************
+def _line_ns(f, pos):
+    """(UT of the line starting at pos as int64 ns, offset of the next line)."""
+    f.seek(pos)
+    line = f.readline()
+    return _ns(line.split(b",", 1)[0].decode()), pos + len(line)
+#******************
+def _bisect(f, lo, hi, key_ns):
+    """
+    Offset of the first line starting in [lo, hi] with UT >= key_ns, in a
+    sorted file; lo and hi are line starts (hi may be EOF).
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid - 1)
+        f.readline()
+        p = f.tell()                # first line start >= mid
+        if p >= hi:                 # the line at lo reaches past mid
+            t, nxt = _line_ns(f, lo)
+            if t >= key_ns:
+                return lo
+            lo = nxt
+            continue
+        t, nxt = _line_ns(f, p)
+        if t < key_ns:
+            lo = nxt
+        else:
+            hi = p
+    return lo
+#******************
+def read_range(label, start=None, end=None, directory=TEMP_DIR):
+    """
+    Readings of label with start <= UT < end as a DataFrame (UT tz-aware
+    UTC, T float).  Only the requested byte range is read.
+    """
+    path = temp_path(label, directory)
+    if not os.path.exists(path):
+        return pd.DataFrame({"UT": pd.Series(dtype="datetime64[ns, UTC]"), "T": []})
+    TempStore(directory).high_water(label)     # make sure it is sorted
+    lo = _utc_ns(start) if start is not None else None
+    hi = _utc_ns(end) if end is not None else None
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        first = len(f.readline())   # after the header
+        a = _bisect(f, first, size, lo) if lo is not None else first
+        b = _bisect(f, a, size, hi) if hi is not None else size
+        f.seek(a)
+        chunk = f.read(max(0, b - a)).decode("utf-8", errors="ignore")
+    rows = [ln.split(",", 1) for ln in chunk.splitlines() if ln]
+    df = pd.DataFrame(rows, columns=["UT", "T"]) if rows else pd.DataFrame(columns=["UT", "T"])
+    df["UT"] = pd.to_datetime(df["UT"], utc=True, format="ISO8601")
+    df["T"] = pd.to_numeric(df["T"], errors="coerce")
+    return df
+#******************
+def attach_temperature(df, label, utc_col="UTC", tolerance=JOIN_TOLERANCE,
+                       direction="nearest", directory=TEMP_DIR):
+    """
+    df with a 'T' column: the enclosure temperature nearest in time to
+    each row (within tolerance, else NaN).  Row order is preserved.
+    """
+    utc = pd.to_datetime(df[utc_col], utc=True, errors="coerce")
+    out = df.copy()
+    if utc.notna().sum() == 0:
+        out["T"] = np.nan
+        return out
+    temps = read_range(label, utc.min() - tolerance, utc.max() + tolerance, directory)
+    left = pd.DataFrame({"_t": utc, "_i": np.arange(len(df))}).dropna(subset=["_t"])
+    left = left.sort_values("_t", kind="stable")
+    if temps.empty:
+        out["T"] = np.nan
+        return out
+    j = pd.merge_asof(left, temps.rename(columns={"UT": "_t"}), on="_t",
+                      tolerance=tolerance, direction=direction)
+    t = np.full(len(df), np.nan)
+    t[j["_i"].to_numpy()] = j["T"].to_numpy(float)
+    out["T"] = t
+    return out
+#******************
+def ingest_files(files, directory=TEMP_DIR):
+    store = TempStore(directory)
+    for infile in sorted(files):
+        print(f"Reading {infile}")
+        # DSN029-T_2026-019.dat -> DSN029-T
+        label = os.path.basename(infile).split("_")[0]
+        n = store.ingest(label, read_dat(infile))
+        print(f"Wrote/appended {n} rows to {temp_path(label, directory)}")
+    store.save_index()
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ingest", help="add readings from .dat files")
+    p.add_argument("files", nargs="*", help=f"default {NEW_GLOB}")
+    p.add_argument("--dir", default=TEMP_DIR)
+    q = sub.add_parser("query", help="print readings of one site")
+    q.add_argument("label")
+    q.add_argument("--from", dest="start")
+    q.add_argument("--to", dest="end")
+    q.add_argument("--dir", default=TEMP_DIR)
+    args = ap.parse_args()
+    if args.cmd == "ingest":
+        ingest_files(args.files or glob.glob(NEW_GLOB), args.dir)
+    else:
+        df = read_range(args.label, args.start, args.end, args.dir)
+        df.assign(UT=df["UT"].dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3]) \
+          .to_csv(sys.stdout, index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# DSN_timecorr.py
+# UT / local-time handling for DSN_V03 on int64 nanosecond arrays.
+#
+# All DSN sites keep fixed offsets from UT (Arizona: MST = UT-7, no DST);
+# New Mexico loggers switch between MST and MDT (UT-6).  Instead of
+# localizing row by row with pytz, each file's offset is measured from the
+# data: local - UT is rounded to a 15-minute quantum per row (so mixed-
+# offset files just give several values), the dominant value is the
+# logger's offset, and the remainder is clock error, fitted linearly
+# against time for a drift rate.  Corrections are array arithmetic.
+#
+#   ut  = local_to_ut(frame.Tloc, MST)               # Tloc + 7 h
+#   rep = detect(frame.UT, frame.Tloc, expected=MST) # offsets, drift, mismatches
+#   tloc, rep = correct_local(frame.UT, frame.Tloc, MST)
+#   print(describe(rep))
+import numpy as np
+import pandas as pd
+
+#----
+MST = -7.0                              # hours, local = UT + offset
+MDT = -6.0
+HOUR_NS = 3_600_000_000_000
+DAY_NS = 24 * HOUR_NS
+QUANTUM_NS = HOUR_NS // 4               # offsets are whole quarter hours
+CLOCK_TOL_S = 60.0                      # larger residuals are clock errors
+NAT = np.iinfo(np.int64).min
+#******************
+def to_ns(values, fmt=None):
+    """
+    Time stamps (strings, datetimes, tz-aware -> UTC wall time) as int64
+    ns since the epoch of their wall time; unparsable -> NAT.
+    """
+    if isinstance(values, np.ndarray) and values.dtype == np.int64:
+        return values
+    s = values.reset_index(drop=True) if isinstance(values, pd.Series) else pd.Series(values)
+    t = pd.to_datetime(s, errors="coerce", format=fmt or "ISO8601")
+    if getattr(t.dt, "tz", None) is not None:
+        t = t.dt.tz_convert("UTC").dt.tz_localize(None)
+    return t.to_numpy(dtype="datetime64[ns]").view(np.int64)
+#******************
+def from_ns(ns):
+    """int64 ns -> naive datetime64[ns] array (NAT -> NaT)."""
+    return np.asarray(ns, dtype=np.int64).view("datetime64[ns]")
+#******************
+def local_to_ut(tloc, offset_hours=MST, fmt=None):
+    """Naive UT of local wall times at a fixed offset (local = UT + offset)."""
+    ns = to_ns(tloc, fmt)
+    ut = ns - int(round(offset_hours * HOUR_NS))
+    return from_ns(np.where(ns == NAT, NAT, ut))
+#******************
+def ut_to_local(ut, offset_hours=MST):
+    ns = to_ns(ut)
+    loc = ns + int(round(offset_hours * HOUR_NS))
+    return from_ns(np.where(ns == NAT, NAT, loc))
+#******************
+def offsets(ut, tloc):
+    """
+    Per-row offset local - UT in hours (rounded to QUANTUM_NS, NaN where a
+    time is missing) and the clock error beyond it in seconds.
+    """
+    u, t = to_ns(ut), to_ns(tloc)
+    valid = (u != NAT) & (t != NAT)
+    d = np.where(valid, t - u, 0)
+    q = np.round(d / QUANTUM_NS).astype(np.int64) * QUANTUM_NS
+    off_h = np.where(valid, q / HOUR_NS, np.nan)
+    resid_s = np.where(valid, (d - q) / 1e9, np.nan)
+    return off_h, resid_s
+#******************
+def detect(ut, tloc, expected=None, tol_s=CLOCK_TOL_S):
+    """
+    Offset and clock report of one file:
+      offset        dominant local - UT (hours), or expected if given
+      offsets       {hours: rows} of all offsets seen
+      n_mismatch    rows at another offset
+      n_clock       rows whose clock error exceeds tol_s
+      clock_s       median clock error (s)
+      drift_s_day   fitted clock drift (s/day, 0 for < 2 rows)
+    """
+    ut, tloc = to_ns(ut), to_ns(tloc)       # parse once
+    off_h, resid = offsets(ut, tloc)
+    ok = np.isfinite(off_h)
+    vals, counts = np.unique(off_h[ok], return_counts=True)
+    dominant = float(vals[np.argmax(counts)]) if vals.size else np.nan
+    offset = float(expected) if expected is not None else dominant
+    drift = 0.0
+    if ok.sum() >= 2:
+        days = (ut[ok] - ut[ok].min()) / DAY_NS
+        if np.ptp(days) > 0:
+            drift = float(np.polyfit(days, resid[ok], 1)[0])
+    return {
+        "offset": offset,
+        "offsets": {float(v): int(c) for v, c in zip(vals, counts)},
+        "n_mismatch": int((ok & (off_h != offset)).sum()),
+        "n_clock": int((ok & (np.abs(resid) > tol_s)).sum()),
+        "clock_s": float(np.median(resid[ok])) if ok.any() else 0.0,
+        "drift_s_day": round(drift, 3),
+        "rows": int(len(off_h)),
+    }
+#******************
+def correct_local(ut, tloc, offset_hours=MST, tol_s=CLOCK_TOL_S):
+    """
+    Local times rebuilt from UT at offset_hours for rows whose local time
+    is at another offset or off by more than tol_s (UT is trusted); other
+    rows keep their time.  Returns (naive datetime64 array, report with
+    'n_fixed').
+    """
+    ut, tloc = to_ns(ut), to_ns(tloc)
+    rep = detect(ut, tloc, expected=offset_hours, tol_s=tol_s)
+    off_h, resid = offsets(ut, tloc)
+    bad = ((off_h != offset_hours) | (np.abs(resid) > tol_s)) & (ut != NAT)
+    fixed = np.where(bad, ut + int(round(offset_hours * HOUR_NS)), tloc)
+    rep["n_fixed"] = int(bad.sum())
+    return from_ns(fixed), rep
+#******************
+def describe(rep):
+    """One-line summary of a detect/correct_local report."""
+    offs = ", ".join(f"UT{h:+g}h: {n}" for h, n in sorted(rep["offsets"].items()))
+    s = (f"offset UT{rep['offset']:+g}h ({offs or 'no rows'}), {rep['n_mismatch']} at other "
+         f"offsets, clock {rep['clock_s']:+.1f} s, drift {rep['drift_s_day']:+.2f} s/day")
+    if "n_fixed" in rep:
+        s += f", {rep['n_fixed']} local times rebuilt from UT"
+    return s
@@ -0,0 +1,107 @@
+# DSN_validate.py
+# Time-order validation of a sensor frame before the JD/night stages of
+# DSN_V03.  Everything is computed on the int64 ns UT array at once:
+#   inversions  rows earlier than the row before them
+#   duplicates  rows whose UT already occurred (any position)
+#   segments    monotonic runs between inversions (concatenated dumps)
+#   overlaps    segments that start before an earlier segment ended
+#   nat         rows whose UT does not parse
+# repair() stable-sorts by UT, drops NaT rows and resolves duplicate
+# timestamps by policy:
+#   first  keep the first row of each UT (file order)        [default]
+#   last   keep the last row (later dump wins)
+#   mean   average numeric columns, first value of the others
+#   drop   drop every row of a duplicated UT
+# The policy is taken from the environment variable DSN_DUP_POLICY when
+# not given.
+#
+#   frame, rep = validate(frame, "UT")
+#   print(describe(rep)); run_metrics["validate"] = rep
+import os
+import numpy as np
+import DSN_timecorr
+
+#----
+DUP_POLICIES = ("first", "last", "mean", "drop")
+DEFAULT_POLICY = "first"
+#******************
+def dup_policy(policy=None):
+    """policy, else DSN_DUP_POLICY, else DEFAULT_POLICY; ValueError if unknown."""
+    policy = (policy or os.environ.get("DSN_DUP_POLICY", "") or DEFAULT_POLICY).strip().lower()
+    if policy not in DUP_POLICIES:
+        raise ValueError(f"unknown duplicate policy {policy!r}, use one of {DUP_POLICIES}")
+    return policy
+#******************
+def check(ut):
+    """Order report of the UT values ut (see module header)."""
+    ns = DSN_timecorr.to_ns(ut)
+    valid = ns != DSN_timecorr.NAT
+    t = ns[valid]
+    rep = {"rows": int(len(ns)), "nat": int((~valid).sum()),
+           "inversions": 0, "duplicates": 0, "segments": int(t.size > 0),
+           "overlaps": 0, "monotonic": True}
+    if t.size < 2:
+        return rep
+    back = np.diff(t) < 0
+    # segment starts: first row and every row after an inversion
+    starts = np.concatenate(([0], np.flatnonzero(back) + 1))
+    seg_lo = np.minimum.reduceat(t, starts)
+    seg_hi = np.maximum.reduceat(t, starts)
+    prev_hi = np.maximum.accumulate(seg_hi)[:-1]
+    s = np.sort(t, kind="stable")
+    rep.update(inversions=int(back.sum()),
+               duplicates=int((s[1:] == s[:-1]).sum()),
+               segments=int(starts.size),
+               overlaps=int((seg_lo[1:] <= prev_hi).sum()))
+    rep["monotonic"] = rep["inversions"] == 0 and rep["duplicates"] == 0 and rep["nat"] == 0
+    return rep
+#******************
+def repair(df, ut_col="UT", policy=None, ns=None):
+    """
+    df stable-sorted by ut_col with NaT rows dropped and duplicate UT
+    resolved by policy; index reset.  ns: df[ut_col] already as int64 ns.
+    Returns (frame, rows removed).
+    """
+    policy = dup_policy(policy)
+    ns = DSN_timecorr.to_ns(df[ut_col] if ns is None else ns)
+    keep = np.flatnonzero(ns != DSN_timecorr.NAT)
+    order = keep[np.argsort(ns[keep], kind="stable")]
+    out = df.iloc[order].reset_index(drop=True)
+    t = ns[order]
+    first = np.concatenate(([True], t[1:] != t[:-1]))
+    last = np.concatenate((t[1:] != t[:-1], [True]))
+    if policy == "first":
+        out = out[first]
+    elif policy == "last":
+        out = out[last]
+    elif policy == "drop":
+        out = out[first & last]
+    elif not first.all():                      # mean
+        group = np.cumsum(first) - 1
+        num = out.select_dtypes("number").columns
+        agg = {c: ("mean" if c in num else "first") for c in out.columns}
+        out = out.groupby(group, sort=False).agg(agg)
+    out = out.reset_index(drop=True)
+    return out, len(df) - len(out)
+#******************
+def validate(df, ut_col="UT", fix=True, policy=None):
+    """
+    Order report of df[ut_col] and, when it is not monotonic and fix is
+    set, the repaired frame.  Returns (frame, report); the report carries
+    'policy' and 'removed' when a repair was made.
+    """
+    ns = DSN_timecorr.to_ns(df[ut_col])      # parsed once
+    rep = check(ns)
+    if fix and not rep["monotonic"]:
+        df, removed = repair(df, ut_col, policy, ns=ns)
+        rep["policy"] = dup_policy(policy)
+        rep["removed"] = int(removed)
+    return df, rep
+#******************
+def describe(rep):
+    """One-line summary of a check/validate report."""
+    s = (f"{rep['rows']} rows, {rep['inversions']} inversions, {rep['duplicates']} duplicate UT, "
+         f"{rep['segments']} segments ({rep['overlaps']} overlapping), {rep['nat']} bad UT")
+    if "removed" in rep:
+        s += f"; sorted, {rep['removed']} rows removed (duplicates: {rep['policy']})"
+    return s
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DSN_xlsx.py
+# Fast ingest of the Sugarloaf/Bonita SQM1 Excel workbooks for DSN_V03.
+# The first worksheet's XML is streamed from the .xlsx zip in chunks of
+# whole rows; only the cells of the wanted columns are converted, straight
+# to float64, no workbook object is built.  Cell attributes may come in
+# any order; numbers, booleans, formula results, shared strings and inline
+# strings are read as pd.to_numeric of their text (errors -> NaN).  Tloc
+# (yymmddHHMM numbers) is decoded arithmetically to datetime64.
+#
+# The streamed result is checked before it is used: when a sheet cell has
+# no reference, the last row read falls short of the sheet's <dimension>,
+# or Tloc/SQM come back empty, the workbook is read with
+# pd.read_excel(header=None, skiprows=head_skip) instead.  --verify
+# compares both readers on a workbook.
+#
+# The converted columns are cached (compressed) as
+# DSNdata/XLSX_CACHE/<key>.npz, the key being the SHA-256 of the workbook
+# bytes and the layout (columns, kept columns, header rows), so re-runs and
+# reprocessing of an unchanged workbook never parse it again.  The cache
+# directory is git-ignored; the environment variable DSN_XLSX_CACHE
+# overrides it (DSN_reprocess points its DSN_V03 runs at the shared one).
+#
+# Usage:
+#   python DSN_xlsx.py DSNdata/SAVE/DSN003-S_25_010.xlsx [--site Sugarloaf] [--no-cache] [--verify]
+#
+#   from DSN_xlsx import read_sqm1, LAYOUTS
+#   frame = read_sqm1(path, LAYOUTS["Sugarloaf"])   # Tloc datetime64, KEEP columns
+import os
+import re
+import sys
+import zlib
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import posixpath
+from xml.sax.saxutils import unescape
+import numpy as np
+import pandas as pd
+
+#----
+CACHE_DIR = "DSNdata/XLSX_CACHE"
+FORMAT = 2                                   # bump when the cached layout changes
+HEAD_SKIP = 4                                # title, units, names, short names
+CHUNK = 1 << 20
+# sheet columns of the two loggers (as DSN_V03 names them)
+LAYOUTS = {
+    "Sugarloaf": ['Tloc', 'Solar', 'Winds', 'Windd', 'Etempc', 'RH',
+                  'Barom', 'Precip', 'SQM', 'Stempc', 'Battery', 'Dtempc'],
+    "Bonita": ['Tloc', 'Precip', 'SQM', 'Stempc', 'Solar', 'Winds',
+               'Windd', 'Etempc', 'RH', 'Barom', 'Battery', 'Dtempc'],
+}
+KEEP = ['Tloc', 'Winds', 'Etempc', 'RH', 'SQM', 'Battery']
+CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+REF_RE = re.compile(rb'\br="([A-Z]+)(\d+)"')
+TYPE_RE = re.compile(rb'\bt="([^"]*)"')
+VALUE_RE = re.compile(rb'<v>([^<]*)</v>')
+TEXT_RE = re.compile(rb'<t\b[^>/]*>([^<]*)</t>')
+SI_RE = re.compile(rb'<si\b[^>]*?(?:/>|>(.*?)</si>)', re.S)
+DIM_RE = re.compile(rb'<dimension\b[^>]*\bref="[A-Z]*\d*:?[A-Z]*(\d+)"')
+#******************
+def _letters(i):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    s = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = chr(65 + r) + s
+    return s
+#******************
+def _first_sheet(z):
+    """Zip member of the workbook's first worksheet."""
+    wb = z.read("xl/workbook.xml")
+    rid = re.search(rb'<sheet\b[^>]*\br:id="([^"]+)"', wb)
+    if rid is not None:
+        rels = z.read("xl/_rels/workbook.xml.rels")
+        for rel in re.finditer(rb'<Relationship\b[^>]*>', rels):
+            if re.search(rb'\bId="' + re.escape(rid.group(1)) + b'"', rel.group(0)):
+                target = re.search(rb'Target="([^"]+)"', rel.group(0)).group(1).decode()
+                return target.lstrip("/") if target.startswith("/") \
+                    else posixpath.normpath(posixpath.join("xl", target))
+    return "xl/worksheets/sheet1.xml"
+#******************
+def _rows(f):
+    """Chunks of the sheet XML ending on a row boundary."""
+    tail = b""
+    while True:
+        block = f.read(CHUNK)
+        if not block:
+            if tail:
+                yield tail
+            return
+        buf = tail + block
+        cut = buf.rfind(b"</row>")
+        if cut < 0:
+            tail = buf
+            continue
+        cut += len(b"</row>")
+        yield buf[:cut]
+        tail = buf[cut:]
+#******************
+def _text(xml):
+    """Text of a string item (<si>/<is>): its <t> runs joined."""
+    return unescape(b"".join(TEXT_RE.findall(xml or b"")).decode("utf-8"))
+#******************
+def _shared_strings(z):
+    """The workbook's shared string table."""
+    try:
+        xml = z.read("xl/sharedStrings.xml")
+    except KeyError:
+        return []
+    return [_text(m.group(1)) for m in SI_RE.finditer(xml)]
+#******************
+def read_columns(path, columns, head_skip=HEAD_SKIP):
+    """
+    {column index: float64 array} of the first worksheet below head_skip
+    rows, one entry per sheet row that has any of the wanted cells (as
+    pd.read_excel(header=None, skiprows=head_skip) rows).  None when the
+    sheet can't be streamed reliably (cells without reference, fewer rows
+    than its <dimension>).
+    """
+    want = {_letters(i).encode(): i for i in columns}
+    rows, cols, vals = [], [], []
+    shared = None
+    dim_last = last = 0
+    with zipfile.ZipFile(path) as z, z.open(_first_sheet(z)) as f:
+        for chunk in _rows(f):
+            if not last:
+                dim = DIM_RE.search(chunk)
+                dim_last = int(dim.group(1)) if dim else dim_last
+            for m in CELL_RE.finditer(chunk):
+                ref = REF_RE.search(m.group(1))
+                if ref is None:
+                    return None                      # positional cells
+                row = int(ref.group(2))
+                last = max(last, row)
+                col = want.get(ref.group(1))
+                if col is None or row <= head_skip or m.group(2) is None:
+                    continue
+                kind = TYPE_RE.search(m.group(1))
+                kind = kind.group(1) if kind else b"n"
+                if kind == b"inlineStr":
+                    text = _text(m.group(2))
+                elif kind in (b"n", b"b", b"s", b"str"):
+                    v = VALUE_RE.search(m.group(2))
+                    if v is None or not v.group(1):
+                        continue
+                    text = v.group(1).decode()
+                    if kind == b"s":
+                        if shared is None:
+                            shared = _shared_strings(z)
+                        i = int(text)
+                        text = shared[i] if i < len(shared) else ""
+                    elif kind == b"str":
+                        text = unescape(text)
+                else:
+                    continue                         # errors, ISO dates
+                rows.append(row)
+                cols.append(col)
+                vals.append(text)
+    if last < dim_last:
+        return None
+    row_ids, at = np.unique(np.asarray(rows, dtype=np.int64), return_inverse=True)
+    num = pd.to_numeric(pd.Series(vals, dtype=object).str.strip(),
+                        errors="coerce").to_numpy(dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.int64)
+    out = {}
+    for i in columns:
+        a = np.full(len(row_ids), np.nan)
+        sel = cols == i
+        a[at[sel]] = num[sel]
+        out[i] = a
+    return out
+#******************
+def read_excel_columns(path, columns, names, head_skip=HEAD_SKIP):
+    """Fallback: the kept columns through pd.read_excel (Tloc decoded)."""
+    df = pd.read_excel(path, header=None, skiprows=head_skip)
+    arrays = {}
+    for c in names:
+        i = columns.index(c)
+        s = df[i] if i in df.columns else pd.Series(np.nan, index=df.index)
+        if c == "Tloc" and pd.api.types.is_datetime64_any_dtype(s):
+            arrays[c] = s.to_numpy(dtype="datetime64[ns]")
+        elif c == "Tloc":
+            arrays[c] = tloc_datetime(pd.to_numeric(s, errors="coerce"))
+        else:
+            arrays[c] = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64)
+    return arrays
+#******************
+def _empty(arrays):
+    """No rows, or no Tloc/SQM values at all."""
+    if not arrays or not len(next(iter(arrays.values()))):
+        return True
+    return any(c in arrays and pd.isna(arrays[c]).all() for c in ("Tloc", "SQM"))
+#******************
+def tloc_datetime(values):
+    """yymmddHHMM numbers -> datetime64[ns] (as strptime '%y%m%d%H%M'); bad -> NaT."""
+    v = np.asarray(values, dtype=np.float64)
+    ok = np.isfinite(v) & (v >= 0)
+    n = np.where(ok, np.round(v), 0).astype(np.int64)
+    yy = n // 10**8
+    parts = pd.DataFrame({"year": np.where(yy < 69, 2000 + yy, 1900 + yy),
+                          "month": n // 10**6 % 100, "day": n // 10**4 % 100,
+                          "hour": n // 100 % 100, "minute": n % 100})
+    t = pd.to_datetime(parts, errors="coerce").to_numpy(dtype="datetime64[ns]")
+    t[~ok | (n >= 10**10)] = np.datetime64("NaT")
+    return t
+#******************
+def cache_key(path, columns, keep, head_skip):
+    """SHA-256 of the workbook bytes and the layout."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            h.update(block)
+    h.update(repr((FORMAT, list(columns), list(keep), head_skip)).encode())
+    return h.hexdigest()
+#******************
+def _load(path):
+    try:
+        with np.load(path) as z:
+            return {name: z[name] for name in z.files}
+    except (OSError, ValueError, zipfile.BadZipFile, zlib.error):
+        return None                              # damaged: parse again
+#******************
+def _save(arrays, path):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+#******************
+def stream_columns(path, columns, names, head_skip=HEAD_SKIP):
+    """The kept columns through read_columns (Tloc decoded); None: unreadable."""
+    raw = read_columns(path, [columns.index(c) for c in names], head_skip)
+    if raw is None:
+        return None
+    arrays = {c: raw[columns.index(c)] for c in names}
+    if "Tloc" in arrays:
+        arrays["Tloc"] = tloc_datetime(arrays["Tloc"])
+    return arrays
+#******************
+def verify(path, columns, keep=KEEP, head_skip=HEAD_SKIP):
+    """True when the streamed columns equal pd.read_excel's (rows with a Tloc)."""
+    names = [c for c in columns if c in keep]
+    frames = []
+    for arrays in (stream_columns(path, columns, names, head_skip),
+                   read_excel_columns(path, columns, names, head_skip)):
+        if arrays is None:
+            return False
+        df = pd.DataFrame({c: arrays[c] for c in names})
+        if "Tloc" in df:
+            df = df[df["Tloc"].notna()]
+        frames.append(df.reset_index(drop=True))
+    return frames[0].equals(frames[1])
+#******************
+def default_cache_dir():
+    """DSN_XLSX_CACHE, else CACHE_DIR."""
+    return os.environ.get("DSN_XLSX_CACHE") or CACHE_DIR
+#******************
+def read_sqm1(path, columns, keep=KEEP, head_skip=HEAD_SKIP, cache_dir=CACHE_DIR):
+    """
+    SQM1 workbook as a frame of the kept columns (sheet order), Tloc as
+    datetime64, the others float64.  cache_dir None: no cache.
+    """
+    names = [c for c in columns if c in keep]
+    cached = None
+    if cache_dir is not None:
+        cached = os.path.join(cache_dir, cache_key(path, columns, keep, head_skip) + ".npz")
+        arrays = _load(cached) if os.path.exists(cached) else None
+        if arrays is not None and set(arrays) == set(names):
+            return pd.DataFrame({c: arrays[c] for c in names})
+    arrays = stream_columns(path, columns, names, head_skip)
+    if arrays is None or _empty(arrays):
+        print("⚠️ DSN_xlsx: streamed sheet empty or short, reading", path, "with pd.read_excel")
+        arrays = read_excel_columns(path, columns, names, head_skip)
+    if cached is not None:
+        _save(arrays, cached)
+    return pd.DataFrame({c: arrays[c] for c in names})
+#******************
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--site", choices=sorted(LAYOUTS), default="Sugarloaf")
+    ap.add_argument("--cache-dir", default=default_cache_dir())
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--verify", action="store_true",
+                    help="compare the streamed columns with pd.read_excel")
+    args = ap.parse_args()
+    bad = 0
+    for path in args.files:
+        if args.verify:
+            ok = verify(path, LAYOUTS[args.site])
+            bad += not ok
+            print(f"{'✅' if ok else '❌'} {path}: streamed reader "
+                  f"{'matches' if ok else 'differs from'} pd.read_excel")
+            continue
+        df = read_sqm1(path, LAYOUTS[args.site],
+                       cache_dir=None if args.no_cache else args.cache_dir)
+        print(f"✅ {path}: {len(df)} rows, {df['Tloc'].min()} .. {df['Tloc'].max()}")
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(main())